@@ -1,11 +1,15 @@
+import random
+import time
 import requests
 import logging
 
 class DatabaseConnection:
-    def _init_(self, url, timeout=10, max_retries=3):
+    def _init_(self, url, timeout=10, max_retries=3, backoff=0.5, max_backoff=10):
         self.url = url
         self.timeout = timeout
         self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
         self.logger = logging.getLogger(__name__)
 
         try:
@@ -24,6 +28,9 @@ class DatabaseConnection:
             except requests.exceptions.RequestException as e:
                 self.logger.warning("Connection attempt failed: %s", e)
                 retry_count += 1
+                if retry_count < self.max_retries:
+                    # Exponential backoff with full jitter, so failing clients do not retry in lockstep
+                    time.sleep(random.uniform(0, min(self.max_backoff, self.backoff * 2 ** retry_count)))
         raise ConnectionError(f"Failed to establish a connection after {self.max_retries} attempts")
 
 # Example usage
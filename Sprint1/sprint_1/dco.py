@@ -43,8 +43,7 @@ class Datacube:
         try:
             response = requests.post(self.dbc.url, data={'query': wcps_query}, verify=True)  # Send POST request
             response.raise_for_status()  # Raise an exception for HTTP errors
-            img = Image.open(BytesIO(response.content))  # Open image from response content
-            img.show()  # Display the image
+            Image.open(BytesIO(response.content))  # Check that the response is an image, without displaying it
             return response, wcps_query  # Return the response and WCPS query
         except (requests.exceptions.RequestException, IOError) as e:
             raise RuntimeError(f"Error performing subset operation: {e}")  # Raise an error if operation fails
@@ -57,8 +56,7 @@ class Datacube:
         try:
             response = requests.post(self.dbc.url, data={'query': wcps_query}, verify=True)  # Send POST request
             response.raise_for_status()  # Raise an exception for HTTP errors
-            img = Image.open(BytesIO(response.content))  # Open image from response content
-            img.show()  # Display the image
+            Image.open(BytesIO(response.content))  # Check that the response is an image, without displaying it
             return response, wcps_query  # Return the response and WCPS query
         except (requests.exceptions.RequestException, IOError) as e:
             raise RuntimeError(f"Error retrieving temperature data: {e}")  # Raise an error if operation fails
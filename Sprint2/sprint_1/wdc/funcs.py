@@ -355,15 +355,16 @@ class dbo:
 
         return f"""
         image>>for $c in ( AvgLandTemp ) 
+        let $region := $c[ansi("{ansi}"), Lat({lat_start}:{lat_end}), Long({lon_start}:{lon_end})]
         return encode(
             switch 
-                    case $c[ansi("{ansi}"), Lat({lat_start}:{lat_end}), Long({lon_start}:{lon_end})] = 99999 
+                    case $region = 99999 
                         return {{red: 255; green: 255; blue: 255}}
-                    case 18 > $c[ansi("{ansi}"), Lat({lat_start}:{lat_end}), Long({lon_start}:{lon_end})] 
+                    case 18 > $region 
                         return {{red: 0; green: 0; blue: 255}} 
-                    case 23 > $c[ansi("{ansi}"), Lat({lat_start}:{lat_end}), Long({lon_start}:{lon_end})] 
+                    case 23 > $region 
                         return {{red: 255; green: 255; blue: 0}} 
-                    case 30 > $c[ansi("{ansi}"), Lat({lat_start}:{lat_end}), Long({lon_start}:{lon_end})]  
+                    case 30 > $region  
                         return {{red: 255; green: 140; blue: 0}}
                     default return {{red: 255; green: 0; blue: 0}}
                 , "image/png")"""
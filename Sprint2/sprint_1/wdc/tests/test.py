@@ -103,15 +103,16 @@ query = db_obj.on_the_fly_colouring(35, 75, -20, 40, "2014-07")
 
 expected_query = """
 image>>for $c in ( AvgLandTemp ) 
+        let $region := $c[ansi("2014-07"), Lat(35:75), Long(-20:40)]
         return encode(
             switch 
-                    case $c[ansi("2014-07"), Lat(35:75), Long(-20:40)] = 99999 
+                    case $region = 99999 
                         return {red: 255; green: 255; blue: 255}
-                    case 18 > $c[ansi("2014-07"), Lat(35:75), Long(-20:40)] 
+                    case 18 > $region 
                         return {red: 0; green: 0; blue: 255} 
-                    case 23 > $c[ansi("2014-07"), Lat(35:75), Long(-20:40)] 
+                    case 23 > $region 
                         return {red: 255; green: 255; blue: 0} 
-                    case 30 > $c[ansi("2014-07"), Lat(35:75), Long(-20:40)]  
+                    case 30 > $region  
                         return {red: 255; green: 140; blue: 0}
                     default return {red: 255; green: 0; blue: 0}
                 , "image/png")
@@ -1,7 +1,8 @@
+import inspect
 import unittest
 
 from wdc.dbc_connection import dbc
-from wdc.dbo_datacube import dbo
+from wdc.dbo_datacube import QUERY_TEMPLATES, dbo
 
 
 class TestDatabaseOperations(unittest.TestCase):
@@ -43,6 +44,136 @@ class TestDatabaseOperations(unittest.TestCase):
         """
         self.assertEqual(query.strip(), expected_query.strip(), "Export data function Test Case Failed")
 
+    def test_compiled_template(self):
+        template = self.db_obj.compile("minimum")
+        self.assertEqual(template.fields, ("lat", "lon", "ansi_start", "ansi_end"))
+        queries = template.bind_many([(53.08, 8.80, "2014-01", "2014-12"), (34.05, -118.25, "2015-01", "2015-12")])
+        self.assertEqual(queries[0], self.db_obj.minimum(53.08, 8.80, "2014-01", "2014-12"))
+        self.assertEqual(queries[1], self.db_obj.minimum(34.05, -118.25, "2015-01", "2015-12"))
+
+    def test_template_with_repeated_fields(self):
+        template = self.db_obj.compile("on_the_fly_colouring")
+        query = template.bind(ansi="2014-07", lat_start=35, lat_end=75, lon_start=-20, lon_end=40)
+        self.assertEqual(query, self.db_obj.on_the_fly_colouring(35, 75, -20, 40, "2014-07"))
+
+    def test_positional_bind_matches_every_method(self):
+        values = {"lat": 53.08, "lon": 8.80, "ansi": "2014-07", "ansi_start": "2014-01",
+                  "ansi_end": "2014-12", "lat_start": 35, "lat_end": 75, "lon_start": -20,
+                  "lon_end": 40, "coverage_name": "Sum", "x_min": 0, "x_max": 10,
+                  "y_min": 0, "y_max": 20, "format": "image/tiff"}
+        for method in QUERY_TEMPLATES:
+            with self.subTest(method=method):
+                names = inspect.signature(getattr(self.db_obj, method)).parameters
+                args = [values[name] for name in names]
+                self.assertEqual(self.db_obj.compile(method).bind(*args), getattr(self.db_obj, method)(*args))
+
+    def test_every_method_generates_the_expected_query(self):
+        expected = {
+            "most_basic_query": ((),
+                "\n"
+                "        for $c in (AvgLandTemp) return 1\n"
+                "        "),
+            "selecting_single_value": ((53.08, 8.8, "2014-07"),
+                "\n"
+                "        for $c in (AvgLandTemp)\n"
+                "        return $c[Lat(53.08), Long(8.8), ansi(\"2014-07\")]"),
+            "transofrm_3d_to_1d_subset": ((53.08, 8.8, "2014-01", "2014-12"),
+                "\n"
+                "        diagram>>for $c in ( AvgLandTemp )\n"
+                "        return encode(\n"
+                "                    $c[Lat(53.08), Long(8.8]), ansi(\"2014-01\":\"2014-12\")]\n"
+                "                , \"text/csv\")"),
+            "transform_3d_to_2d_subset": (("2014-07",),
+                "\n"
+                "        image>>for $c in ( AvgLandTemp )\n"
+                "         return encode(\n"
+                "                       $c[ansi(2014-07)]\n"
+                "                , \"image/png\")"),
+            "celsius_to_kelvin": ((53.08, 8.8, "2014-01", "2014-12"),
+                "\n"
+                "        diagram>>for $c in ( AvgLandTemp ) \n"
+                "         return encode(\n"
+                "                        $c[Lat(53.08), Long(8.8), ansi(\"2014-01\":\"2014-12\")] \n"
+                "                        + 273.15\n"
+                "                , \"text/csv\")"),
+            "minimum": ((53.08, 8.8, "2014-01", "2014-12"),
+                "\n"
+                "        for $c in (AvgLandTemp) \n"
+                "        return \n"
+                "            min($c[Lat(53.08), Long(8.8), ansi(\"2014-01\":\"2014-12\")])"),
+            "maximum": ((53.08, 8.8, "2014-01", "2014-12"),
+                "\n"
+                "        for $c in (AvgLandTemp) \n"
+                "        return \n"
+                "            max($c[Lat(53.08), Long(8.8), ansi(\"2014-01\":\"2014-12\")])"),
+            "average": ((53.08, 8.8, "2014-01", "2014-12"),
+                "\n"
+                "        for $c in (AvgLandTemp) \n"
+                "        return \n"
+                "            avg($c[Lat(53.08), Long(8.8), ansi(\"2014-01\":\"2014-12\")])"),
+            "when_temp_more_than_15": ((53.08, 8.8, "2014-01", "2014-12"),
+                "\n"
+                "        for $c in (AvgLandTemp)\n"
+                "        return count(\n"
+                "                        $c[Lat(53.08), Long(8.8), ansi(\"2014-01\":\"2014-12\")]\n"
+                "                    > 15)"),
+            "on_the_fly_colouring": ((35, 75, -20, 40, "2014-07"),
+                "\n"
+                "        image>>for $c in ( AvgLandTemp ) \n"
+                "        let $region := $c[ansi(\"2014-07\"), Lat(35:75), Long(-20:40)]\n"
+                "        return encode(\n"
+                "            switch \n"
+                "                    case $region = 99999 \n"
+                "                        return {red: 255; green: 255; blue: 255}\n"
+                "                    case 18 > $region \n"
+                "                        return {red: 0; green: 0; blue: 255} \n"
+                "                    case 23 > $region \n"
+                "                        return {red: 255; green: 255; blue: 0} \n"
+                "                    case 30 > $region  \n"
+                "                        return {red: 255; green: 140; blue: 0}\n"
+                "                    default return {red: 255; green: 0; blue: 0}\n"
+                "                , \"image/png\")"),
+            "coverage_constructor": (("Sum", 0, 10, 0, 20),
+                "\n"
+                "        image>>for $c in ( AvgLandTemp ) \n"
+                "        return encode(\n"
+                "                        coverage Sum\n"
+                "                        over $p x(0:10),\n"
+                "                            $q y(0:20)\n"
+                "                        values $p + $q\n"
+                "            , \"image/png\")"),
+            "fetch_metadata": ((),
+                "metadata>>for $c in ( AvgLandTemp ) return encode(properties($c), 'application/json')"),
+            "detect_anomalies": ((53.08, 8.8, "2014-01", "2014-12"),
+                "\n"
+                "        for $c in (AvgLandTemp)\n"
+                "        return\n"
+                "            filter(anomaly_detection($c[Lat(53.08), Long(8.8), ansi(\"2014-01\":\"2014-12\")]), threshold > 3)\n"
+                "        "),
+            "zonal_statistics": ((35, 75, -20, 40, "2014-01", "2014-12"),
+                "\n"
+                "        for $c in (AvgLandTemp)\n"
+                "        return\n"
+                "            stats($c[Lat(35:75), Long(-20:40), ansi(\"2014-01\":\"2014-12\")])\n"
+                "        "),
+            "export_data": (("image/tiff",),
+                "\n"
+                "        for $c in (AvgLandTemp)\n"
+                "        return\n"
+                "            encode($c, \"image/tiff\")\n"
+                "        "),
+        }
+        self.assertEqual(set(expected), set(QUERY_TEMPLATES))
+        for method, (args, query) in expected.items():
+            with self.subTest(method=method):
+                self.assertEqual(getattr(self.db_obj, method)(*args), query)
+
+    def test_colouring_reads_region_once(self):
+        query = self.db_obj.on_the_fly_colouring(35, 75, -20, 40, "2014-07")
+        self.assertEqual(query.count('$c[ansi("2014-07"), Lat(35:75), Long(-20:40)]'), 1)
+        self.assertIn('let $region := $c[ansi("2014-07"), Lat(35:75), Long(-20:40)]', query)
+        self.assertEqual(query.count("$region"), 5)
+
     # Existing test methods...
     # Continue to add existing test methods here.
 
@@ -1,2 +1,3 @@
 from .dbc_connection import *
-from .dbo_datacube import *
\ No newline at end of file
+from .dbo_datacube import *
+from .query_template import *
\ No newline at end of file
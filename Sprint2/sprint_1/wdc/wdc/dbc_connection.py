@@ -1,12 +1,63 @@
+import threading
 import requests
 from requests import HTTPError
-from typing import Union, NewType, BinaryIO
+from requests.adapters import HTTPAdapter
+from typing import Union, NewType, BinaryIO, Dict, List
 
 # Defining image as a type for return typehinting
 Image = NewType('Image', BinaryIO)
 Diagram = NewType('Diagram', BinaryIO)
 
 
+class _PooledAdapter(HTTPAdapter):
+    """
+    An HTTP adapter that counts how many requests every pooled connection
+    served. A connection counts as new whenever its socket changes.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self._stats_lock = threading.Lock()
+        self._hosts = {}
+        self._serial = 0
+        super().__init__(*args, **kwargs)
+
+    def send(self, request, *args, **kwargs):
+        response = super().send(request, *args, **kwargs)
+        # The body has not been read yet, so the connection is still attached
+        connection = getattr(response.raw, "_connection", None)
+        if connection is not None:
+            self._record(connection)
+        return response
+
+    def _record(self, connection):
+        host = f"{connection.host}:{connection.port}"
+        sock = getattr(connection, "sock", None)
+        with self._stats_lock:
+            stats = self._hosts.setdefault(host, {"connections": 0, "requests": 0, "open": {}})
+            stats["requests"] += 1
+            if getattr(connection, "_wdc_sock", None) is not sock:
+                stats["open"].pop(getattr(connection, "_wdc_serial", None), None)
+                self._serial += 1
+                connection._wdc_sock = sock
+                connection._wdc_serial = self._serial
+                stats["connections"] += 1
+                stats["open"][self._serial] = 0
+            else:
+                stats["open"][connection._wdc_serial] += 1
+
+    def stats(self) -> Dict[str, Dict[str, Union[int, List[int]]]]:
+        with self._stats_lock:
+            return {
+                host: {
+                    "connections": stats["connections"],
+                    "requests": stats["requests"],
+                    "reused": stats["requests"] - stats["connections"],
+                    "reuse_per_connection": list(stats["open"].values()),
+                }
+                for host, stats in self._hosts.items()
+            }
+
+
 class dbc:
     """
     A class used to handle connection with the server whose URL was given
@@ -15,13 +66,23 @@ class dbc:
     ----------
     server_url : str
         URL of the server user wants to connect to
+    pool_size : int
+        Maximum number of connections kept open to the server
+    keep_alive : bool
+        Whether connections are kept open and reused between queries
         
     Methods
     -------
-    __init__(self, server_url: str) -> Union[bytes, str]:
+    __init__(self, server_url: str, pool_size: int = 10, keep_alive: bool = True) -> Union[bytes, str]:
         Function that initialises the connection to the server whose url was provided
         and returns either bytes (response.content) or a string (error
         message)
+
+    close(self):
+        Function that closes all pooled connections to the server
+
+    connection_stats(self) -> Dict[str, Dict[str, Union[int, List[int]]]]:
+        Function that reports how often the pooled connections were reused
         
     get_capabilities(self):
         Function that returns all possible coverages user can use
@@ -31,18 +92,73 @@ class dbc:
         the query is either an integer, float, image or diagram
     """
     
-    def __init__(self, server_url: str):
+    def __init__(self, server_url: str, pool_size: int = 10, keep_alive: bool = True):
         """
         Parameters
         ----------
         server_url : str
             URL of the server user wants to connect to
 
+        pool_size : int
+            Maximum number of connections kept open to the server
+
+        keep_alive : bool
+            Whether connections are kept open and reused between queries
+
         possible_coverages : str
             All possible coverages we can use
         """
         self.url = server_url
         self.coverages = ['AvgLandTemp']
+        self.pool_size = pool_size
+        self.keep_alive = keep_alive
+        self._session = None
+        self._session_lock = threading.Lock()
+
+    def __enter__(self) -> "dbc":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _get_session(self) -> requests.Session:
+        """
+        Returns:
+            requests.Session: the pooled session shared by all queries,
+            created on first use
+        """
+        if self._session is None:
+            with self._session_lock:
+                if self._session is None:
+                    session = requests.Session()
+                    adapter = _PooledAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+                    session.mount("http://", adapter)
+                    session.mount("https://", adapter)
+                    if not self.keep_alive:
+                        session.headers["Connection"] = "close"
+                    self._session = session
+        return self._session
+
+    def close(self):
+        """
+        Closes all pooled connections. A new pool is created if the
+        connection is used again afterwards.
+        """
+        with self._session_lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+
+    def connection_stats(self) -> Dict[str, Dict[str, Union[int, List[int]]]]:
+        """
+        Returns:
+            Dict[str, Dict[str, Union[int, List[int]]]]: for every host the
+            number of connections opened, requests sent, requests that reused
+            an open connection and the reuse count of every open connection
+        """
+        if self._session is None:
+            return {}
+        return self._session.get_adapter(self.url).stats()
     
     def get_capabilities(self):
         return self.coverages
@@ -61,7 +177,7 @@ class dbc:
             Attempting to connect to the server whose URL was provided and 
             posting a query
             """
-            response = requests.post(self.url, {'query':query})
+            response = self._get_session().post(self.url, {'query':query})
             response.raise_for_status() # Raises HTTP error
         
         except HTTPError as err:
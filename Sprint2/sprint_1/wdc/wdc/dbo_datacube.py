@@ -1,4 +1,105 @@
 from .dbc_connection import dbc
+from .query_template import QueryTemplate
+
+
+# Query shapes of all dbo methods, compiled once when the module is imported.
+# The fields are ordered like the arguments of the methods, so compiled
+# templates bind positional values the way the methods do
+QUERY_TEMPLATES = {
+    "most_basic_query": QueryTemplate("""
+        for $c in ({coverage}) return 1
+        """, fields=("coverage",)),
+
+    "selecting_single_value": QueryTemplate("""
+        for $c in ({coverage})
+        return $c[Lat({lat}), Long({lon}), ansi("{ansi}")]""", fields=("coverage", "lat", "lon", "ansi")),
+
+    "transofrm_3d_to_1d_subset": QueryTemplate("""
+        diagram>>for $c in ( {coverage} )
+        return encode(
+                    $c[Lat({lat}), Long({lon}]), ansi("{ansi_start}":"{ansi_end}")]
+                , "text/csv")""", fields=("coverage", "lat", "lon", "ansi_start", "ansi_end")),
+
+    "transform_3d_to_2d_subset": QueryTemplate("""
+        image>>for $c in ( {coverage} )
+         return encode(
+                       $c[ansi({ansi})]
+                , "image/png")""", fields=("coverage", "ansi")),
+
+    "celsius_to_kelvin": QueryTemplate("""
+        diagram>>for $c in ( {coverage} ) 
+         return encode(
+                        $c[Lat({lat}), Long({lon}), ansi("{ansi_start}":"{ansi_end}")] 
+                        + 273.15
+                , "text/csv")""", fields=("coverage", "lat", "lon", "ansi_start", "ansi_end")),
+
+    "minimum": QueryTemplate("""
+        for $c in ({coverage}) 
+        return 
+            min($c[Lat({lat}), Long({lon}), ansi("{ansi_start}":"{ansi_end}")])""", fields=("coverage", "lat", "lon", "ansi_start", "ansi_end")),
+
+    "maximum": QueryTemplate("""
+        for $c in ({coverage}) 
+        return 
+            max($c[Lat({lat}), Long({lon}), ansi("{ansi_start}":"{ansi_end}")])""", fields=("coverage", "lat", "lon", "ansi_start", "ansi_end")),
+
+    "average": QueryTemplate("""
+        for $c in ({coverage}) 
+        return 
+            avg($c[Lat({lat}), Long({lon}), ansi("{ansi_start}":"{ansi_end}")])""", fields=("coverage", "lat", "lon", "ansi_start", "ansi_end")),
+
+    "when_temp_more_than_15": QueryTemplate("""
+        for $c in (AvgLandTemp)
+        return count(
+                        $c[Lat({lat}), Long({lon}), ansi("{ansi_start}":"{ansi_end}")]
+                    > 15)""", fields=("lat", "lon", "ansi_start", "ansi_end")),
+
+    "on_the_fly_colouring": QueryTemplate("""
+        image>>for $c in ( AvgLandTemp ) 
+        let $region := $c[ansi("{ansi}"), Lat({lat_start}:{lat_end}), Long({lon_start}:{lon_end})]
+        return encode(
+            switch 
+                    case $region = 99999 
+                        return {{red: 255; green: 255; blue: 255}}
+                    case 18 > $region 
+                        return {{red: 0; green: 0; blue: 255}} 
+                    case 23 > $region 
+                        return {{red: 255; green: 255; blue: 0}} 
+                    case 30 > $region  
+                        return {{red: 255; green: 140; blue: 0}}
+                    default return {{red: 255; green: 0; blue: 0}}
+                , "image/png")""", fields=("lat_start", "lat_end", "lon_start", "lon_end", "ansi")),
+
+    "coverage_constructor": QueryTemplate("""
+        image>>for $c in ( {coverage} ) 
+        return encode(
+                        coverage {coverage_name}
+                        over $p x({x_min}:{x_max}),
+                            $q y({y_min}:{y_max})
+                        values $p + $q
+            , "image/png")""", fields=("coverage", "coverage_name", "x_min", "x_max", "y_min", "y_max")),
+
+    "fetch_metadata": QueryTemplate("metadata>>for $c in ( {coverage} ) return encode(properties($c), 'application/json')", fields=("coverage",)),
+
+    "detect_anomalies": QueryTemplate("""
+        for $c in ({coverage})
+        return
+            filter(anomaly_detection($c[Lat({lat}), Long({lon}), ansi("{ansi_start}":"{ansi_end}")]), threshold > 3)
+        """, fields=("coverage", "lat", "lon", "ansi_start", "ansi_end")),
+
+    "zonal_statistics": QueryTemplate("""
+        for $c in ({coverage})
+        return
+            stats($c[Lat({lat_start}:{lat_end}), Long({lon_start}:{lon_end}), ansi("{ansi_start}":"{ansi_end}")])
+        """, fields=("coverage", "lat_start", "lat_end", "lon_start", "lon_end", "ansi_start", "ansi_end")),
+
+    "export_data": QueryTemplate("""
+        for $c in ({coverage})
+        return
+            encode($c, "{format}")
+        """, fields=("coverage", "format")),
+}
+
 
 class dbo:
     """
@@ -71,6 +172,10 @@ class dbo:
     export_data(self, format: str = 'csv') -> str:
         Generates a query to export data in a specified format.
 
+    compile(self, method: str) -> QueryTemplate:
+        Returns the compiled query shape of a method, bound to the coverage,
+        for generating many queries of that shape in bulk.
+
     Parameters
     ----------
     lat : float
@@ -90,6 +195,7 @@ class dbo:
         """
         self.connection = connection
         self.coverage = coverage if coverage in self.connection.get_capabilities() else None
+        self._compiled = {}
 
         if self.coverage is None:
             raise ValueError("Invalid coverage. Please provide again")
@@ -104,9 +210,7 @@ class dbo:
             str: the final query
         """
         
-        return f"""
-        for $c in ({self.coverage}) return 1
-        """
+        return QUERY_TEMPLATES["most_basic_query"].bind(coverage=self.coverage)
 
 
     def selecting_single_value(self, lat: float, lon: float, ansi: str) -> str:
@@ -120,9 +224,8 @@ class dbo:
             str: the final query
         """
         
-        return f"""
-        for $c in ({self.coverage})
-        return $c[Lat({lat}), Long({lon}), ansi("{ansi}")]"""
+        return QUERY_TEMPLATES["selecting_single_value"].bind(coverage=self.coverage, lat=lat,
+                                                              lon=lon, ansi=ansi)
         
         
     def transofrm_3d_to_1d_subset(self, lat: float, lon: float, ansi_start: str, ansi_end: str) -> str:
@@ -140,11 +243,9 @@ class dbo:
             str: the final query
         """
         
-        return f"""
-        diagram>>for $c in ( {self.coverage} )
-        return encode(
-                    $c[Lat({lat}), Long({lon}]), ansi("{ansi_start}":"{ansi_end}")]
-                , "text/csv")"""
+        return QUERY_TEMPLATES["transofrm_3d_to_1d_subset"].bind(coverage=self.coverage, lat=lat,
+                                                                 lon=lon, ansi_start=ansi_start,
+                                                                 ansi_end=ansi_end)
 
 
     def transform_3d_to_2d_subset(self, ansi: str) -> str:
@@ -156,11 +257,7 @@ class dbo:
             str: the final query
         """
         
-        return f"""
-        image>>for $c in ( {self.coverage} )
-         return encode(
-                       $c[ansi({ansi})]
-                , "image/png")"""
+        return QUERY_TEMPLATES["transform_3d_to_2d_subset"].bind(coverage=self.coverage, ansi=ansi)
 
 
     def celsius_to_kelvin(self, lat: float, lon: float, ansi_start: str, ansi_end: str) -> str:
@@ -175,12 +272,8 @@ class dbo:
             str: the final query
         """
         
-        return f"""
-        diagram>>for $c in ( {self.coverage} ) 
-         return encode(
-                        $c[Lat({lat}), Long({lon}), ansi("{ansi_start}":"{ansi_end}")] 
-                        + 273.15
-                , "text/csv")"""
+        return QUERY_TEMPLATES["celsius_to_kelvin"].bind(coverage=self.coverage, lat=lat, lon=lon,
+                                                         ansi_start=ansi_start, ansi_end=ansi_end)
 
 
     def minimum(self, lat: float, lon: float, ansi_start: str, ansi_end: str) -> str:
@@ -195,10 +288,8 @@ class dbo:
             str: the final query
         """
 
-        return f"""
-        for $c in ({self.coverage}) 
-        return 
-            min($c[Lat({lat}), Long({lon}), ansi("{ansi_start}":"{ansi_end}")])"""
+        return QUERY_TEMPLATES["minimum"].bind(coverage=self.coverage, lat=lat, lon=lon,
+                                               ansi_start=ansi_start, ansi_end=ansi_end)
 
 
     def maximum(self, lat: float, lon: float, ansi_start: str, ansi_end: str) -> str:
@@ -213,10 +304,8 @@ class dbo:
             str: the final query
         """
         
-        return f"""
-        for $c in ({self.coverage}) 
-        return 
-            max($c[Lat({lat}), Long({lon}), ansi("{ansi_start}":"{ansi_end}")])"""
+        return QUERY_TEMPLATES["maximum"].bind(coverage=self.coverage, lat=lat, lon=lon,
+                                               ansi_start=ansi_start, ansi_end=ansi_end)
 
 
     def average(self, lat: float, lon: float, ansi_start: str, ansi_end: str) -> str:
@@ -231,10 +320,8 @@ class dbo:
             str: the final query
         """
         
-        return f"""
-        for $c in ({self.coverage}) 
-        return 
-            avg($c[Lat({lat}), Long({lon}), ansi("{ansi_start}":"{ansi_end}")])"""
+        return QUERY_TEMPLATES["average"].bind(coverage=self.coverage, lat=lat, lon=lon,
+                                               ansi_start=ansi_start, ansi_end=ansi_end)
 
 
     def when_temp_more_than_15(self, lat: float, lon: float, ansi_start: str, ansi_end: str) -> str:
@@ -249,11 +336,9 @@ class dbo:
             str: the final query
         """
         
-        return f"""
-        for $c in (AvgLandTemp)
-        return count(
-                        $c[Lat({lat}), Long({lon}), ansi("{ansi_start}":"{ansi_end}")]
-                    > 15)"""
+        return QUERY_TEMPLATES["when_temp_more_than_15"].bind(lat=lat, lon=lon,
+                                                              ansi_start=ansi_start,
+                                                              ansi_end=ansi_end)
 
 
     def on_the_fly_colouring(self, lat_start: float, lat_end: float, 
@@ -270,20 +355,9 @@ class dbo:
             str: the final query
         """
         
-        return f"""
-        image>>for $c in ( AvgLandTemp ) 
-        return encode(
-            switch 
-                    case $c[ansi("{ansi}"), Lat({lat_start}:{lat_end}), Long({lon_start}:{lon_end})] = 99999 
-                        return {{red: 255; green: 255; blue: 255}}
-                    case 18 > $c[ansi("{ansi}"), Lat({lat_start}:{lat_end}), Long({lon_start}:{lon_end})] 
-                        return {{red: 0; green: 0; blue: 255}} 
-                    case 23 > $c[ansi("{ansi}"), Lat({lat_start}:{lat_end}), Long({lon_start}:{lon_end})] 
-                        return {{red: 255; green: 255; blue: 0}} 
-                    case 30 > $c[ansi("{ansi}"), Lat({lat_start}:{lat_end}), Long({lon_start}:{lon_end})]  
-                        return {{red: 255; green: 140; blue: 0}}
-                    default return {{red: 255; green: 0; blue: 0}}
-                , "image/png")"""
+        return QUERY_TEMPLATES["on_the_fly_colouring"].bind(ansi=ansi, lat_start=lat_start,
+                                                            lat_end=lat_end, lon_start=lon_start,
+                                                            lon_end=lon_end)
 
 
     def coverage_constructor(self, coverage_name: str, x_min: float, 
@@ -300,14 +374,9 @@ class dbo:
             str: the final query
         """
         
-        return f"""
-        image>>for $c in ( {self.coverage} ) 
-        return encode(
-                        coverage {coverage_name}
-                        over $p x({x_min}:{x_max}),
-                            $q y({y_min}:{y_max})
-                        values $p + $q
-            , "image/png")"""
+        return QUERY_TEMPLATES["coverage_constructor"].bind(coverage=self.coverage,
+                                                            coverage_name=coverage_name, x_min=x_min,
+                                                            x_max=x_max, y_min=y_min, y_max=y_max)
 
 
     def fetch_metadata(self) -> str:
@@ -317,7 +386,7 @@ class dbo:
         Returns:
             str: Query for fetching dataset metadata.
         """
-        return f"metadata>>for $c in ( {self.coverage} ) return encode(properties($c), 'application/json')"
+        return QUERY_TEMPLATES["fetch_metadata"].bind(coverage=self.coverage)
 
 
     def detect_anomalies(self, lat: float, lon: float, ansi_start: str, ansi_end: str) -> str:
@@ -333,11 +402,8 @@ class dbo:
         Returns:
             str: the final query for detecting anomalies.
         """
-        return f"""
-        for $c in ({self.coverage})
-        return
-            filter(anomaly_detection($c[Lat({lat}), Long({lon}), ansi("{ansi_start}":"{ansi_end}")]), threshold > 3)
-        """
+        return QUERY_TEMPLATES["detect_anomalies"].bind(coverage=self.coverage, lat=lat, lon=lon,
+                                                        ansi_start=ansi_start, ansi_end=ansi_end)
 
 
     def zonal_statistics(self, lat_start: float, lat_end: float, lon_start: float, lon_end: float, ansi_start: str,
@@ -356,11 +422,10 @@ class dbo:
         Returns:
             str: The final query for zonal statistics.
         """
-        return f"""
-        for $c in ({self.coverage})
-        return
-            stats($c[Lat({lat_start}:{lat_end}), Long({lon_start}:{lon_end}), ansi("{ansi_start}":"{ansi_end}")])
-        """
+        return QUERY_TEMPLATES["zonal_statistics"].bind(coverage=self.coverage, lat_start=lat_start,
+                                                        lat_end=lat_end, lon_start=lon_start,
+                                                        lon_end=lon_end, ansi_start=ansi_start,
+                                                        ansi_end=ansi_end)
 
 
     def export_data(self, format: str = 'csv') -> str:
@@ -373,8 +438,32 @@ class dbo:
         Returns:
             str: The final query to export data.
         """
-        return f"""
-        for $c in ({self.coverage})
-        return
-            encode($c, "{format}")
+        return QUERY_TEMPLATES["export_data"].bind(coverage=self.coverage, format=format)
+
+
+    def compile(self, method: str) -> QueryTemplate:
         """
+        Returns the compiled query shape of a method with the coverage
+        already bound. Its remaining fields are the arguments of the method,
+        in the same order, so many queries can be generated at once with
+        bind_many.
+
+        Example:
+            template = db_obj.compile("minimum")
+            queries = template.bind_many(zip(lats, lons, ansi_starts, ansi_ends))
+
+        Args:
+            method (str): name of the dbo method, e.g. "minimum"
+
+        Returns:
+            QueryTemplate: the compiled query shape
+        """
+        if method not in QUERY_TEMPLATES:
+            raise ValueError(f"Unknown query method: {method}. Please select one of {list(QUERY_TEMPLATES)}")
+
+        if method not in self._compiled:
+            template = QUERY_TEMPLATES[method]
+            if "coverage" in template.fields:
+                template = template.partial(coverage=self.coverage)
+            self._compiled[method] = template
+        return self._compiled[method]
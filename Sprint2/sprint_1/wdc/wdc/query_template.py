@@ -0,0 +1,182 @@
+from string import Formatter
+from typing import Any, Dict, Iterable, Iterator, List, Sequence, Tuple, Union
+
+
+class QueryTemplate:
+    """
+    A class of a query shape that is parsed once and then bound to values
+    many times
+
+    The template is written like the body of an f-string, with named fields
+    such as {lat} and doubled braces for literal ones. It is compiled into a
+    single %-format string, so binding a row of values is one C-level
+    formatting call instead of re-rendering the whole query.
+
+
+    Attributes
+    ---------
+    text : str
+        The template the query shape was compiled from
+    fields : Tuple[str, ...]
+        The names of the fields, in the order positional values are bound
+        to them: the given order, or else the order they first appear in
+
+
+    Methods
+    -------
+    __init__(self, text: str, fields: Sequence[str] = None):
+        Compiles the template
+
+    bind(self, *values, **named_values) -> str:
+        Returns the query for one set of values
+
+    bind_many(self, rows: Iterable[Union[Sequence, Dict[str, Any]]]) -> List[str]:
+        Returns the queries for many sets of values
+
+    iter_bind(self, rows: Iterable[Union[Sequence, Dict[str, Any]]]) -> Iterator[str]:
+        Yields the queries for many sets of values one by one
+
+    partial(self, **named_values) -> QueryTemplate:
+        Returns a new template with some fields already bound
+    """
+
+
+    def __init__(self, text: str, fields: Sequence[str] = None):
+        """
+        Args:
+            text (str): the query shape, with named fields in braces
+            fields (Sequence[str], optional): the order of the fields for
+                positional values, e.g. the arguments of the method the
+                template belongs to. Defaults to the order they first appear in
+
+        Raises:
+            ValueError: if a field is positional or uses a format spec or conversion,
+                or if fields does not name every field of the template exactly once
+        """
+        self.text = text
+
+        found = []
+        chunks = []
+        for literal, field, format_spec, conversion in Formatter().parse(text):
+            chunks.append(literal.replace("%", "%%"))
+            if field is None:
+                continue
+            if not field or field.isdigit() or format_spec or conversion:
+                raise ValueError(f"Unsupported template field: {{{field}}}. Please only use named fields")
+            found.append(field)
+            chunks.append("%s")
+
+        if fields is None:
+            fields = list(dict.fromkeys(found))
+        elif len(set(fields)) != len(fields) or set(fields) != set(found):
+            raise ValueError(f"The fields {tuple(fields)} do not match the template fields {tuple(dict.fromkeys(found))}")
+        positions = [list(fields).index(field) for field in found]
+
+        self.fields: Tuple[str, ...] = tuple(fields)
+        self._positions = tuple(positions)
+        # The field name behind every %s of the format string
+        self._order = tuple(fields[position] for position in positions)
+        # Rows can be passed to the format string unchanged if every field is used once, in order
+        self._in_order = self._positions == tuple(range(len(fields)))
+        self._format = "".join(chunks)
+
+
+    def __repr__(self) -> str:
+        return f"QueryTemplate(fields={self.fields})"
+
+
+    def _arrange(self, row: Union[Sequence, Dict[str, Any]]) -> tuple:
+        """
+        Args:
+            row (Union[Sequence, Dict[str, Any]]): values in the order of the
+                fields, or a mapping from field names to values
+
+        Returns:
+            tuple: the values in the order the format string expects
+        """
+        if isinstance(row, dict):
+            row = tuple(row[field] for field in self.fields)
+        elif len(row) != len(self.fields):
+            raise ValueError(f"Expected {len(self.fields)} values for fields {self.fields}, got {len(row)}")
+
+        if self._in_order:
+            return tuple(row)
+        return tuple(row[position] for position in self._positions)
+
+
+    def bind(self, *values, **named_values) -> str:
+        """
+        Args:
+            *values: values of the fields, in the order of the fields
+            **named_values: values of the fields, by name
+
+        Returns:
+            str: the final query
+        """
+        if values and named_values:
+            raise ValueError("Please bind the fields either by position or by name")
+        if not named_values:
+            if self._in_order and len(values) == len(self.fields):
+                return self._format % values
+            return self._format % self._arrange(values)
+
+        try:
+            return self._format % tuple([named_values[field] for field in self._order])
+        except KeyError as err:
+            raise ValueError(f"Missing value for template field {err}") from None
+
+
+    def iter_bind(self, rows: Iterable[Union[Sequence, Dict[str, Any]]]) -> Iterator[str]:
+        """
+        Args:
+            rows (Iterable[Union[Sequence, Dict[str, Any]]]): one tuple of
+                values (in the order of the fields) or mapping per query
+
+        Yields:
+            str: the final query of every row
+        """
+        template = self._format
+        if self._in_order:
+            # Fast path: tuples are formatted as they are, without rearranging them
+            for row in rows:
+                yield template % (row if type(row) is tuple and len(row) == len(self.fields) else self._arrange(row))
+        else:
+            for row in rows:
+                yield template % self._arrange(row)
+
+
+    def bind_many(self, rows: Iterable[Union[Sequence, Dict[str, Any]]]) -> List[str]:
+        """
+        Args:
+            rows (Iterable[Union[Sequence, Dict[str, Any]]]): one tuple of
+                values (in the order of the fields) or mapping per query,
+                e.g. zip(lats, lons, ansi_starts, ansi_ends)
+
+        Returns:
+            List[str]: the final queries, in the order of the rows
+        """
+        return list(self.iter_bind(rows))
+
+
+    def partial(self, **named_values) -> "QueryTemplate":
+        """
+        Args:
+            **named_values: values of the fields to bind now
+
+        Returns:
+            QueryTemplate: a template whose remaining fields are the ones not bound
+        """
+        unknown = set(named_values) - set(self.fields)
+        if unknown:
+            raise ValueError(f"Unknown template fields: {sorted(unknown)}")
+
+        chunks = []
+        for literal, field, _, _ in Formatter().parse(self.text):
+            chunks.append(literal.replace("{", "{{").replace("}", "}}"))
+            if field is None:
+                continue
+            if field in named_values:
+                chunks.append(str(named_values[field]).replace("{", "{{").replace("}", "}}"))
+            else:
+                chunks.append(f"{{{field}}}")
+        return QueryTemplate("".join(chunks), fields=[field for field in self.fields if field not in named_values])
@@ -0,0 +1,247 @@
+"""
+Benchmarks of query generation, transport and decoding.
+
+Every benchmark runs offline against a stand-in WCPS server on localhost,
+so results only depend on the machine and can be compared across releases.
+The results are written as JSON:
+
+    python benchmarks.py --output results.json
+    python benchmarks.py --quick --only query_generation,decode_csv
+"""
+import argparse
+import importlib.util
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from wdc import ImageResult, Query, Params, dbc, decode_csv, encode_csv
+from wdc.Server import StandInServer
+
+# Bumped whenever the layout of the results changes
+RESULTS_VERSION = 1
+
+# The Sprint 2 package is also named wdc, so it is loaded under another name
+SPRINT2_PACKAGE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                               "..", "Sprint2", "sprint_1", "wdc", "wdc")
+
+def _rate(function, number: int, repeat: int = 3) -> float:
+    """
+    Returns the best number of calls per second of `repeat` runs of
+    `number` calls.
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        best = min(best, time.perf_counter() - start)
+    return number / best
+
+
+def _percentiles(seconds: list) -> dict:
+    milliseconds = np.asarray(seconds) * 1000
+    return {
+        "count": int(milliseconds.size),
+        "mean_ms": float(milliseconds.mean()),
+        "p50_ms": float(np.percentile(milliseconds, 50)),
+        "p90_ms": float(np.percentile(milliseconds, 90)),
+        "p99_ms": float(np.percentile(milliseconds, 99)),
+        "max_ms": float(milliseconds.max()),
+    }
+
+
+def _query(query_type: str, params: list) -> Query:
+    # Setting the coverage after construction skips the lookup in the server's catalog
+    query = Query(query_type=query_type, params=params)
+    query.coverage = "AvgLandTemp"
+    return query
+
+
+def bench_query_generation(quick: bool) -> dict:
+    number = 2000 if quick else 20000
+    params = [Params("ansi", "2014-01", "2014-12"), Params("Lat", 53.08), Params("Long", 8.80)]
+    query = _query("celsius_to_kelvin", params)
+
+    def fresh():
+        str(_query("celsius_to_kelvin", params))
+
+    def new_params():
+        query.params = params
+        str(query)
+
+    return {
+        "new_query_per_second": _rate(fresh, number),
+        "new_params_per_second": _rate(new_params, number),
+        "cached_per_second": _rate(lambda: str(query), number),
+    }
+
+
+def _load_sprint2():
+    spec = importlib.util.spec_from_file_location(
+        "sprint2_wdc", os.path.join(SPRINT2_PACKAGE, "__init__.py"),
+        submodule_search_locations=[SPRINT2_PACKAGE])
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def bench_dbo_generation(quick: bool) -> dict:
+    try:
+        sprint2 = _load_sprint2()
+    except (ImportError, OSError) as err:
+        return {"skipped": f"The Sprint 2 package could not be loaded: {err}"}
+
+    number = 2000 if quick else 20000
+    datacube = sprint2.dbo(sprint2.dbc("http://127.0.0.1/rasdaman/ows"), "AvgLandTemp")
+    return {
+        "celsius_to_kelvin_per_second": _rate(
+            lambda: datacube.celsius_to_kelvin(53.08, 8.80, "2014-01", "2014-12"), number),
+        "on_the_fly_colouring_per_second": _rate(
+            lambda: datacube.on_the_fly_colouring(45, 56, 0, 6, "2014-07"), number),
+    }
+
+
+def bench_request_latency(quick: bool) -> dict:
+    number = 200 if quick else 2000
+    with StandInServer(payload_size=18) as server, dbc(server.url) as conn:
+        conn.execute_query_bytes("warm up")
+        seconds = []
+        for index in range(number):
+            start = time.perf_counter()
+            conn.execute_query_bytes(f"for $c in ( AvgLandTemp ) return {index}")
+            seconds.append(time.perf_counter() - start)
+    return _percentiles(seconds)
+
+
+def bench_concurrency_scaling(quick: bool) -> dict:
+    number = 64 if quick else 256
+    latency = 0.01
+    results = {"server_latency_ms": latency * 1000, "queries": number}
+    with StandInServer(latency=latency, payload_size=1) as server:
+        for workers in (1, 2, 4, 8, 16):
+            queries = [f"for $c in ( AvgLandTemp ) return {index}" for index in range(number)]
+            with dbc(server.url, pool_size=workers, single_flight=False) as conn:
+                start = time.perf_counter()
+                conn.execute_many(queries, workers=workers)
+                elapsed = time.perf_counter() - start
+            results[f"workers_{workers}_queries_per_second"] = number / elapsed
+    return results
+
+
+def bench_decode_csv(quick: bool) -> dict:
+    size = 200 if quick else 1000
+    values = np.random.default_rng(0).uniform(-40, 40, (size, size)).round(2)
+    payload = encode_csv(values)
+    number = 3 if quick else 10
+    rate = _rate(lambda: decode_csv(payload), number)
+    return {
+        "cells": int(values.size),
+        "payload_bytes": len(payload),
+        "decodes_per_second": rate,
+        "megabytes_per_second": rate * len(payload) / 1e6,
+    }
+
+
+def bench_decode_png(quick: bool) -> dict:
+    try:
+        from PIL import Image
+    except ImportError:
+        return {"skipped": "Pillow is not installed"}
+
+    size = 256 if quick else 1024
+    pixels = np.random.default_rng(0).integers(0, 256, (size, size, 3), dtype=np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, format="PNG")
+    payload = buffer.getvalue()
+    number = 5 if quick else 20
+    rate = _rate(lambda: ImageResult(payload).to_array(), number)
+    return {
+        "pixels": size * size,
+        "payload_bytes": len(payload),
+        "decodes_per_second": rate,
+        "megapixels_per_second": rate * size * size / 1e6,
+        "previews_per_second": _rate(lambda: ImageResult(payload).to_array(reduce=4), number),
+    }
+
+
+BENCHMARKS = {
+    "query_generation": bench_query_generation,
+    "dbo_generation": bench_dbo_generation,
+    "request_latency": bench_request_latency,
+    "concurrency_scaling": bench_concurrency_scaling,
+    "decode_csv": bench_decode_csv,
+    "decode_png": bench_decode_png,
+}
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(names: list = None, quick: bool = False) -> dict:
+    """
+    Runs the benchmarks and returns their results with the environment
+    they ran in.
+
+    Parameters:
+    -----------
+    names : list, optional
+        The benchmarks to run. Defaults to all of them.
+    quick : bool, optional
+        Whether to run fewer iterations, e.g. as a smoke test.
+        Defaults to False.
+
+    Returns:
+    --------
+    dict
+        The results, ready to be written as JSON.
+    """
+    names = list(BENCHMARKS) if names is None else names
+    unknown = [name for name in names if name not in BENCHMARKS]
+    if unknown:
+        raise ValueError(f"Error. Unknown benchmarks: {', '.join(unknown)}")
+
+    return {
+        "version": RESULTS_VERSION,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "commit": _git_commit(),
+        "quick": quick,
+        "environment": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+        },
+        "benchmarks": {name: BENCHMARKS[name](quick) for name in names},
+    }
+
+
+def main(argv: list = None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--output", help="Write the JSON results to this file instead of stdout")
+    parser.add_argument("--only", help="Comma separated benchmarks to run: " + ", ".join(BENCHMARKS))
+    parser.add_argument("--quick", action="store_true", help="Run fewer iterations")
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.only.split(",") if args.only else None, quick=args.quick)
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as output:
+            output.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
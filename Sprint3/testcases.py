@@ -1,6 +1,31 @@
+import asyncio
+import contextlib
+import importlib.util
+import io
+import logging
+import os
+import tempfile
+import threading
+import time
 import unittest
+from unittest import mock
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import parse_qs
 from wdc.Connection import dbc
-from wdc import Query, Params
+from wdc import Query, Params, CoverageCatalog, QueryError, ResultCache, FusedQuery, decode_result
+from wdc import Datacube, Lat, Long, ansi, optimize, switch
+from wdc import LocalCoverage, LocalEngine, parse_wcps, compile_wcps
+from wdc import AxisIndex, CoverageStore, AxisGrid, plan_tiles, fetch_tiles
+from wdc import partial_wcps, combine_partials
+from wdc import RetryPolicy, CircuitBreaker, SingleFlight, deadline
+from wdc import TransientQueryError, InvalidQueryError, CircuitOpenError, DeadlineExceededError
+from wdc import StandInServer
+from wdc import collect_spans, span, start_span
+from wdc import Histogram, MetricsRegistry
+from wdc import emit, set_sampling
+from wdc import ImageResult
+import numpy as np
+import requests
 
 server_url = "https://ows.rasdaman.org/rasdaman/ows"
 db_conn = dbc(server_url=server_url)
@@ -107,5 +132,811 @@ $c[ansi("2014-01":"2014-12"), Lat(53.08), Long(8.8)]
         expected_result = b'7'
         self.assertEqual(result, expected_result, "Test case failed")
 
+class TestQueryCaching(unittest.TestCase):
+    def setUp(self):
+        # Assigning the coverage directly skips the validation against the server
+        self.query = Query(query_type="min")
+        self.query.coverage = "AvgLandTemp"
+        self.query.set_params([Params("ansi", "2014-01", "2014-12")])
+
+    def testTextIsReusedUntilChanged(self):
+        first = self.query.get_wcps()
+        self.assertIs(self.query.get_wcps(), first)
+        self.query.set_params([Params("ansi", "2015-01", "2015-12")])
+        self.assertIn('ansi("2015-01":"2015-12")', self.query.get_wcps())
+        self.query.set_query_type("max")
+        self.assertIn("max($c[", self.query.get_wcps())
+
+    def testReturnTypeIsNotMutated(self):
+        self.query.set_query_type("transform_3d_to_1d_subset")
+        self.assertIn('"text/csv"', str(self.query))
+        self.assertIsNone(self.query.return_type)
+        self.assertEqual(self.query.get_return_type(), "text/csv")
+
+class TestFusion(unittest.TestCase):
+    def makeQuery(self, query_type, *params):
+        query = Query(query_type=query_type, params=list(params))
+        query.coverage = "AvgLandTemp"
+        return query
+
+    def testFusedQueryAndSplit(self):
+        single = self.makeQuery("selecting_single_value", Params("ansi", "2014-07"), Params("Lat", 53.08), Params("Long", 8.80))
+        count = self.makeQuery("when_temp_more_than_15", Params("ansi", "2014-01", "2014-12"), Params("Lat", 53.08), Params("Long", 8.80))
+        fused = FusedQuery([single, count])
+        expected_result = '''diagram>>for $c in ( AvgLandTemp )
+ return encode(
+coverage fused over $i i(0:1)
+values switch
+ case $i = 0 return $c[ansi("2014-07"), Lat(53.08), Long(8.8)]
+ default return count(
+$c[ansi("2014-01":"2014-12"), Lat(53.08), Long(8.8)]
+> 15)
+, "text/csv")'''
+        self.assertEqual(fused.get_wcps(), expected_result)
+        self.assertEqual(fused.split(b"25.984251,7"), [25.984251, 7])
+
+    def testRangesCannotBeFused(self):
+        series = self.makeQuery("transform_3d_to_1d_subset", Params("ansi", "2014-01", "2014-12"))
+        with self.assertRaises(ValueError):
+            FusedQuery([series])
+
+class _FixedResultConnection:
+    # Stands in for dbc, recording the queries instead of sending them
+    def __init__(self, result):
+        self.result = result
+        self.queries = []
+
+    def execute_query_bytes(self, query):
+        self.queries.append(str(query))
+        return self.result
+
+class TestDatacube(unittest.TestCase):
+    def setUp(self):
+        self.cube = Datacube("AvgLandTemp", axes=("ansi", "Lat", "Long"))
+
+    def testPipelineIsOneQuery(self):
+        kelvin = self.cube[ansi("2014-01", "2014-12"), Lat(53.08), Long(8.80)] + 273.15
+        self.assertEqual(kelvin.axes, ("ansi",))
+        self.assertEqual(kelvin.get_wcps(),
+                         'for $c in ( AvgLandTemp )\n return encode($c[ansi("2014-01":"2014-12"), '
+                         'Lat(53.08), Long(8.8)] + 273.15, "text/csv")')
+        self.assertEqual(kelvin.max().get_wcps(),
+                         'for $c in ( AvgLandTemp )\n return max($c[ansi("2014-01":"2014-12"), '
+                         'Lat(53.08), Long(8.8)] + 273.15)')
+
+    def testScaleEncodeAndSeveralCoverages(self):
+        other = Datacube("AvgTemperatureColorScaled")
+        diff = (self.cube.subset(Lat=(0, 10)) - other[Lat(0, 10)]).scale(Long=2)
+        self.assertEqual(str(diff.encode("image/png")),
+                         'for $c in ( AvgLandTemp ), $d in ( AvgTemperatureColorScaled )\n'
+                         ' return encode(scale($c[Lat(0:10)] - $d[Lat(0:10)], { Long(2) }), "image/png")')
+        with self.assertRaises(ValueError):
+            self.cube.subset(Time=1)
+        with self.assertRaises(ValueError):
+            self.cube.encode("image/png") + 1
+
+    def testNothingRunsBeforeCompute(self):
+        series = self.cube[ansi("2014-01", "2014-02"), Lat(53.08), Long(8.80)]
+        with self.assertRaises(ValueError):
+            series.compute()
+        conn = _FixedResultConnection(b"{1,2},{3,4}")
+        result = (series * 2).compute(conn)
+        self.assertEqual(result.shape, (2, 2))
+        self.assertEqual(len(conn.queries), 1)
+        self.assertEqual(int((series > 15).count().compute(_FixedResultConnection(b"7"))), 7)
+
+class TestOptimizer(unittest.TestCase):
+    def setUp(self):
+        self.cube = Datacube("AvgLandTemp", axes=("ansi", "Lat", "Long"))
+
+    def testSubsetIsPushedBelowScaleAndArithmetic(self):
+        pipeline = (self.cube.scale(0.5) + 273.15)[Lat(35, 75), ansi("2014-07")]
+        self.assertEqual(pipeline.get_wcps(),
+                         'for $c in ( AvgLandTemp )\n return encode(scale($c[Lat(35:75), ansi("2014-07")], 0.5)'
+                         ' + 273.15, "text/csv")')
+        # Scaling to a target extent depends on the input size, so that subset stays on top
+        extent = self.cube.scale(Lat=(0, 99))[Lat(35, 75), Long(8.80)]
+        self.assertEqual(extent.get_wcps(),
+                         'for $c in ( AvgLandTemp )\n return encode((scale($c[Long(8.8)], { Lat(0:99) }))'
+                         '[Lat(35:75)], "text/csv")')
+
+    def testSubsetsAreMergedAndNoOpScalesDropped(self):
+        merged = optimize(self.cube[Lat(30, 80)].scale(1)[Lat(35, 90), ansi("2014-07")].node)
+        self.assertEqual((merged.op, merged.args), ("subset", (("Lat", 35, 80), ("ansi", "2014-07", None))))
+        self.assertEqual(merged.children[0], self.cube.node)
+        with self.assertRaises(ValueError):
+            self.cube[Lat(1, 2)][Lat(5, 6)].get_wcps()
+
+class TestCommonSubexpressions(unittest.TestCase):
+    def setUp(self):
+        self.cube = Datacube("AvgLandTemp", axes=("ansi", "Lat", "Long"))
+
+    def testHeatmapReadsRegionOnce(self):
+        region = self.cube[ansi("2014-07"), Lat(35, 75), Long(-20, 40)]
+        heatmap = switch([(region == 99999, {"red": 255, "green": 255, "blue": 255}),
+                          (region < 18, {"red": 0, "green": 0, "blue": 255})],
+                         default={"red": 255, "green": 0, "blue": 0}).encode("image/png")
+        self.assertEqual(heatmap.get_wcps(),
+                         'for $c in ( AvgLandTemp )\n'
+                         ' let $v0 := $c[ansi("2014-07"), Lat(35:75), Long(-20:40)]\n'
+                         ' return encode(switch case $v0 = 99999 return {red: 255; green: 255; blue: 255}'
+                         ' case $v0 < 18 return {red: 0; green: 0; blue: 255}'
+                         ' default return {red: 255; green: 0; blue: 0}, "image/png")')
+
+    def testNestedRepeatsAreBoundInOrder(self):
+        # Built twice, so only their structure, not their identity, is shared
+        anomaly = (self.cube[Lat(1, 2)] - self.cube[Lat(1, 2)].avg()) / self.cube[Lat(1, 2)].avg()
+        self.assertEqual(anomaly.get_wcps(),
+                         'for $c in ( AvgLandTemp )\n let $v0 := $c[Lat(1:2)],\n     $v1 := avg($v0)\n'
+                         ' return encode(($v0 - $v1) / $v1, "text/csv")')
+
+class TestLocalEngine(unittest.TestCase):
+    def setUp(self):
+        # 12 months on a 4 x 3 grid, with Lat descending like the demo server coverages
+        self.data = np.arange(12 * 4 * 3, dtype=float).reshape(12, 4, 3)
+        coverage = LocalCoverage(self.data, ("ansi", "Lat", "Long"), {
+            "ansi": [f"2014-{month:02d}" for month in range(1, 13)],
+            "Lat": [60.5, 55.5, 50.5, 45.5],
+            "Long": [0.5, 5.5, 10.5],
+        })
+        self.conn = dbc("local", engine=LocalEngine({"AvgLandTemp": coverage}))
+
+    def makeQuery(self, query_type, *params):
+        query = Query(query_type=query_type, params=list(params))
+        query.coverage = "AvgLandTemp"
+        return query
+
+    def testQueryTypesRunLocally(self):
+        point = (Params("Lat", 53.08), Params("Long", 8.80))
+        year = self.makeQuery("max", Params("ansi", "2014-01", "2014-12"), *point)
+        self.assertEqual(self.conn.execute_query_bytes(year), repr(float(self.data[:, 1, 2].max())).encode())
+        series = self.makeQuery("transform_3d_to_1d_subset", Params("ansi", "2014-03", "2014-05"), *point)
+        np.testing.assert_array_equal(self.conn.execute_query_array(series), self.data[2:5, 1, 2])
+        warm = self.makeQuery("when_temp_more_than_15", Params("ansi", "2014-01", "2014-12"), *point)
+        self.assertEqual(self.conn.execute_query_bytes(warm), b"11")
+        single = self.makeQuery("selecting_single_value", Params("ansi", "2014-07"), *point)
+        self.assertEqual(self.conn.execute_fused([year, single]), [self.data[:, 1, 2].max(), self.data[6, 1, 2]])
+
+    def testDatacubeAndLetQueriesRunLocally(self):
+        cube = Datacube("AvgLandTemp", self.conn)
+        region = cube[ansi("2014-07"), Lat(45, 56), Long(0, 6)]
+        np.testing.assert_array_equal((region * 2).compute(), self.data[6, 1:4, 0:2] * 2)
+        self.assertEqual(int((cube[Lat(60.5), Long(0.5)] > 50).count().compute()), 7)
+        classes = self.conn.execute_query_array(
+            'image>>for $c in ( AvgLandTemp )\n let $region := $c[ansi("2014-07"), Lat(45:56), Long(0:6)]\n'
+            ' return encode(switch case 80 > $region return {red: 0; blue: 255} default return {red: 255; blue: 0},'
+            ' "text/csv")')
+        self.assertEqual(classes.shape, (3, 2, 2))
+        self.assertEqual(classes[0, 0].tolist(), [0, 255])
+
+    def testParsedQueriesCompileBack(self):
+        query = 'for $c in ( AvgLandTemp )\n return encode(scale($c[Lat(0:10)], 0.5) + 273.15, "text/csv")'
+        self.assertEqual(compile_wcps(parse_wcps(query)), query)
+        with self.assertRaises(QueryError):
+            self.conn.execute_query_bytes("for $c in ( AvgLandTemp ) return stats($c)")
+
+class TestCoverageStore(unittest.TestCase):
+    def setUp(self):
+        self.store_dir = tempfile.TemporaryDirectory()
+        self.store = CoverageStore(self.store_dir.name)
+        self.data = np.arange(12 * 4 * 3, dtype=np.float32).reshape(12, 4, 3)
+        self.coverage = LocalCoverage(self.data, ("ansi", "Lat", "Long"), {
+            "ansi": [f"2014-{month:02d}" for month in range(1, 13)],
+            "Lat": [60.5, 55.5, 50.5, 45.5],
+            "Long": [0.5, 5.5, 10.5],
+        })
+
+    def tearDown(self):
+        self.store_dir.cleanup()
+
+    def testAxisIndexLookup(self):
+        lat = AxisIndex("Lat", [60.5, 55.5, 50.5, 45.5])
+        self.assertEqual(lat.lookup(35, 56), slice(1, 4))
+        self.assertEqual(lat.lookup(53.08), 1)
+        with self.assertRaises(ValueError):
+            lat.lookup(20)
+        with self.assertRaises(ValueError):
+            AxisIndex("Long", [0.5, 10.5, 5.5])
+
+    def testSubsetsAreViewsOfTheFile(self):
+        stored = self.store.save("AvgLandTemp", self.coverage)
+        self.assertIsInstance(stored.data, np.memmap)
+        self.assertEqual(self.store.names(), ["AvgLandTemp"])
+        series = stored.subset([("Lat", 53.08, None), ("Long", 8.80, None)])
+        self.assertTrue(np.shares_memory(series.data, stored.data))
+        np.testing.assert_array_equal(series.data, self.data[:, 1, 2])
+        self.assertEqual(series.coordinates["ansi"][0], np.datetime64("2014-01"))
+
+    def testSaveReplacesCoverageAtomically(self):
+        stored = self.store.save("AvgLandTemp", self.coverage)
+        replaced = LocalCoverage(self.data + 100, self.coverage.axes, self.coverage.coordinates)
+        with mock.patch("wdc.Store.os.replace", side_effect=OSError("Error. Disk full")):
+            with self.assertRaises(OSError):
+                self.store.save("AvgLandTemp", replaced)
+        np.testing.assert_array_equal(self.store.open("AvgLandTemp").data, self.data)
+
+        self.store.save("AvgLandTemp", replaced)
+        np.testing.assert_array_equal(stored.data, self.data)
+        np.testing.assert_array_equal(self.store.open("AvgLandTemp").data, self.data + 100)
+
+    def testEngineReadsFromStore(self):
+        tiles = self.store.create("AvgLandTemp", self.data.shape, np.float32, self.coverage.axes,
+                                  self.coverage.coordinates)
+        tiles.data[:6] = self.data[:6]
+        tiles.data[6:] = self.data[6:]
+        tiles.data.flush()
+        conn = dbc("local", engine=LocalEngine(store=self.store))
+        self.assertEqual(conn.get_all_possible_coverages(), ["AvgLandTemp"])
+        cube = Datacube("AvgLandTemp", conn)
+        np.testing.assert_array_equal(cube[ansi("2014-07"), Lat(35, 75), Long(0, 6)].compute(),
+                                      self.data[6, :, 0:2])
+
+class TestTiling(unittest.TestCase):
+    def setUp(self):
+        self.data = np.arange(12 * 4 * 3, dtype=float).reshape(12, 4, 3)
+        coordinates = {
+            "ansi": [f"2014-{month:02d}" for month in range(1, 13)],
+            "Lat": [60.5, 55.5, 50.5, 45.5],
+            "Long": [0.5, 5.5, 10.5],
+        }
+        coverage = LocalCoverage(self.data, ("ansi", "Lat", "Long"), coordinates)
+        self.conn = dbc("local", engine=LocalEngine({"AvgLandTemp": coverage}))
+        self.grids = {axis: AxisGrid.from_coordinates(values) for axis, values in coordinates.items()}
+
+    def testPlanCoversEveryCellOnce(self):
+        params = [Params("ansi", "2014-02", "2014-11"), Params("Lat", 40, 62), Params("Long", -10, 1)]
+        plan = plan_tiles(params, self.grids, max_cells=8)
+        self.assertEqual(plan.shape, (10, 4, 1))
+        self.assertTrue(all(np.prod(tile.shape) <= 8 for tile in plan.tiles))
+        self.assertEqual(sum(np.prod(tile.shape) for tile in plan.tiles), 40)
+        self.assertEqual(str(plan.tiles[0].params[0]), 'ansi("2014-02":"2014-04")')
+        self.assertEqual(str(plan.tiles[0].params[2]), "Long(-0.75:1)")
+        self.assertEqual(str(Params("Long", -10, 0)), "Long(-10:0)")
+
+    def testTilesAreFetchedAndReassembled(self):
+        query = Query(query_type="transform_3d_to_1d_subset",
+                      params=[Params("ansi", "2014-02", "2014-11"), Params("Lat", 40, 62), Params("Long", 0, 11)])
+        query.coverage = "AvgLandTemp"
+        progress = []
+        result = self.conn.execute_tiled(query, self.grids, max_cells=8,
+                                         progress=lambda done, total: progress.append((done, total)))
+        np.testing.assert_array_equal(result, self.data[1:11])
+        self.assertEqual(progress[-1], (20, 20))
+
+        cube = Datacube("AvgLandTemp", self.conn)
+        plan = plan_tiles([Params("Lat", 40, 62), Params("Long", 0, 11), Params("ansi", "2014-07")],
+                          self.grids, max_cells=2)
+        np.testing.assert_array_equal(fetch_tiles(self.conn, lambda params: cube[tuple(params)], plan),
+                                      self.data[6])
+
+    def testTilesFollowTheAxisOrderOfTheCoverage(self):
+        query = Query(query_type="transform_3d_to_2d_subset",
+                      params=[Params("Long", 0, 11), Params("Lat", 40, 62), Params("ansi", "2014-07")])
+        query.coverage = "AvgLandTemp"
+        query.return_type = "text/csv"
+        expected = decode_result(self.conn.execute_query_bytes(query), query=query)
+        self.assertEqual(expected.shape, (4, 3))
+        np.testing.assert_array_equal(self.conn.execute_tiled(query, self.grids, max_cells=2), expected)
+
+        grids = {"Long": self.grids["Long"], "Lat": self.grids["Lat"]}
+        plan = plan_tiles(query.params, grids, max_cells=2, axes=["ansi", "Lat", "Long"])
+        self.assertEqual(plan.axes, ("Lat", "Long"))
+        with self.assertRaises(ValueError):
+            plan_tiles(query.params, {"Long": self.grids["Long"]}, max_cells=2)
+
+    def testAggregatesCombinePartials(self):
+        for query_type in ("min", "max", "avg", "when_temp_more_than_15"):
+            query = Query(query_type=query_type,
+                          params=[Params("ansi", "2014-02", "2014-11"), Params("Lat", 40, 62), Params("Long", 8)])
+            query.coverage = "AvgLandTemp"
+            expected = decode_result(self.conn.execute_query_bytes(query))[()]
+            self.assertEqual(self.conn.execute_aggregate(query, self.grids, max_cells=3), expected)
+            self.assertEqual(self.conn.execute_aggregate(query, self.grids, max_cells=3, split_axes=["ansi"]),
+                             expected)
+
+    def testAggregatesOfCellsWithNan(self):
+        self.data[3, 1, 0] = np.nan
+        query = Query(query_type="avg",
+                      params=[Params("ansi", "2014-02", "2014-11"), Params("Lat", 40, 62), Params("Long", 0.5)])
+        query.coverage = "AvgLandTemp"
+        tile = plan_tiles(query.params, self.grids, max_cells=3).tiles[0]
+        self.assertEqual(partial_wcps(query, tile).count("$c["), 1)
+        self.assertTrue(np.isnan(self.conn.execute_aggregate(query, self.grids, max_cells=3)))
+
+        for query_type in ("min", "max"):
+            self.assertEqual(combine_partials(query_type, [np.nan, 2.0, 1.0]),
+                             combine_partials(query_type, [2.0, 1.0, np.nan]))
+        self.assertTrue(np.isnan(combine_partials("min", [np.nan, np.nan])))
+
+class _EchoHandler(BaseHTTPRequestHandler):
+    # Answers every query with its own text over a keep-alive connection,
+    # with a server error if the query is "fail", with 503 if it is "busy",
+    # with 400 to queries starting with "bad", with 503 to every other
+    # request of a query starting with "flaky", and after a delay to
+    # queries starting with "slow"
+    protocol_version = "HTTP/1.1"
+    requests_by_query = {}
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        payload = parse_qs(body.decode()).get("query", [""])[0].encode()
+        count = self.requests_by_query[payload] = self.requests_by_query.get(payload, 0) + 1
+        if payload.startswith(b"slow"):
+            time.sleep(0.3)
+        if payload == b"fail":
+            status = 500
+        elif payload.startswith(b"bad"):
+            status = 400
+        elif payload == b"busy" or (payload.startswith(b"flaky") and count % 2 == 1):
+            status = 503
+        else:
+            status = 200
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+class TestConnectionPool(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), _EchoHandler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.local_url = f"http://127.0.0.1:{cls.server.server_port}/rasdaman/ows"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def testConnectionIsReused(self):
+        with dbc(self.local_url, pool_size=2) as conn:
+            for _ in range(5):
+                self.assertEqual(conn.execute_query("1"), b"1")
+            stats = list(conn.connection_stats().values())[0]
+        self.assertEqual(stats["connections"], 1)
+        self.assertEqual(stats["reused"], 4)
+
+    def testAsyncPreservesOrder(self):
+        queries = [str(i) for i in range(50)]
+        with dbc(self.local_url, pool_size=8) as conn:
+            results = asyncio.run(conn.execute_queries_async(queries))
+        self.assertEqual(results, [query.encode() for query in queries])
+
+    def testAsyncConcurrencyAboveTheConnectionDefault(self):
+        queries = [f"slow-async{i}" for i in range(6)]
+        with dbc(self.local_url, pool_size=2) as conn:
+            started = time.perf_counter()
+            results = asyncio.run(conn.execute_queries_async(queries, concurrency=6))
+            elapsed = time.perf_counter() - started
+        self.assertEqual(results, [query.encode() for query in queries])
+        # Two at a time would take three rounds of 0.3 seconds
+        self.assertLess(elapsed, 0.6)
+
+    def testCloseWaitsForWorkersGettingTheSession(self):
+        conn = dbc(self.local_url)
+        started, release = threading.Event(), threading.Event()
+
+        def work():
+            started.set()
+            release.wait()
+            return conn._get_session()
+
+        future = conn._get_executor().submit(work)
+        started.wait()
+        closing = threading.Thread(target=conn.close, daemon=True)
+        closing.start()
+        time.sleep(0.1)
+        release.set()
+        closing.join(timeout=5)
+        self.assertFalse(closing.is_alive())
+        self.assertIsNotNone(future.result(timeout=5))
+        conn.close()
+
+    def testExecuteManyCapturesErrors(self):
+        queries = ["1", "fail", "3"]
+        with dbc(self.local_url) as conn:
+            results = conn.execute_many(queries, workers=3)
+        self.assertEqual(results[0], b"1")
+        self.assertIsInstance(results[1], QueryError)
+        self.assertEqual((results[1].query, results[1].status_code), ("fail", 500))
+        self.assertEqual(results[2], b"3")
+
+    def testStreamingFailureKeepsItsCause(self):
+        with dbc(self.local_url, retry=RetryPolicy(max_attempts=1)) as conn:
+            with self.assertRaises(QueryError) as raised:
+                list(conn.execute_query_stream("fail"))
+        self.assertIsInstance(raised.exception.__cause__, requests.HTTPError)
+
+    def testStreamingResult(self):
+        with dbc(self.local_url) as conn:
+            self.assertEqual(list(conn.execute_query_stream("abcdef", chunk_size=2)), [b"ab", b"cd", b"ef"])
+            with tempfile.TemporaryDirectory() as out_dir:
+                path = f"{out_dir}/result.bin"
+                self.assertEqual(conn.execute_query_to("abcdef", path), 6)
+                with open(path, "rb") as result:
+                    self.assertEqual(result.read(), b"abcdef")
+                with self.assertRaises(QueryError):
+                    conn.execute_query_to("fail", f"{out_dir}/failed.bin")
+                self.assertFalse(os.path.exists(f"{out_dir}/failed.bin"))
+
+class TestTransportPolicy(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), _EchoHandler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.local_url = f"http://127.0.0.1:{cls.server.server_port}/rasdaman/ows"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def testTransientFailuresAreRetried(self):
+        with dbc(self.local_url, retry=RetryPolicy(max_attempts=2, base_delay=0)) as conn:
+            self.assertEqual(conn.execute_query_bytes("flaky1"), b"flaky1")
+            with self.assertRaises(InvalidQueryError):
+                conn.execute_query_bytes("bad")
+        self.assertEqual(_EchoHandler.requests_by_query[b"flaky1"], 2)
+        self.assertEqual(_EchoHandler.requests_by_query[b"bad"], 1)
+        self.assertLessEqual(RetryPolicy(base_delay=1, max_delay=3, seed=1).backoff(5), 3)
+
+    def testCircuitOpensAfterRepeatedFailures(self):
+        now = [0.0]
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10, clock=lambda: now[0])
+        with dbc(self.local_url, retry=RetryPolicy(max_attempts=1), breaker=breaker) as conn:
+            for _ in range(2):
+                with self.assertRaises(TransientQueryError):
+                    conn.execute_query_bytes("busy")
+            requests_sent = _EchoHandler.requests_by_query[b"busy"]
+            with self.assertRaises(CircuitOpenError):
+                conn.execute_query_bytes("1")
+            self.assertEqual(_EchoHandler.requests_by_query[b"busy"], requests_sent)
+            now[0] = 10.0
+            self.assertEqual(breaker.state(conn._host), "half-open")
+            self.assertEqual(conn.execute_query_bytes("1"), b"1")
+            self.assertEqual(breaker.state(conn._host), "closed")
+
+    def testServerErrorsOpenTheCircuit(self):
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10)
+        with dbc(self.local_url, breaker=breaker) as conn:
+            for _ in range(2):
+                with self.assertRaises(QueryError):
+                    conn.execute_query_bytes("fail")
+            with self.assertRaises(CircuitOpenError):
+                conn.execute_query_bytes("1")
+
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10)
+        with dbc(self.local_url, breaker=breaker) as conn:
+            for _ in range(2):
+                with self.assertRaises(InvalidQueryError):
+                    conn.execute_query_bytes("bad-request")
+            self.assertEqual(breaker.state(conn._host), "closed")
+
+    def testInterruptedProbeIsReleased(self):
+        now = [0.0]
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10, clock=lambda: now[0])
+        with dbc(self.local_url, retry=RetryPolicy(max_attempts=1), breaker=breaker) as conn:
+            with self.assertRaises(TransientQueryError):
+                conn.execute_query_bytes("busy")
+            now[0] = 10.0
+
+            def interrupt(*args):
+                raise KeyboardInterrupt
+
+            conn._post_once = interrupt
+            with self.assertRaises(KeyboardInterrupt):
+                conn.execute_query_bytes("1")
+            del conn._post_once
+            self.assertEqual(conn.execute_query_bytes("1"), b"1")
+            self.assertEqual(breaker.state(conn._host), "closed")
+
+    def testDeadlineReachesWorkerThreads(self):
+        with dbc(self.local_url, retry=RetryPolicy(max_attempts=5, base_delay=60)) as conn:
+            with deadline(1):
+                with self.assertRaises(DeadlineExceededError):
+                    conn.execute_query_bytes("busy")
+            with deadline(0):
+                results = conn.execute_many(["1", "2"])
+        self.assertTrue(all(isinstance(result, DeadlineExceededError) for result in results))
+
+    def testConcurrentIdenticalQueriesShareOneRequest(self):
+        with dbc(self.local_url, pool_size=8) as conn:
+            results = conn.execute_many(["slow1", "slow1", "slow1", "slow2"] * 2, workers=8)
+            self.assertEqual(conn._flights.shared(), 6)
+        self.assertEqual(results, [b"slow1", b"slow1", b"slow1", b"slow2"] * 2)
+        self.assertEqual(_EchoHandler.requests_by_query[b"slow1"], 1)
+
+        with dbc(self.local_url, single_flight=False) as conn:
+            conn.execute_many(["slow3"] * 3, workers=3)
+        self.assertEqual(_EchoHandler.requests_by_query[b"slow3"], 3)
+
+    def testSharedErrorsAreRaisedAsCopies(self):
+        flights = SingleFlight()
+        release = threading.Event()
+        leader_error = InvalidQueryError("Error. Rejected", query="q", status_code=400)
+        errors = []
+
+        def fail():
+            release.wait()
+            raise leader_error
+
+        def call():
+            try:
+                flights.do("q", fail)
+            except QueryError as exc:
+                errors.append(exc)
+
+        threads = [threading.Thread(target=call) for _ in range(3)]
+        threads[0].start()
+        while flights.in_flight() == 0:
+            time.sleep(0.01)
+        for thread in threads[1:]:
+            thread.start()
+        time.sleep(0.1)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        copies = [error for error in errors if error is not leader_error]
+        self.assertEqual(len(copies), 2)
+        self.assertIsNot(copies[0], copies[1])
+        for error in copies:
+            self.assertIsInstance(error, InvalidQueryError)
+            self.assertEqual((str(error), error.query, error.status_code), ("Error. Rejected", "q", 400))
+            self.assertIs(error.__cause__, leader_error)
+
+class TestStandInServer(unittest.TestCase):
+    def setUp(self):
+        self.server = StandInServer(seed=0).start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def _query(self, query_type, params):
+        query = Query(query_type=query_type, params=params)
+        query.coverage = "AvgLandTemp"
+        return query
+
+    def testCapabilitiesAndQueries(self):
+        self.assertTrue("AvgLandTemp" in CoverageCatalog(self.server.url))
+        with dbc(self.server.url) as conn:
+            self.assertEqual(conn.get_all_possible_coverages(), ["AvgLandTemp"])
+            series = conn.execute_query_array(self._query(
+                "transform_3d_to_1d_subset",
+                [Params("ansi", "2014-01", "2014-12"), Params("Lat", 53.08), Params("Long", 8.80)]))
+            self.assertEqual(series.shape, (12,))
+            self.assertEqual(int(series.argmax()), 6)
+            with self.assertRaises(InvalidQueryError):
+                conn.execute_query_bytes("for $c in ( Unknown ) return max($c)")
+
+    def testInjectedLatencyErrorsAndPayloads(self):
+        self.server.error_rate = 1.0
+        with dbc(self.server.url, retry=RetryPolicy(max_attempts=2, base_delay=0)) as conn:
+            with self.assertRaises(TransientQueryError):
+                conn.execute_query_bytes("for $c in ( AvgLandTemp ) return 1")
+            self.assertEqual(self.server.stats()["injected_errors"], 2)
+
+            self.server.error_rate = 0.0
+            self.server.latency = 0.2
+            self.server.payload_size = 1000
+            start = time.perf_counter()
+            self.assertEqual(len(conn.execute_query_bytes("anything")), 1000)
+            self.assertGreaterEqual(time.perf_counter() - start, 0.2)
+
+    def testCachedQueriesDoNotReachServer(self):
+        query = self._query("max", [Params("ansi", "2014-01", "2014-12"), Params("Lat", 40, 50), Params("Long", 0, 10)])
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cache = ResultCache(cache_dir)
+            with dbc(self.server.url, cache=cache) as conn:
+                first = conn.execute_query_bytes(query)
+                self.assertEqual(conn.execute_query_bytes(query), first)
+            cache.close()
+        self.assertEqual(self.server.stats()["queries"], 1)
+
+class TestInstrumentation(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = StandInServer().start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+    def testEveryPhaseIsRecorded(self):
+        query = Query(query_type="transform_3d_to_1d_subset",
+                      params=[Params("ansi", "2014-01", "2014-12"), Params("Lat", 53.08), Params("Long", 8.80)])
+        query.coverage = "AvgLandTemp"
+        with dbc(self.server.url) as conn, collect_spans("wdc.query") as spans:
+            conn.execute_query_array(query)
+            with self.assertRaises(InvalidQueryError):
+                conn.execute_query_bytes("for $c in ( Unknown ) return max($c)")
+
+        self.assertEqual(len(spans), 2)
+        self.assertEqual(set(spans[0].timings()),
+                         {"build", "connect", "server_wait", "transfer", "decode", "total"})
+        self.assertEqual(spans[0].attributes["query_type"], "transform_3d_to_1d_subset")
+        self.assertEqual(spans[0].attributes["bytes"], len(conn.execute_query_bytes(query)))
+        self.assertEqual(spans[1].attributes["coverage"], "Unknown")
+        self.assertEqual(spans[1].attributes["error"], "InvalidQueryError")
+
+    def testNothingIsRecordedWithoutListeners(self):
+        self.assertIsNone(start_span("wdc.query"))
+        with dbc(self.server.url) as conn, span("cell") as cell:
+            conn.execute_many(["for $c in ( AvgLandTemp ) return 1"] * 2)
+        self.assertEqual([child.name for child in cell.children], ["wdc.query"] * 2)
+
+class TestMetrics(unittest.TestCase):
+    def testHistogramQuantiles(self):
+        histogram = Histogram(buckets=[0.01, 0.1, 1])
+        for value in [0.005] * 50 + [0.05] * 45 + [0.5] * 4 + [5]:
+            histogram.observe(value)
+        self.assertAlmostEqual(histogram.quantile(0.5), 0.01)
+        self.assertAlmostEqual(histogram.quantile(0.95), 0.1)
+        self.assertEqual(histogram.cumulative()[-1], (float("inf"), 100))
+
+    def testFamiliesAreAggregated(self):
+        query = Query(query_type="max", params=[Params("ansi", "2014-01", "2014-12"), Params("Lat", 53.08), Params("Long", 8.80)])
+        query.coverage = "AvgLandTemp"
+        with tempfile.TemporaryDirectory() as cache_dir, StandInServer() as server, MetricsRegistry() as registry:
+            cache = ResultCache(cache_dir)
+            with dbc(server.url, cache=cache) as conn:
+                for _ in range(3):
+                    conn.execute_query_bytes(query)
+                with self.assertRaises(InvalidQueryError):
+                    conn.execute_query_bytes("for $c in ( Unknown ) return max($c)")
+            cache.close()
+
+        family, failed = sorted(registry.snapshot(), key=lambda metrics: metrics["query_type"])
+        self.assertEqual((family["query_type"], family["coverage"], family["requests"]), ("max", "AvgLandTemp", 3))
+        self.assertAlmostEqual(family["cache_hit_rate"], 2 / 3)
+        self.assertEqual(failed["errors_by_type"], {"InvalidQueryError": 1})
+        text = registry.to_prometheus()
+        self.assertIn('wdc_queries_total{query_type="max",coverage="AvgLandTemp"} 3', text)
+        self.assertIn('wdc_query_duration_seconds_count{query_type="wcps",coverage="Unknown"} 1', text)
+
+class _RecordingHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+class TestEvents(unittest.TestCase):
+    def setUp(self):
+        self.handler = _RecordingHandler()
+        logging.getLogger("wdc").addHandler(self.handler)
+        logging.getLogger("wdc").setLevel(logging.INFO)
+
+    def tearDown(self):
+        logging.getLogger("wdc").removeHandler(self.handler)
+        logging.getLogger("wdc").setLevel(logging.NOTSET)
+        set_sampling(1.0, "query_succeeded")
+
+    def testStatusIsLoggedNotPrinted(self):
+        output = io.StringIO()
+        with StandInServer() as server, dbc(server.url) as conn, contextlib.redirect_stdout(output):
+            self.assertEqual(conn.execute_query("for $c in ( AvgLandTemp ) return 1"), b"1")
+            conn.execute_query("for $c in ( Unknown ) return max($c)")
+        self.assertEqual(output.getvalue(), "")
+        self.assertEqual([record.event for record in self.handler.records], ["query_succeeded", "query_failed"])
+        self.assertEqual(self.handler.records[1].fields["status_code"], 400)
+        self.assertEqual(self.handler.records[1].levelno, logging.WARNING)
+
+    def testSampling(self):
+        set_sampling(0.0, "query_succeeded")
+        emit("query_succeeded", "{bytes}", bytes=1)
+        emit("query_failed", "{error}", logging.WARNING, error="busy")
+        logging.getLogger("wdc").setLevel(logging.ERROR)
+        emit("query_failed", "{error}", logging.WARNING, error="busy")
+        self.assertEqual([record.getMessage() for record in self.handler.records], ["busy"])
+
+class TestImageResult(unittest.TestCase):
+    def setUp(self):
+        if importlib.util.find_spec("PIL") is None:
+            self.skipTest("Pillow is not installed")
+        self.server = StandInServer().start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def testImagesAreDecodedOnDemand(self):
+        query = Query(query_type="transform_3d_to_2d_subset", params=[Params("ansi", "2014-07")])
+        query.coverage = "AvgLandTemp"
+        with dbc(self.server.url) as conn:
+            image = conn.execute_query_image(query)
+        self.assertEqual(image.format, "png")
+        self.assertEqual(image.size, (72, 36))
+        self.assertIsNone(image.decode_seconds)
+
+        pixels = np.asarray(image)
+        self.assertEqual(pixels.shape[:2], (36, 72))
+        self.assertGreaterEqual(image.decode_seconds, 0)
+        self.assertIs(image.to_array(), pixels)
+        self.assertEqual(image.to_array(reduce=4).shape[:2], (9, 18))
+
+    def testDatacubeReturnsImageResult(self):
+        with dbc(self.server.url) as conn:
+            cube = Datacube("AvgLandTemp", conn)
+            result = cube[ansi("2014-07")].encode("image/png").compute()
+        self.assertIsInstance(result, ImageResult)
+        self.assertTrue(bytes(result).startswith(b"\x89PNG"))
+
+class TestBenchmarks(unittest.TestCase):
+    def testResultsAreJson(self):
+        import json
+        from benchmarks import run_benchmarks
+
+        results = json.loads(json.dumps(run_benchmarks(["query_generation", "decode_csv"], quick=True)))
+        self.assertEqual(set(results["benchmarks"]), {"query_generation", "decode_csv"})
+        self.assertGreater(results["benchmarks"]["decode_csv"]["decodes_per_second"], 0)
+        with self.assertRaises(ValueError):
+            run_benchmarks(["unknown"])
+
+class TestResultCache(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.TemporaryDirectory()
+        self.cache = ResultCache(self.cache_dir.name, max_bytes=10)
+
+    def tearDown(self):
+        self.cache.close()
+        self.cache_dir.cleanup()
+
+    def testNormalizedQueriesShareEntries(self):
+        self.cache.put(server_url, 'for $c in ( AvgLandTemp )\n return min($c[ansi("2014-01")])', b"2.28")
+        cached = self.cache.get(server_url, 'for $c in ( AvgLandTemp )   return   min($c[ansi("2014-01")])')
+        self.assertEqual(cached, b"2.28")
+        self.assertIsNone(self.cache.get("http://other/ows", 'for $c in ( AvgLandTemp ) return 1'))
+
+    def testLruEvictionAndInvalidation(self):
+        self.cache.put(server_url, "for $c in ( AvgLandTemp ) return 1", b"11111")
+        self.cache.put(server_url, "for $c in ( Other ) return 2", b"22222")
+        self.cache.put(server_url, "for $c in ( AvgLandTemp ) return 3", b"33333")
+        self.assertIsNone(self.cache.get(server_url, "for $c in ( AvgLandTemp ) return 1"))
+        self.assertEqual(self.cache.size(), 10)
+        self.assertEqual(self.cache.invalidate_coverage("AvgLandTemp"), 1)
+        self.assertEqual(self.cache.get(server_url, "for $c in ( Other ) return 2"), b"22222")
+
+class TestDecode(unittest.TestCase):
+    def testSeriesFromCsv(self):
+        query = Query()
+        query.set_params([Params("ansi", "2014-01", "2014-03"), Params("Lat", 53.08), Params("Long", 8.80)])
+        result = decode_result(b"275.9846457481384,277.6381887435913,284.2523626327514", query)
+        self.assertEqual(result.shape, (3,))
+        self.assertAlmostEqual(result[1], 277.6381887435913)
+
+    def testScalarAndCount(self):
+        self.assertEqual(decode_result(b"25.984251").shape, ())
+        count = decode_result(b"7")
+        self.assertEqual((count.dtype.kind, int(count)), ("i", 7))
+
+    def testNestedAndMultiBand(self):
+        self.assertEqual(decode_result(b"{1,2,3},{4,5,6}").shape, (2, 3))
+        self.assertEqual(decode_result(b'{"1 2 3","4 5 6"},{"7 8 9","1 2 3"}').shape, (2, 2, 3))
+
+class TestCoverageCatalog(unittest.TestCase):
+    def testLoadsOnFirstUseOnly(self):
+        calls = []
+        def loader():
+            calls.append(1)
+            return ["AvgLandTemp", "AvgTemperatureColorScaled"]
+        catalog = CoverageCatalog(server_url, loader=loader)
+        self.assertEqual(calls, [], "Catalog must not load on creation")
+        self.assertIn("AvgLandTemp", catalog)
+        self.assertNotIn("NoSuchCoverage", catalog)
+        self.assertEqual(len(calls), 1, "Catalog must only load once within its TTL")
+
+    def testDiskCacheAvoidsServer(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            warm = CoverageCatalog(server_url, cache_dir=cache_dir, loader=lambda: ["AvgLandTemp"])
+            warm.get_coverages()
+            def offline():
+                raise AssertionError("Server must not be contacted")
+            cold = CoverageCatalog(server_url, cache_dir=cache_dir, loader=offline)
+            self.assertEqual(cold.get_coverages(), ["AvgLandTemp"])
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,136 @@
+from typing import List, Union
+
+import numpy as np
+
+# Importing user-defined modules
+from wdc.Connection import QueryError
+from wdc.Decode import decode_csv
+from wdc.Tiling import Tile, TilePlan
+
+# Query types whose result can be combined from the results of the tiles
+decomposableTypes = [
+    "min",
+    "max",
+    "avg",
+    "when_temp_more_than_15"
+]
+
+def partial_wcps(query, tile: Tile) -> str:
+    """
+    Returns the WCPS query computing the partial aggregate of one tile.
+
+    min and max return the minimum or maximum of the tile and
+    when_temp_more_than_15 its count. avg returns the sum and the number
+    of cells of the tile, as two CSV values of one request, since averages
+    of tiles of different sizes cannot be combined. The tile is bound once
+    by a let clause, and every cell is counted, NaN or not, so a NaN cell
+    makes the average NaN like it does in the query of the whole subset.
+
+    Parameters:
+    -----------
+    query : wdc.Query
+        The query whose aggregate is decomposed.
+    tile : Tile
+        The tile, see wdc.Tiling.plan_tiles.
+
+    Returns:
+    --------
+    str
+        The WCPS query of the tile.
+    """
+    if query.query_type not in decomposableTypes:
+        raise ValueError(f"Error. Queries of type {query.query_type} cannot be decomposed")
+
+    cells = f"{query.return_val}[" + ", ".join(param.get_all_params() for param in tile.params) + "]"
+    head = f"for {query.return_val} in ( {query.coverage} )\n return "
+
+    if query.query_type in ("min", "max"):
+        return head + f"{query.query_type}({cells})"
+    if query.query_type == "when_temp_more_than_15":
+        return head + f"count({cells} > 15)"
+    # Every cell is either equal to itself or, if it is NaN, unequal
+    return (f"for {query.return_val} in ( {query.coverage} )\n let $tile := {cells}\n return "
+            f"encode(\ncoverage partial over $i i(0:1)\nvalues switch\n case $i = 0 return add($tile)\n"
+            f" default return count($tile = $tile or $tile != $tile)\n, \"text/csv\")")
+
+
+def combine_partials(query_type: str, partials: List) -> Union[int, float]:
+    """
+    Combines the partial aggregates of the tiles into the aggregate of the
+    whole subset.
+
+    Parameters:
+    -----------
+    query_type : str
+        One of decomposableTypes.
+    partials : List
+        The partial aggregate of every tile: a number, or a (sum, count)
+        pair for avg.
+
+    Returns:
+    --------
+    Union[int, float]
+        The aggregate. avg is the total sum divided by the total count.
+        min and max skip NaN partials, so they do not depend on the order
+        of the tiles, and are NaN only if every partial is.
+    """
+    if query_type in ("min", "max"):
+        values = np.asarray(partials, dtype=float)
+        if np.isnan(values).all():
+            return float("nan")
+        return float(np.nanmin(values) if query_type == "min" else np.nanmax(values))
+    if query_type == "when_temp_more_than_15":
+        return int(sum(partials))
+
+    total = sum(partial[0] for partial in partials)
+    count = sum(partial[1] for partial in partials)
+    if count == 0:
+        raise ValueError("Error. Cannot average a subset without cells")
+    return total / count
+
+
+def _parse_partial(query_type: str, payload: bytes):
+    values = decode_csv(payload, dtype=float).reshape(-1)
+    expected = 2 if query_type == "avg" else 1
+    if values.size != expected:
+        raise ValueError(f"Error. Expected {expected} values but received {values.size}")
+    return tuple(values.tolist()) if query_type == "avg" else float(values[0])
+
+
+def aggregate_tiles(conn, query, plan: TilePlan, workers: int = None) -> Union[int, float]:
+    """
+    Computes the aggregate of a query as partial aggregates of the tiles
+    of a plan, fetched in parallel, and combines them client-side.
+
+    Parameters:
+    -----------
+    conn : wdc.dbc
+        The connection executing the partial queries.
+    query : wdc.Query
+        A query of one of decomposableTypes.
+    plan : TilePlan
+        The tiles, see wdc.Tiling.plan_tiles.
+    workers : int, optional
+        Number of partial queries executed at the same time. Defaults to
+        the concurrency of the connection.
+
+    Returns:
+    --------
+    Union[int, float]
+        The aggregate of the whole subset. Counts are integers.
+
+    Raises:
+    -------
+    QueryError
+        If a partial query failed.
+    """
+    partial_queries = [partial_wcps(query, tile) for tile in plan.tiles]
+    partials = []
+    for partial_query, payload in zip(partial_queries, conn.execute_many(partial_queries, workers=workers)):
+        if isinstance(payload, QueryError):
+            raise payload
+        try:
+            partials.append(_parse_partial(query.query_type, payload))
+        except ValueError as err:
+            raise QueryError(str(err), query=partial_query) from err
+    return combine_partials(query.query_type, partials)
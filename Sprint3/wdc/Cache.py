@@ -0,0 +1,280 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import List, Optional
+
+# Matching the coverages iterated over in a WCPS query, e.g. "for $c in ( AvgLandTemp )",
+# including every further iterator such as ", $d in ( AvgTemperatureColorScaled )"
+_COVERAGE_PATTERN = re.compile(r"(?:for|,)\s*\$\w+\s+in\s*\(\s*([^)]*?)\s*\)")
+_WHITESPACE = re.compile(r"\s+")
+
+def normalize_query(query: str) -> str:
+    """
+    Returns the query with every run of whitespace outside of string
+    literals collapsed into a single space, so that queries differing only
+    in indentation share a cache entry.
+
+    Parameters:
+    -----------
+    query : str
+        The WCPS query.
+
+    Returns:
+    --------
+    str
+        The normalized query.
+    """
+    parts = str(query).strip().split('"')
+    # Every odd part lies between two quotes and is kept as it is
+    parts[::2] = [_WHITESPACE.sub(" ", part) for part in parts[::2]]
+    return '"'.join(parts)
+
+
+def query_coverages(query: str) -> List[str]:
+    """
+    Returns the names of the coverages a WCPS query reads from.
+
+    Parameters:
+    -----------
+    query : str
+        The WCPS query.
+
+    Returns:
+    --------
+    List[str]
+        The coverage names, in the order they appear in the query.
+    """
+    coverages = []
+    for match in _COVERAGE_PATTERN.finditer(str(query)):
+        coverages.extend(name.strip() for name in match.group(1).split(",") if name.strip())
+    return coverages
+
+
+class ResultCache:
+    """
+    A class implementing a content-addressed, size-bounded on-disk cache of
+    query results.
+
+    Results are stored in one file per entry, named after the hash of the
+    server URL and the normalized query. An SQLite index keeps the size,
+    the coverages and the last use of every entry, so the least recently
+    used entries can be evicted once the cache grows beyond `max_bytes`.
+
+    Attributes
+    ----------
+    cache_dir : str
+        Directory the results and the index are stored in.
+    max_bytes : int
+        Maximum total size of the cached results.
+    hits : int
+        Number of lookups answered from the cache.
+    misses : int
+        Number of lookups that were not in the cache.
+
+    Methods
+    -------
+    __init__(self, cache_dir: str, max_bytes: int = 512 * 1024 * 1024)
+        Initializes the cache, creating the directory if needed.
+
+    get(self, server_url: str, query: str) -> Optional[bytes]
+        Returns the cached result of the query, or None.
+
+    put(self, server_url: str, query: str, result: bytes)
+        Stores the result of the query.
+
+    invalidate_coverage(self, coverage: str) -> int
+        Removes all results of queries reading from the coverage.
+
+    clear(self)
+        Removes all results.
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int = 512 * 1024 * 1024):
+        """
+        Initializes the cache, creating the directory if needed.
+
+        Parameters:
+        -----------
+        cache_dir : str
+            Directory the results and the index are stored in.
+        max_bytes : int, optional
+            Maximum total size of the cached results. Defaults to 512 MiB.
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(cache_dir, exist_ok=True)
+        self._db = sqlite3.connect(os.path.join(cache_dir, "index.sqlite"),
+                                   check_same_thread=False, isolation_level=None)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "key TEXT PRIMARY KEY, coverages TEXT, size INTEGER, last_used REAL)"
+        )
+
+
+    @staticmethod
+    def key(server_url: str, query: str) -> str:
+        """
+        Returns the cache key of a query sent to a server.
+
+        Parameters:
+        -----------
+        server_url : str
+            URL of the server the query is sent to.
+        query : str
+            The WCPS query.
+
+        Returns:
+        --------
+        str
+            The SHA-256 hex digest of the server URL and the normalized query.
+        """
+        text = f"{server_url}\n{normalize_query(query)}"
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.bin")
+
+
+    def get(self, server_url: str, query: str) -> Optional[bytes]:
+        """
+        Returns the cached result of the query, or None.
+
+        Parameters:
+        -----------
+        server_url : str
+            URL of the server the query is sent to.
+        query : str
+            The WCPS query.
+
+        Returns:
+        --------
+        Optional[bytes]
+            The cached result, or None if the query is not cached.
+        """
+        key = self.key(server_url, query)
+        try:
+            with open(self._path(key), "rb") as entry:
+                result = entry.read()
+        except OSError:
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+            self._db.execute("UPDATE entries SET last_used = ? WHERE key = ?", (time.time(), key))
+        return result
+
+
+    def put(self, server_url: str, query: str, result: bytes):
+        """
+        Stores the result of the query, evicting the least recently used
+        results if the cache grows beyond its maximum size.
+
+        Parameters:
+        -----------
+        server_url : str
+            URL of the server the query is sent to.
+        query : str
+            The WCPS query.
+        result : bytes
+            The result returned by the server.
+        """
+        if len(result) > self.max_bytes:
+            return
+
+        key = self.key(server_url, query)
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Writing to a temporary file first so readers never see a partial result
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as entry:
+            entry.write(result)
+        os.replace(tmp_path, path)
+
+        coverages = "," + ",".join(query_coverages(query)) + ","
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO entries (key, coverages, size, last_used) VALUES (?, ?, ?, ?)",
+                (key, coverages, len(result), time.time()),
+            )
+            self._evict()
+
+
+    def _evict(self):
+        (total,) = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()
+        if total <= self.max_bytes:
+            return
+
+        rows = self._db.execute("SELECT key, size FROM entries ORDER BY last_used").fetchall()
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            self._remove(key)
+            total -= size
+
+
+    def _remove(self, key: str):
+        self._db.execute("DELETE FROM entries WHERE key = ?", (key,))
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+
+    def invalidate_coverage(self, coverage: str) -> int:
+        """
+        Removes all results of queries reading from the coverage.
+
+        Parameters:
+        -----------
+        coverage : str
+            Name of the coverage whose data changed.
+
+        Returns:
+        --------
+        int
+            The number of removed results.
+        """
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT key FROM entries WHERE instr(coverages, ?) > 0", (f",{coverage},",)
+            ).fetchall()
+            for (key,) in rows:
+                self._remove(key)
+        return len(rows)
+
+
+    def clear(self):
+        """
+        Removes all results.
+        """
+        with self._lock:
+            for (key,) in self._db.execute("SELECT key FROM entries").fetchall():
+                self._remove(key)
+
+
+    def size(self) -> int:
+        """
+        Returns the total size of the cached results in bytes.
+        """
+        with self._lock:
+            (total,) = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()
+        return total
+
+
+    def close(self):
+        """
+        Closes the index of the cache.
+        """
+        with self._lock:
+            self._db.close()
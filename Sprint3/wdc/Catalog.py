@@ -0,0 +1,234 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Callable, FrozenSet, Iterator, List, Optional
+
+# Importing user-defined modules
+from wdc.Connection import dbc
+
+# Server whose coverages are used to validate queries (applied in wdc/Query.py)
+DEFAULT_SERVER_URL = "https://ows.rasdaman.org/rasdaman/ows?REQUEST=GetCoverage"
+
+class CoverageCatalog:
+    """
+    A class that lazily loads and caches the coverages offered by a server.
+
+    Nothing is fetched when the catalog is created. The GetCapabilities
+    request is only sent the first time the coverages are needed, and the
+    result is kept in memory for `ttl` seconds. If a `cache_dir` is given,
+    the coverages are also persisted there (one file per server URL), so a
+    fresh process can validate coverages without any network call.
+
+    Attributes
+    ----------
+    server_url : str
+        URL of the server whose coverages are listed.
+    ttl : float
+        Number of seconds a loaded list of coverages stays valid.
+    cache_dir : str, optional
+        Directory used to persist the coverages between processes.
+        Defaults to None, meaning the coverages are only kept in memory.
+
+    Methods
+    -------
+    __init__(self, server_url: str, ttl: float = 3600.0, cache_dir: str = None,
+             loader: Callable[[], List[str]] = None)
+        Initializes the catalog without contacting the server.
+
+    get_coverages(self) -> List[str]
+        Returns the coverages, loading them on first use or once expired.
+
+    refresh(self) -> List[str]
+        Fetches the coverages from the server and updates all caches.
+
+    invalidate(self)
+        Drops the in-memory coverages so the next access reloads them.
+
+    __contains__(self, coverage: str) -> bool
+        Checks whether the coverage is offered by the server.
+    """
+
+    def __init__(self, server_url: str, ttl: float = 3600.0, cache_dir: str = None,
+                 loader: Callable[[], List[str]] = None):
+        """
+        Initializes the catalog without contacting the server.
+
+        Parameters:
+        -----------
+        server_url : str
+            URL of the server whose coverages are listed.
+        ttl : float, optional
+            Number of seconds a loaded list of coverages stays valid.
+            Defaults to one hour.
+        cache_dir : str, optional
+            Directory used to persist the coverages between processes.
+            Defaults to None.
+        loader : Callable[[], List[str]], optional
+            Function returning the coverages of the server. Defaults to
+            dbc(server_url).get_all_possible_coverages.
+        """
+        self.server_url = server_url
+        self.ttl = ttl
+        self.cache_dir = cache_dir
+        self._loader = loader
+        self._coverages: Optional[FrozenSet[str]] = None
+        self._ordered: List[str] = []
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+
+
+    def get_coverages(self) -> List[str]:
+        """
+        Returns the coverages, loading them on first use or once expired.
+
+        The in-memory copy is used first, then the on-disk cache and only
+        then the server itself.
+
+        Returns:
+        --------
+        List[str]
+            The names of all coverages offered by the server.
+        """
+        self._ensure_loaded()
+        return list(self._ordered)
+
+
+    def refresh(self) -> List[str]:
+        """
+        Fetches the coverages from the server and updates all caches.
+
+        Returns:
+        --------
+        List[str]
+            The names of all coverages offered by the server.
+        """
+        with self._lock:
+            self._fetch()
+        return list(self._ordered)
+
+
+    def invalidate(self):
+        """
+        Drops the in-memory coverages so the next access reloads them.
+        The on-disk cache is kept and still honours the TTL.
+        """
+        with self._lock:
+            self._coverages = None
+            self._ordered = []
+            self._loaded_at = 0.0
+
+
+    def __contains__(self, coverage: str) -> bool:
+        """
+        Checks whether the coverage is offered by the server.
+
+        Parameters:
+        -----------
+        coverage : str
+            Name of the coverage to look up.
+
+        Returns:
+        --------
+        bool
+            True if the coverage exists, False otherwise.
+        """
+        if coverage is None:
+            return False
+        self._ensure_loaded()
+        return coverage in self._coverages
+
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.get_coverages())
+
+
+    def __len__(self) -> int:
+        self._ensure_loaded()
+        return len(self._ordered)
+
+
+    def __repr__(self) -> str:
+        state = "loaded" if self._coverages is not None else "not loaded"
+        return f"CoverageCatalog({self.server_url!r}, {state})"
+
+
+    def _is_fresh(self, loaded_at: float) -> bool:
+        return time.time() - loaded_at < self.ttl
+
+
+    def _ensure_loaded(self):
+        # Fast path: no locking once the coverages are in memory and fresh
+        if self._coverages is not None and self._is_fresh(self._loaded_at):
+            return
+
+        with self._lock:
+            if self._coverages is not None and self._is_fresh(self._loaded_at):
+                return
+            if not self._load_from_disk():
+                self._fetch()
+
+
+    def _set(self, coverages: List[str], loaded_at: float):
+        self._ordered = list(coverages)
+        self._coverages = frozenset(coverages)
+        self._loaded_at = loaded_at
+
+
+    def _fetch(self):
+        loader = self._loader or dbc(self.server_url).get_all_possible_coverages
+        coverages = loader()
+        self._set(coverages, time.time())
+        self._save_to_disk()
+
+
+    def _cache_path(self) -> Optional[str]:
+        if self.cache_dir is None:
+            return None
+        key = hashlib.sha256(self.server_url.encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, f"coverages-{key}.json")
+
+
+    def _load_from_disk(self) -> bool:
+        path = self._cache_path()
+        if path is None or not os.path.exists(path):
+            return False
+
+        try:
+            with open(path, "r", encoding="utf-8") as cache_file:
+                cached = json.load(cache_file)
+            loaded_at = float(cached["loaded_at"])
+            coverages = list(cached["coverages"])
+        except (OSError, ValueError, KeyError, TypeError):
+            # A corrupt or unreadable cache file is treated as a cache miss
+            return False
+
+        if cached.get("server_url") != self.server_url or not self._is_fresh(loaded_at):
+            return False
+
+        self._set(coverages, loaded_at)
+        return True
+
+
+    def _save_to_disk(self):
+        path = self._cache_path()
+        if path is None:
+            return
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        payload = {
+            "server_url": self.server_url,
+            "loaded_at": self._loaded_at,
+            "coverages": self._ordered,
+        }
+        # Writing to a temporary file first so readers never see a partial file
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as cache_file:
+            json.dump(payload, cache_file)
+        os.replace(tmp_path, path)
+
+
+# Coverages used to validate the coverages users wish to use (applied in wdc/Query.py).
+# Nothing is fetched until the first validation takes place.
+allCoverages = CoverageCatalog(DEFAULT_SERVER_URL)
@@ -1,13 +1,223 @@
-from typing import Union, List, BinaryIO, NewType
+from typing import Union, List, Dict, Iterable, Iterator, BinaryIO, NewType
+import asyncio
+import logging
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
 import requests
 from requests import HTTPError
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
 import xml.etree.ElementTree as ET
 
+# Importing user-defined modules
+from wdc.Cache import ResultCache, normalize_query
+from wdc.Events import emit
+from wdc.Policy import CircuitBreaker, RetryPolicy, SingleFlight, bind_context, remaining_time
+from wdc.Trace import _current_span, end_span, start_span
+
 # Defining custom types for return type hinting
 Image = NewType('Image', BinaryIO)
 Diagram = NewType('Diagram', BinaryIO)
 Query = NewType('Query', str)
 
+class QueryError(Exception):
+    """
+    Raised when a query could not be executed.
+
+    Attributes
+    ----------
+    query : str
+        The WCPS query that failed.
+    status_code : int
+        The HTTP status code returned by the server, or None if no
+        response was received.
+    """
+
+    def __init__(self, message: str, query: str = None, status_code: int = None):
+        super().__init__(message)
+        self.query = query
+        self.status_code = status_code
+
+
+class TransientQueryError(QueryError):
+    """
+    Raised when a query failed in a way that may succeed when retried: the
+    server could not be reached, timed out, or answered 408, 429, 502, 503
+    or 504.
+    """
+
+
+class InvalidQueryError(QueryError):
+    """
+    Raised when the server rejected a query with a 4xx status code, which
+    retrying does not change.
+    """
+
+
+class CircuitOpenError(QueryError):
+    """
+    Raised without contacting the server while requests to it are paused
+    after repeated failures (see wdc.CircuitBreaker).
+    """
+
+
+class DeadlineExceededError(QueryError):
+    """
+    Raised when the deadline of a query passed (see wdc.deadline).
+    """
+
+
+# Status codes of failures that may succeed when the request is repeated
+_TRANSIENT_STATUS_CODES = (408, 429, 502, 503, 504)
+
+def _query_error(exc: Exception, query: str) -> QueryError:
+    """
+    Wraps an exception raised while sending a query into the QueryError
+    subclass matching the failure.
+    """
+    if isinstance(exc, QueryError):
+        return exc
+    if isinstance(exc, HTTPError):
+        status_code = exc.response.status_code if exc.response is not None else None
+        if status_code in _TRANSIENT_STATUS_CODES:
+            error_type = TransientQueryError
+        elif status_code is not None and 400 <= status_code < 500:
+            error_type = InvalidQueryError
+        else:
+            error_type = QueryError
+        return error_type(str(exc), query=query, status_code=status_code)
+    if isinstance(exc, (requests.ConnectionError, requests.Timeout)):
+        return TransientQueryError(f"The server could not be reached: {exc}", query=query)
+    return QueryError(f"An unexpected error has occurred: {exc}", query=query)
+
+
+# The coverage of WCPS text, for queries not given as wdc.Query objects
+_COVERAGE_PATTERN = re.compile(r"for\s+\$\w+\s+in\s*\(\s*([^\s,)]+)")
+
+def _query_attributes(query) -> Dict[str, str]:
+    """
+    Returns the query_type and coverage of a query, for its span.
+    """
+    attributes = {"query_type": getattr(query, "query_type", None) or "wcps"}
+    coverage = getattr(query, "coverage", None)
+    if coverage is None and isinstance(query, str):
+        match = _COVERAGE_PATTERN.search(query)
+        coverage = match.group(1) if match else None
+    attributes["coverage"] = coverage
+    return attributes
+
+
+class _TimedHTTPConnection(HTTPConnection):
+    """
+    An HTTP connection recording how long opening its socket took in the
+    current span, as the phase "connect" (name resolution included).
+    """
+
+    def _new_conn(self):
+        span = _current_span.get()
+        if span is None:
+            return super()._new_conn()
+        start = time.perf_counter()
+        sock = super()._new_conn()
+        span.add_child("connect", start, time.perf_counter())
+        return sock
+
+
+class _TimedHTTPSConnection(HTTPSConnection):
+    """
+    An HTTPS connection recording the phases "connect" and "tls" of opening
+    it in the current span.
+    """
+
+    def _new_conn(self):
+        span = _current_span.get()
+        if span is None:
+            return super()._new_conn()
+        start = time.perf_counter()
+        sock = super()._new_conn()
+        self._wdc_connected_at = time.perf_counter()
+        span.add_child("connect", start, self._wdc_connected_at)
+        return sock
+
+    def connect(self):
+        self._wdc_connected_at = None
+        super().connect()
+        span = _current_span.get()
+        if span is not None and self._wdc_connected_at is not None:
+            span.add_child("tls", self._wdc_connected_at, time.perf_counter())
+
+
+class _TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+
+class _TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+
+class _PooledAdapter(HTTPAdapter):
+    """
+    An HTTP adapter that counts how many requests every pooled connection served.
+
+    A connection counts as new whenever its socket changes, so connections
+    that the server closed and urllib3 silently re-opened are not reported
+    as reused.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self._stats_lock = threading.Lock()
+        self._hosts = {}
+        self._serial = 0
+        super().__init__(*args, **kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {"http": _TimedHTTPConnectionPool,
+                                                   "https": _TimedHTTPSConnectionPool}
+
+    def send(self, request, *args, **kwargs):
+        response = super().send(request, *args, **kwargs)
+        # The body has not been read yet, so the connection is still attached
+        connection = getattr(response.raw, "_connection", None)
+        if connection is not None:
+            self._record(connection)
+        return response
+
+    def _record(self, connection):
+        host = f"{connection.host}:{connection.port}"
+        sock = getattr(connection, "sock", None)
+        with self._stats_lock:
+            stats = self._hosts.setdefault(host, {"connections": 0, "requests": 0, "open": {}})
+            stats["requests"] += 1
+            if getattr(connection, "_wdc_sock", None) is not sock:
+                # A new socket means a new TCP (and TLS) handshake took place
+                stats["open"].pop(getattr(connection, "_wdc_serial", None), None)
+                self._serial += 1
+                connection._wdc_sock = sock
+                connection._wdc_serial = self._serial
+                stats["connections"] += 1
+                stats["open"][self._serial] = 0
+            else:
+                stats["open"][connection._wdc_serial] += 1
+
+    def stats(self) -> Dict[str, Dict[str, Union[int, List[int]]]]:
+        with self._stats_lock:
+            return {
+                host: {
+                    "connections": stats["connections"],
+                    "requests": stats["requests"],
+                    "reused": stats["requests"] - stats["connections"],
+                    "reuse_per_connection": list(stats["open"].values()),
+                }
+                for host, stats in self._hosts.items()
+            }
+
+
 class dbc:
     """
     A class responsible for connecting to the rasdaman server of the datacube.
@@ -16,57 +226,805 @@ class dbc:
     ----------
     server_url : str
         URL of the server to connect to.
+    pool_size : int
+        Maximum number of connections kept open to the server.
+    keep_alive : bool
+        Whether connections are kept open and reused between queries.
+    concurrency : int
+        Maximum number of queries the asynchronous API keeps in flight.
+    cache : wdc.ResultCache
+        Optional on-disk cache answering repeated queries without the server.
+    engine : wdc.LocalEngine
+        Optional in-process engine executing the queries instead of the server.
+    timeout : float
+        Maximum number of seconds one attempt of a request may take, or None.
+    retry : wdc.RetryPolicy
+        How often and how long apart failed requests are retried.
+    breaker : wdc.CircuitBreaker
+        Pauses requests to the server after repeated failures, or None.
+    single_flight : bool
+        Whether concurrent identical queries share one request.
 
     Methods
     -------
-    __init__(self, server_url: str)
+    __init__(self, server_url: str, pool_size: int = 10, keep_alive: bool = True,
+             concurrency: int = None, cache: ResultCache = None, engine=None,
+             timeout: float = None, retry: RetryPolicy = None, breaker: CircuitBreaker = None,
+             single_flight: bool = True)
         Initializes the dbc object with the provided server URL.
     
     execute_query(self, query: Query) -> Union[int, float, bytes, str, Image, Diagram]
         Executes a query on the rasdaman server and returns the result.
+
+    execute_query_async(self, query: Query) -> Union[int, float, bytes, str, Image, Diagram]
+        Coroutine executing a query without blocking the event loop.
+
+    execute_queries_async(self, queries: Iterable[Query], concurrency: int = None) -> List
+        Coroutine executing many queries concurrently, preserving their order.
+
+    execute_query_bytes(self, query: Query) -> bytes
+        Executes a query and returns its raw result, raising on failure.
+
+    execute_query_array(self, query: Query, dtype=None) -> numpy.ndarray
+        Executes a query and decodes its numeric result into a NumPy array.
+
+    execute_query_image(self, query: Query) -> ImageResult
+        Executes a query and returns its image result, decoded on demand.
+
+    execute_many(self, queries: Iterable[Query], workers: int = None) -> List
+        Executes many queries on a thread pool, preserving their order and
+        returning a QueryError in place of every query that failed.
+
+    execute_fused(self, queries: List[Query], max_batch: int = 500, workers: int = None) -> List
+        Executes many single-value queries as a few fused requests.
+
+    execute_tiled(self, query: Query, grids: Dict, max_cells: int = 250000, workers: int = None,
+                  progress=None, dtype=None) -> Union[numpy.ndarray, Image]
+        Executes a large subset as concurrent tile queries and reassembles them.
+
+    execute_aggregate(self, query: Query, grids: Dict, max_cells: int = 250000,
+                      split_axes: List[str] = None, workers: int = None) -> Union[int, float]
+        Executes a min, max, avg or count query as parallel partial aggregates.
+
+    execute_query_stream(self, query: Query, chunk_size: int = 65536) -> Iterator[bytes]
+        Executes a query and yields its result in chunks as they arrive.
+
+    execute_query_to(self, query: Query, destination, chunk_size: int = 65536) -> int
+        Executes a query and writes its result straight to a file.
     
     get_all_possible_coverages(self) -> List[str]
         Retrieves a list of all available coverages from the rasdaman server.
+
+    connection_stats(self) -> Dict[str, Dict[str, Union[int, List[int]]]]
+        Reports how often the pooled connections were reused.
+
+    close(self)
+        Closes all pooled connections.
     """
 
-    def __init__(self, server_url: str):
+    def __init__(self, server_url: str, pool_size: int = 10, keep_alive: bool = True,
+                 concurrency: int = None, cache: ResultCache = None, engine=None,
+                 timeout: float = None, retry: RetryPolicy = None, breaker: CircuitBreaker = None,
+                 single_flight: bool = True):
         """
         Initializes the dbc object with the provided server URL.
 
+        No connection is opened here. The pooled HTTP session is created on
+        the first query and reused by every following query, so only the
+        first request to the server pays for the TCP and TLS handshakes.
+
         Parameters
         ----------
         server_url : str
             URL of the server to connect to.
+        pool_size : int, optional
+            Maximum number of connections kept open to the server.
+            Defaults to 10.
+        keep_alive : bool, optional
+            Whether connections are kept open and reused between queries.
+            Defaults to True.
+        concurrency : int, optional
+            Maximum number of queries the asynchronous API keeps in flight.
+            Defaults to the pool size, so every query in flight has its own
+            pooled connection.
+        cache : wdc.ResultCache, optional
+            On-disk cache of query results. Only use it for coverages whose
+            data does not change, or invalidate it when they do. Defaults to
+            None, meaning every query is sent to the server.
+        engine : wdc.LocalEngine, optional
+            Engine executing every query in-process with NumPy, against
+            local coverages, instead of sending it to the server. All query
+            methods work unchanged. Defaults to None.
+        timeout : float, optional
+            Maximum number of seconds one attempt of a request may take.
+            A deadline set with wdc.deadline shortens it. Defaults to None,
+            meaning no limit.
+        retry : wdc.RetryPolicy, optional
+            How often and how long apart requests that failed transiently
+            are retried. Defaults to 3 attempts with exponential backoff
+            and jitter; RetryPolicy(max_attempts=1) disables retries.
+        breaker : wdc.CircuitBreaker, optional
+            Pauses requests to a host after repeated failures.
+            Pass the same breaker to several connections to share the state
+            of a host. Defaults to a breaker of this connection.
+        single_flight : bool, optional
+            Whether concurrent callers of the same query, up to whitespace,
+            share one request and all receive its result or its error,
+            e.g. when dashboard panels refresh together. Streamed queries
+            are not shared. Defaults to True.
 
         Returns
         -------
         None
         """
         self.url = server_url
+        self.pool_size = pool_size
+        self.keep_alive = keep_alive
+        self.concurrency = concurrency if concurrency is not None else pool_size
+        self.cache = cache
+        self.engine = engine
+        self.timeout = timeout
+        self.retry = retry if retry is not None else RetryPolicy()
+        self.breaker = breaker if breaker is not None else CircuitBreaker()
+        self._host = urlsplit(server_url).netloc or server_url
+        self.single_flight = single_flight
+        self._flights = SingleFlight()
+        self._session = None
+        self._session_lock = threading.Lock()
+        self._executor = None
+
+    def __enter__(self) -> "dbc":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _get_session(self) -> requests.Session:
+        """
+        Returns the pooled HTTP session, creating it on first use.
+
+        Returns
+        -------
+        requests.Session
+            The session shared by all queries of this connection.
+        """
+        if self._session is None:
+            with self._session_lock:
+                if self._session is None:
+                    session = requests.Session()
+                    adapter = _PooledAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+                    session.mount("http://", adapter)
+                    session.mount("https://", adapter)
+                    if not self.keep_alive:
+                        session.headers["Connection"] = "close"
+                    self._session = session
+        return self._session
+
+    def close(self):
+        """
+        Closes all pooled connections. The connection can still be used
+        afterwards, in which case a new pool is created.
+        """
+        # Workers may still need the lock to get the session, so the
+        # executor is shut down after releasing it
+        with self._session_lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+        with self._session_lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        """
+        Returns the thread pool running the blocking HTTP calls of the
+        asynchronous API, creating it on first use.
+        """
+        if self._executor is None:
+            with self._session_lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.concurrency,
+                                                        thread_name_prefix="wdc-dbc")
+        return self._executor
+
+    def connection_stats(self) -> Dict[str, Dict[str, Union[int, List[int]]]]:
+        """
+        Reports how often the pooled connections were reused.
+
+        Returns
+        -------
+        Dict[str, Dict[str, Union[int, List[int]]]]
+            For every host the number of connections opened, the number of
+            requests sent, how many of those requests reused an already
+            open connection and the reuse count of every open connection.
+        """
+        if self._session is None:
+            return {}
+        return self._session.get_adapter(self.url).stats()
+
+    def _post_once(self, query: str, stream: bool, timeout: float) -> requests.Response:
+        span = _current_span.get()
+        if span is not None:
+            phases = len(span.children)
+            start = time.perf_counter()
+        # The body is read separately, so the wait for the server and the
+        # transfer can be told apart
+        response = self._get_session().post(self.url, {'query': query}, stream=True, timeout=timeout)
+        if span is not None:
+            headers_at = time.perf_counter()
+            opened = [child.end for child in span.children[phases:] if child.name in ("connect", "tls")]
+            span.add_child("server_wait", max(opened, default=start), headers_at)
+        try:
+            response.raise_for_status()  # Raises HTTP error
+            if not stream:
+                response.content
+        except Exception:
+            response.close()
+            raise
+        if span is not None and not stream:
+            span.add_child("transfer", headers_at, time.perf_counter())
+        return response
+
+    def _post(self, query: Query, stream: bool = False) -> requests.Response:
+        """
+        Posts a query to the server and returns the successful response.
+        With stream=True the body is not read yet, and failures while it is
+        read are not retried.
+
+        Transient failures are retried following the retry policy, within
+        the current deadline, and every attempt is reported to the circuit
+        breaker. Every failure but a rejected query (4xx) counts against the
+        server, but only transient failures are retried.
+
+        Raises:
+            CircuitOpenError: If requests to the server are paused
+            DeadlineExceededError: If the deadline passed
+            QueryError: The subclass matching the last failure
+        """
+        wcps_query = str(query)
+        span = _current_span.get()
+        retries = 0
+        while True:
+            if span is not None:
+                span.attributes["attempts"] = retries + 1
+            remaining = remaining_time()
+            if remaining is not None and remaining <= 0:
+                raise DeadlineExceededError("Error. The deadline of the query has passed", query=wcps_query)
+            if not self.breaker.allow(self._host):
+                raise CircuitOpenError(f"Error. Requests to {self._host} are paused after repeated failures",
+                                       query=wcps_query)
+
+            timeout = self.timeout
+            if remaining is not None:
+                timeout = remaining if timeout is None else min(timeout, remaining)
+            interrupted = True
+            try:
+                response = self._post_once(wcps_query, stream, timeout)
+            except Exception as exc:
+                interrupted = False
+                error = _query_error(exc, wcps_query)
+                # A rejected query shows that the server is up
+                if isinstance(error, InvalidQueryError):
+                    self.breaker.record_success(self._host)
+                    raise error from exc
+                self.breaker.record_failure(self._host)
+                if not isinstance(error, TransientQueryError) or retries + 1 >= self.retry.max_attempts:
+                    raise error from exc
+
+                delay = self.retry.backoff(retries)
+                remaining = remaining_time()
+                if remaining is not None and delay >= remaining:
+                    raise DeadlineExceededError(f"Error. The deadline of the query passed while retrying: {error}",
+                                                query=wcps_query, status_code=error.status_code) from exc
+                if span is not None:
+                    span.add_child("retry_wait", time.perf_counter(), time.perf_counter() + delay)
+                emit("query_retried", "Retrying in {delay:.3f} s after: {error}", error=error,
+                     delay=delay, attempt=retries + 1, query=wcps_query)
+                time.sleep(delay)
+                retries += 1
+                continue
+            else:
+                interrupted = False
+                self.breaker.record_success(self._host)
+                return response
+            finally:
+                # Interrupted attempts, e.g. by KeyboardInterrupt, must not leave a probe in flight
+                if interrupted:
+                    self.breaker.release(self._host)
+
+    def _send(self, query: Query) -> bytes:
+        """
+        Posts a query to the server and returns the raw response body.
+        If a result cache is configured it is consulted first, and
+        successful results are stored in it. If a local engine is
+        configured it executes the query instead of the server.
+        """
+        span = _current_span.get()
+        if self.engine is not None:
+            if span is None:
+                return self.engine.execute(str(query))
+            start = time.perf_counter()
+            content = self.engine.execute(str(query))
+            span.add_child("execute", start, time.perf_counter())
+        elif self.cache is None:
+            content = self._fetch(str(query))
+        else:
+            wcps_query = str(query)
+            content = self.cache.get(self.url, wcps_query)
+            if span is not None:
+                span.attributes["cache"] = "miss" if content is None else "hit"
+            if content is None:
+                content = self._fetch(wcps_query)
+                self.cache.put(self.url, wcps_query, content)
+        if span is not None:
+            span.attributes["bytes"] = len(content)
+        return content
+
+    def _execute(self, query: Query, decode=None):
+        """
+        Sends a query like _send and decodes the result with `decode`, if
+        given. While spans are recorded (see wdc.add_hook) both are
+        recorded as the span of the query.
+
+        Raises:
+            QueryError: If the query could not be executed. Exceptions
+                raised by decode are passed on unchanged.
+        """
+        span = start_span("wdc.query")
+        try:
+            if span is None:
+                wcps_query = str(query)
+            else:
+                span.attributes.update(_query_attributes(query))
+                start = time.perf_counter()
+                wcps_query = str(query)
+                span.add_child("build", start, time.perf_counter())
+            try:
+                result = self._send(wcps_query)
+            except Exception as exc:
+                error = _query_error(exc, wcps_query)
+                if error is exc:
+                    raise
+                raise error from exc
+            if decode is not None and span is None:
+                result = decode(result)
+            elif decode is not None:
+                start = time.perf_counter()
+                result = decode(result)
+                span.add_child("decode", start, time.perf_counter())
+        except BaseException as exc:
+            end_span(span, exc)
+            raise
+        end_span(span)
+        return result
+
+    def _fetch(self, query: str) -> bytes:
+        """
+        Posts a query and returns the response body. With single-flight,
+        a query already in flight is not sent again; its result is shared.
+        """
+        if not self.single_flight:
+            return self._post(query).content
+        span = _current_span.get()
+        led = span is None
+
+        def post() -> bytes:
+            nonlocal led
+            led = True
+            return self._post(query).content
+
+        try:
+            content = self._flights.do(normalize_query(query), post, timeout=remaining_time())
+            if not led:
+                span.attributes["shared"] = True
+            return content
+        except TimeoutError as exc:
+            raise DeadlineExceededError("Error. The deadline passed while waiting for the same query",
+                                        query=query) from exc
 
     def execute_query(self, query: Query) -> Union[int, float, Image, Diagram]:
         """
+        Executes a query and returns its result, or an error message if it
+        failed. The outcome is logged as the event query_succeeded or
+        query_failed (see wdc.Events) instead of being printed.
+
         Args:
-            query (str): The query that was built to be executed by user
+            query (str): The query that was built to be executed by user,
+                either as WCPS text or as a wdc.Query object
 
         Returns:
             Union[int, float, Image, Diagram]: All possible return types for a query
         """
         try:
-            response = requests.post(self.url, {'query': query})
-            response.raise_for_status()  # Raises HTTP error
-            print("Connection successful!")  # Add this line to indicate success
-            return response.content
-        except HTTPError as err:
-            print(f"Connection failed: {err}")  # Add this line to indicate failure
-            if response.status_code == 500:
+            content = self._execute(query)
+            emit("query_succeeded", "Query succeeded ({bytes} bytes)", query=query, bytes=len(content))
+            return content
+        except QueryError as err:
+            emit("query_failed", "Query failed: {error}", logging.WARNING,
+                 query=query, error=err, status_code=err.status_code)
+            if err.status_code == 500:
                 return f"The server encountered an error and could not process your request: {err}"
-            else:
+            elif err.status_code is not None:
                 return f"The page isn't working right now. Please try again: {err}"
+            else:
+                return str(err)
         except Exception as exc:
-            print(f"An unexpected error has occurred: {exc}")  # Add this line to indicate failure
+            emit("query_failed", "Query failed: {error}", logging.WARNING, query=query, error=exc, status_code=None)
             return f"An unexpected error has occurred: {exc}"
 
+    def execute_query_bytes(self, query: Query) -> bytes:
+        """
+        Executes a query and returns its raw result. Unlike execute_query,
+        failures are raised instead of being returned as error strings.
+
+        Args:
+            query (str): WCPS text, or any object whose str() is WCPS text
+                such as wdc.Query or wdc.Datacube
+
+        Returns:
+            bytes: The result as returned by the server
+
+        Raises:
+            QueryError: If the query could not be executed
+        """
+        return self._execute(query)
+
+    def execute_query_array(self, query: Query, dtype=None):
+        """
+        Executes a query and decodes its text/csv or scalar result into a
+        NumPy array, shaped after the subsets of the query.
+
+        Args:
+            query (str): WCPS text or wdc.Query object. Passing the Query
+                object lets the result shape be inferred from its subsets.
+            dtype (numpy dtype, optional): The type of the values. Defaults
+                to int64 or float64, depending on the payload.
+
+        Returns:
+            numpy.ndarray: The decoded result
+
+        Raises:
+            QueryError: If the query could not be executed
+        """
+        from wdc.Decode import decode_result
+
+        def decode(content: bytes):
+            return decode_result(content, query=None if isinstance(query, str) else query, dtype=dtype)
+
+        return self._execute(query, decode)
+
+    def execute_query_image(self, query: Query):
+        """
+        Executes a query returning image/png or image/jpeg, e.g. of type
+        transform_3d_to_2d_subset or on_the_fly_colouring, and returns the
+        image undecoded. It is decoded into a NumPy array on first use.
+
+        Args:
+            query (str): WCPS text or wdc.Query object
+
+        Returns:
+            wdc.ImageResult: The encoded image
+
+        Raises:
+            QueryError: If the query could not be executed
+        """
+        from wdc.Decode import ImageResult
+
+        return ImageResult(self.execute_query_bytes(query))
+
+    def execute_many(self, queries: Iterable[Query],
+                     workers: int = None) -> List[Union[bytes, QueryError]]:
+        """
+        Executes many queries in parallel on a thread pool.
+
+        A failing query does not abort the batch. Instead of an error string
+        its slot in the result holds a QueryError carrying the query and the
+        HTTP status code, so failures can be told apart from results.
+
+        Args:
+            queries (Iterable[Query]): WCPS texts or wdc.Query objects
+            workers (int, optional): Number of queries executed at the same
+                time. Defaults to the concurrency of the connection.
+
+        Returns:
+            List[Union[bytes, QueryError]]: The results, in the order of the queries
+        """
+        queries = list(queries)
+
+        def run(query: Query) -> Union[bytes, QueryError]:
+            try:
+                return self._execute(query)
+            except Exception as exc:
+                error = _query_error(exc, str(query))
+                if error is not exc:
+                    error.__cause__ = exc
+                return error
+
+        if not queries:
+            return []
+        with ThreadPoolExecutor(max_workers=workers or self.concurrency,
+                                thread_name_prefix="wdc-batch") as executor:
+            return list(executor.map(bind_context(run), queries))
+
+    def execute_fused(self, queries: List[Query], max_batch: int = 500,
+                      workers: int = None) -> List[Union[int, float, QueryError]]:
+        """
+        Executes many single-value queries (selecting_single_value, min, max,
+        avg, when_temp_more_than_15) as a few fused requests, one per
+        coverage and per `max_batch` queries, instead of one request each.
+
+        Args:
+            queries (List[Query]): the wdc.Query objects to execute
+            max_batch (int, optional): Maximum number of queries fused into
+                one request. Defaults to 500.
+            workers (int, optional): Number of fused requests executed at the
+                same time. Defaults to the concurrency of the connection.
+
+        Returns:
+            List[Union[int, float, QueryError]]: The result of every query, in
+            order. If a fused request fails, each of its queries gets a QueryError.
+        """
+        from wdc.Fusion import FusedQuery, fusion_groups
+
+        queries = list(queries)
+        batches = fusion_groups(queries, max_batch)
+        fused_queries = [FusedQuery([queries[index] for index in batch]) for batch in batches]
+        payloads = self.execute_many(fused_queries, workers=workers)
+
+        results = [None] * len(queries)
+        for batch, fused, payload in zip(batches, fused_queries, payloads):
+            if not isinstance(payload, QueryError):
+                try:
+                    values = fused.split(payload)
+                except ValueError as err:
+                    payload = QueryError(str(err), query=str(fused))
+            if isinstance(payload, QueryError):
+                values = [payload] * len(batch)
+            for index, value in zip(batch, values):
+                results[index] = value
+        return results
+
+    def execute_tiled(self, query: Query, grids: Dict, max_cells: int = 250000,
+                      workers: int = None, progress=None, dtype=None, axes: List[str] = None):
+        """
+        Executes a query over a large subset as many smaller tile queries,
+        fetched concurrently, and reassembles their results, so neither the
+        server nor one response has to hold the whole subset.
+
+        Args:
+            query (Query): wdc.Query whose params give the subset. Other
+                queries, e.g. wdc.Datacube, can be tiled with
+                wdc.plan_tiles and wdc.fetch_tiles.
+            grids (Dict[str, wdc.AxisGrid]): The grid of every axis that
+                may be split, used to size the tiles in cells
+            max_cells (int, optional): Maximum number of cells per tile.
+                Defaults to 250000.
+            workers (int, optional): Number of tiles fetched at the same
+                time. Defaults to the concurrency of the connection.
+            progress (Callable[[int, int], None], optional): Called with the
+                number of tiles done and the number of tiles after every tile
+            dtype (numpy dtype, optional): The type of numeric values
+            axes (List[str], optional): The axes of the coverage in their
+                order, which the dimensions of the result follow. Defaults
+                to the axes of the local engine's coverage, or else to the
+                order of grids.
+
+        Returns:
+            Union[numpy.ndarray, PIL.Image.Image]: The values of the whole
+            subset, or one mosaic for image/png and image/jpeg results
+
+        Raises:
+            QueryError: If a tile could not be fetched
+        """
+        from wdc.Tiling import fetch_tiles, plan_tiles
+
+        plan = plan_tiles(query.params or [], grids, max_cells=max_cells,
+                          axes=axes if axes is not None else self._coverage_axes(query))
+        return fetch_tiles(self, query, plan, workers=workers, progress=progress, dtype=dtype)
+
+    def _coverage_axes(self, query: Query) -> List[str]:
+        """
+        Returns the axes of the coverage of a query on the local engine, or
+        None if they are not known.
+        """
+        coverage = getattr(query, "coverage", None)
+        if self.engine is None or coverage is None:
+            return None
+        try:
+            return list(self.engine.get_coverage(coverage).axes)
+        except ValueError:
+            return None
+
+    def execute_aggregate(self, query: Query, grids: Dict, max_cells: int = 250000,
+                          split_axes: List[str] = None, workers: int = None) -> Union[int, float]:
+        """
+        Executes a min, max, avg or when_temp_more_than_15 (count) query as
+        partial aggregates of tiles or time chunks, executed in parallel and
+        combined client-side, so long ranges finish in the time of one tile
+        instead of timing out as one request. avg is combined as the total
+        sum divided by the total count.
+
+        Args:
+            query (Query): wdc.Query of a type listed in decomposableTypes
+            grids (Dict[str, wdc.AxisGrid]): The grid of every axis that
+                may be split, used to size the tiles in cells
+            max_cells (int, optional): Maximum number of cells per tile.
+                Defaults to 250000.
+            split_axes (List[str], optional): The axes that may be split,
+                e.g. ["ansi"] for time chunks. Defaults to every axis with a grid.
+            workers (int, optional): Number of partial queries executed at
+                the same time. Defaults to the concurrency of the connection.
+
+        Returns:
+            Union[int, float]: The aggregate, as one request would return it
+
+        Raises:
+            QueryError: If a partial query failed
+        """
+        from wdc.Aggregate import aggregate_tiles
+        from wdc.Tiling import plan_tiles
+
+        # Partial aggregates are combined into one value, so the order of the axes does not matter
+        plan = plan_tiles(query.params or [], grids, max_cells=max_cells, split_axes=split_axes,
+                          axes=[param.param for param in query.params or []])
+        return aggregate_tiles(self, query, plan, workers=workers)
+
+    def execute_query_stream(self, query: Query, chunk_size: int = 65536) -> Iterator[bytes]:
+        """
+        Executes a query and yields its result in chunks as they arrive.
+
+        Only one chunk is held in memory at a time, so large encode()
+        results or exports never have to fit in memory. The connection is
+        returned to the pool once the iteration finishes or is abandoned.
+
+        Args:
+            query (str): WCPS text or wdc.Query object
+            chunk_size (int, optional): Maximum size of a chunk in bytes.
+                Defaults to 64 KiB.
+
+        Yields:
+            bytes: The next chunk of the result
+
+        Raises:
+            QueryError: If the query could not be executed
+        """
+        wcps_query = str(query)
+        if self.engine is not None:
+            content = self.execute_query_bytes(wcps_query)
+            for start in range(0, len(content), chunk_size):
+                yield content[start:start + chunk_size]
+            return
+
+        span = start_span("wdc.query")
+        if span is not None:
+            span.attributes.update(_query_attributes(query))
+        try:
+            response = self._post(wcps_query, stream=True)
+        except Exception as exc:
+            end_span(span, exc)
+            error = _query_error(exc, wcps_query)
+            if error is exc:
+                raise
+            raise error from exc
+        if span is None:
+            with response:
+                try:
+                    for chunk in response.iter_content(chunk_size=chunk_size):
+                        if chunk:
+                            yield chunk
+                except requests.RequestException as exc:
+                    raise _query_error(exc, wcps_query) from exc
+            return
+
+        # The span stays open while the body is consumed, but the consumer
+        # runs in between, so it is no longer the current span
+        _current_span.set(span.parent)
+        start = time.perf_counter()
+        received = 0
+        error = None
+        with response:
+            try:
+                for chunk in response.iter_content(chunk_size=chunk_size):
+                    if chunk:
+                        received += len(chunk)
+                        yield chunk
+            except requests.RequestException as exc:
+                error = exc
+                raise _query_error(exc, wcps_query) from exc
+            finally:
+                span.add_child("transfer", start, time.perf_counter())
+                span.attributes["bytes"] = received
+                end_span(span, error)
+
+    def execute_query_to(self, query: Query, destination: Union[str, os.PathLike, BinaryIO],
+                         chunk_size: int = 65536) -> int:
+        """
+        Executes a query and writes its result straight to a file, one chunk
+        at a time.
+
+        Args:
+            query (str): WCPS text or wdc.Query object
+            destination (Union[str, os.PathLike, BinaryIO]): Path of the file
+                to create, or a binary file-like object to write to. A file
+                created from a path is removed again if the query fails.
+            chunk_size (int, optional): Maximum size of a chunk in bytes.
+                Defaults to 64 KiB.
+
+        Returns:
+            int: The number of bytes written
+
+        Raises:
+            QueryError: If the query could not be executed
+        """
+        if hasattr(destination, "write"):
+            written = 0
+            for chunk in self.execute_query_stream(query, chunk_size=chunk_size):
+                destination.write(chunk)
+                written += len(chunk)
+            return written
+
+        try:
+            with open(destination, "wb") as output:
+                return self.execute_query_to(query, output, chunk_size=chunk_size)
+        except BaseException:
+            if os.path.exists(destination):
+                os.remove(destination)
+            raise
+
+    async def execute_query_async(self, query: Query) -> Union[int, float, Image, Diagram]:
+        """
+        Asynchronous counterpart of execute_query.
+
+        The request is sent from a worker thread using the pooled session,
+        so the event loop stays free while waiting for the server.
+
+        Args:
+            query (str): The query that was built to be executed by user,
+                either as WCPS text or as a wdc.Query object
+
+        Returns:
+            Union[int, float, Image, Diagram]: The same result execute_query returns
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._get_executor(), bind_context(self.execute_query), query)
+
+    async def execute_queries_async(self, queries: Iterable[Query],
+                                    concurrency: int = None) -> List[Union[int, float, Image, Diagram]]:
+        """
+        Executes many queries concurrently, keeping at most `concurrency`
+        of them in flight at the same time.
+
+        Args:
+            queries (Iterable[Query]): WCPS texts or wdc.Query objects
+            concurrency (int, optional): Maximum number of queries in flight.
+                Defaults to the concurrency of the connection. Higher limits
+                run on threads of their own; connections beyond the pool size
+                are closed after their query
+
+        Returns:
+            List[Union[int, float, Image, Diagram]]: The results, in the order
+            of the queries
+        """
+        limit = concurrency or self.concurrency
+        semaphore = asyncio.Semaphore(limit)
+        loop = asyncio.get_running_loop()
+        # The shared thread pool only has `self.concurrency` threads
+        if limit <= self.concurrency:
+            executor = self._get_executor()
+        else:
+            executor = ThreadPoolExecutor(max_workers=limit, thread_name_prefix="wdc-dbc")
+
+        async def bounded(query):
+            async with semaphore:
+                return await loop.run_in_executor(executor, bind_context(self.execute_query), query)
+
+        try:
+            return await asyncio.gather(*(bounded(query) for query in queries))
+        finally:
+            if executor is not self._executor:
+                executor.shutdown(wait=False)
+
     def get_all_possible_coverages(self) -> List[str]:
         """
         Retrieves a list of all available coverages from the rasdaman server.
@@ -76,21 +1034,21 @@ class dbc:
         List[str]
             A list of strings representing the names of all available coverages.
         """
-        get_capabilities_url = "https://ows.rasdaman.org/rasdaman/ows?&SERVICE=WCS&VERSION=2.1.0&REQUEST=GetCapabilities"
-        response = requests.post(get_capabilities_url)
+        if self.engine is not None:
+            return self.engine.coverage_names()
+
+        # The capabilities are served by the same endpoint as the queries
+        base_url = self.url.split("?")[0]
+        get_capabilities_url = f"{base_url}?&SERVICE=WCS&VERSION=2.1.0&REQUEST=GetCapabilities"
+        response = self._get_session().post(get_capabilities_url)
         if response.status_code == 200:
-            print("Connection successful!")  # Add this line to indicate success
+            emit("capabilities_received", "Received the coverages of {url}", url=base_url)
         else:
-            print(f"Connection failed: {response.status_code}")  # Add this line to indicate failure
+            emit("capabilities_failed", "Requesting the coverages of {url} failed: {status_code}", logging.WARNING,
+                 url=base_url, status_code=response.status_code)
         coverage_names = []
         root = ET.fromstring(response.content)
         namespaces = {'wcs20': 'http://www.opengis.net/wcs/2.0'}
         for coverage in root.findall(".//wcs20:CoverageId", namespaces):
             coverage_names.append(coverage.text)
         return coverage_names
-
-
-# Finding all coverages to validate coverages users wish to use (applied in wdc/Query.py)
-obj = dbc("https://ows.rasdaman.org/rasdaman/ows?REQUEST=GetCoverage")
-allCoverages = obj.get_all_possible_coverages()
-print("Available coverages:", allCoverages)
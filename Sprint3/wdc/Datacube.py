@@ -0,0 +1,865 @@
+import numbers
+from typing import Dict, Iterable, List, Tuple, Union
+
+# Importing user-defined modules
+from wdc.Decode import ImageResult, decode_result, imageTypes
+from wdc.Params import Params
+from wdc.Query import returnTypes
+
+# Operators of binary nodes, as they are written in WCPS
+binaryOperators = ["+", "-", "*", "/", ">", "<", ">=", "<=", "=", "!=", "and", "or", "xor"]
+
+# Functions applied cell by cell, and the condensers reducing a coverage to
+# a single value (WCPS calls the sum of a coverage "add")
+unaryFunctions = ["-", "not", "abs", "sqrt", "exp", "log", "ln"]
+aggregateTypes = ["min", "max", "avg", "add", "count"]
+
+# Letters of the iterators bound to the coverages of an expression, in order
+_ITERATOR_LETTERS = "cdefghjkmnpqrstuwxyz"
+
+# Marks a derived datacube keeping the axes of the one it was derived from
+_SAME_AXES = object()
+
+class ExprNode:
+    """
+    An immutable node of a datacube expression graph.
+
+    Nodes never change once they are built, so the same node can be shared
+    by several expressions, which makes the expressions a directed acyclic
+    graph. Nodes built in the same way have the same key and compare equal.
+
+    Attributes
+    ----------
+    op : str
+        The kind of node: "coverage", "literal", "struct", "subset",
+        "scale", "binary", "unary", "switch", "aggregate" or "encode", and
+        the "construct" and "index" nodes of parsed coverage constructors.
+    args : tuple
+        The arguments of the node, e.g. the coverage name, the operator or
+        the (axis, start_val, end_val) subsets.
+    children : Tuple[ExprNode, ...]
+        The expressions the node is applied to.
+
+    Methods
+    -------
+    __init__(self, op: str, args: tuple = (), children: tuple = ())
+        Initializes the node.
+
+    key(self) -> tuple
+        Returns the structural identity of the node.
+
+    coverages(self) -> List[str]
+        Returns the coverages the expression reads from.
+    """
+
+    __slots__ = ("op", "args", "children", "_key", "_hash")
+
+    def __init__(self, op: str, args: tuple = (), children: tuple = ()):
+        """
+        Initializes the node.
+
+        Parameters:
+        -----------
+        op : str
+            The kind of node.
+        args : tuple, optional
+            The arguments of the node. Defaults to ().
+        children : tuple, optional
+            The nodes the node is applied to. Defaults to ().
+        """
+        self.op = op
+        self.args = tuple(args)
+        self.children = tuple(children)
+        self._key = None
+        self._hash = None
+
+
+    @property
+    def key(self) -> tuple:
+        """
+        Returns the structural identity of the node, built once.
+        """
+        if self._key is None:
+            self._key = (self.op, self.args, tuple(child.key for child in self.children))
+        return self._key
+
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, ExprNode) and (self is other or self.key == other.key)
+
+
+    def __hash__(self) -> int:
+        if self._hash is None:
+            self._hash = hash(self.key)
+        return self._hash
+
+
+    def __repr__(self) -> str:
+        return f"ExprNode({self.op!r}, {self.args!r})"
+
+
+    def coverages(self) -> List[str]:
+        """
+        Returns the coverages the expression reads from.
+
+        Returns:
+        --------
+        List[str]
+            The coverage names, in the order they first appear.
+        """
+        found = []
+        seen = set()
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            if id(node) in seen:
+                continue
+            seen.add(id(node))
+            if node.op == "coverage" and node.args[0] not in found:
+                found.append(node.args[0])
+            # Reversed, so the children are visited from left to right
+            stack.extend(reversed(node.children))
+        return found
+
+
+def _format_value(value) -> str:
+    """
+    Returns a subset bound, scale factor or literal as it is written in WCPS.
+    """
+    if isinstance(value, str):
+        return f'"{value}"'
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return str(value)
+
+
+def _format_axis(axis: str, start_val, end_val=None) -> str:
+    if end_val is None:
+        return f"{axis}({_format_value(start_val)})"
+    return f"{axis}({_format_value(start_val)}:{_format_value(end_val)})"
+
+
+def _iterator(index: int) -> str:
+    if index < len(_ITERATOR_LETTERS):
+        return "$" + _ITERATOR_LETTERS[index]
+    return f"$c{index}"
+
+
+def is_scalar(node: ExprNode) -> bool:
+    """
+    Returns whether an expression is known to evaluate to a single value
+    rather than to a coverage.
+
+    Parameters:
+    -----------
+    node : ExprNode
+        The expression.
+
+    Returns:
+    --------
+    bool
+        True for condensers, literals, records and arithmetic on them.
+    """
+    if node.op in ("aggregate", "literal", "struct"):
+        return True
+    if node.op in ("binary", "unary", "switch"):
+        return all(is_scalar(child) for child in node.children)
+    return False
+
+
+def shared_nodes(node: ExprNode) -> List[ExprNode]:
+    """
+    Returns the subexpressions that occur more than once in an expression.
+
+    Parameters:
+    -----------
+    node : ExprNode
+        The root of the expression.
+
+    Returns:
+    --------
+    List[ExprNode]
+        The repeated subexpressions, every one after the subexpressions it
+        contains. Coverages, literals and records are not included, as
+        they cost nothing to repeat.
+    """
+    counts = {}
+    order = []
+
+    def visit(current: ExprNode):
+        if current in counts:
+            counts[current] += 1
+            return
+        counts[current] = 1
+        for child in current.children:
+            visit(child)
+        order.append(current)
+
+    visit(node)
+    return [current for current in order
+            if counts[current] > 1 and current.op not in ("coverage", "literal", "struct")]
+
+
+class _Renderer:
+    """
+    Writes an expression graph as WCPS. Identical nodes are rendered once,
+    and the nodes bound by a let clause are written as their variable.
+    """
+
+    def __init__(self, iterators: Dict[str, str], variables: Dict[ExprNode, str] = None):
+        self.iterators = iterators
+        self.variables = variables if variables is not None else {}
+        self._rendered = {}
+
+
+    def render(self, node: ExprNode) -> str:
+        variable = self.variables.get(node)
+        if variable is not None:
+            return variable
+        return self.render_definition(node)
+
+
+    def render_definition(self, node: ExprNode) -> str:
+        """
+        Renders a node itself, even if a variable is bound to it.
+        """
+        text = self._rendered.get(node)
+        if text is None:
+            text = self._render(node)
+            self._rendered[node] = text
+        return text
+
+
+    def _operand(self, node: ExprNode) -> str:
+        """
+        Renders a node used as an operand, in parentheses where needed.
+        """
+        text = self.render(node)
+        if node in self.variables:
+            return text
+        if node.op in ("binary", "switch") or (node.op == "literal" and text.startswith("-")):
+            return f"({text})"
+        return text
+
+
+    def _render(self, node: ExprNode) -> str:
+        op = node.op
+
+        if op == "coverage":
+            return self.iterators[node.args[0]]
+
+        elif op == "literal":
+            return _format_value(node.args[0])
+
+        elif op == "struct":
+            return "{" + "; ".join(f"{name}: {_format_value(value)}" for name, value in node.args) + "}"
+
+        elif op == "subset":
+            (child,) = node.children
+            source = self.render(child)
+            if child not in self.variables and child.op not in ("coverage", "subset"):
+                source = f"({source})"
+            return source + "[" + ", ".join(_format_axis(*subset) for subset in node.args) + "]"
+
+        elif op == "scale":
+            (child,) = node.children
+            if len(node.args) == 1 and node.args[0][0] is None:
+                return f"scale({self.render(child)}, {_format_value(node.args[0][1])})"
+            axes = []
+            for axis, factor in node.args:
+                if isinstance(factor, tuple):
+                    axes.append(_format_axis(axis, *factor))
+                else:
+                    axes.append(_format_axis(axis, factor))
+            return f"scale({self.render(child)}, {{ {', '.join(axes)} }})"
+
+        elif op == "binary":
+            left, right = node.children
+            return f"{self._operand(left)} {node.args[0]} {self._operand(right)}"
+
+        elif op == "unary":
+            (child,) = node.children
+            if node.args[0] == "-":
+                return f"-{self._operand(child)}"
+            return f"{node.args[0]}({self.render(child)})"
+
+        elif op == "switch":
+            *cases, default = node.children
+            text = "switch"
+            for index in range(0, len(cases), 2):
+                text += f" case {self.render(cases[index])} return {self._operand(cases[index + 1])}"
+            return text + f" default return {self._operand(default)}"
+
+        elif op == "aggregate":
+            return f"{node.args[0]}({self.render(node.children[0])})"
+
+        elif op == "index":
+            return node.args[0]
+
+        elif op == "construct":
+            name, axes = node.args
+            domain = ", ".join(f"{variable} {_format_axis(axis, start_val, end_val)}"
+                               for variable, axis, start_val, end_val in axes)
+            return f"coverage {name} over {domain} values {self.render(node.children[0])}"
+
+        elif op == "encode":
+            return f'encode({self.render(node.children[0])}, "{node.args[0]}")'
+
+        raise ValueError(f"Error. Unsupported expression node: {op}")
+
+
+def compile_wcps(node: ExprNode, hoist: bool = True) -> str:
+    """
+    Compiles an expression graph into a single WCPS query.
+
+    Every coverage the expression reads from is bound to its own iterator,
+    $c for the first one, $d for the second one and so on. Subexpressions
+    occurring more than once, such as the same subset compared in several
+    switch cases, are bound to a variable ($v0, $v1, ...) by a let clause,
+    so the server evaluates them, and reads their cells, only once.
+
+    Parameters:
+    -----------
+    node : ExprNode
+        The root of the expression.
+    hoist : bool, optional
+        Whether repeated subexpressions are bound by a let clause. Defaults
+        to True.
+
+    Returns:
+    --------
+    str
+        The WCPS query.
+    """
+    coverages = node.coverages()
+    if not coverages:
+        raise ValueError("Error. The expression does not read from any coverage")
+
+    iterators = {coverage: _iterator(index) for index, coverage in enumerate(coverages)}
+    bindings = ", ".join(f"{iterators[coverage]} in ( {coverage} )" for coverage in coverages)
+
+    variables = {}
+    renderer = _Renderer(iterators, variables)
+    definitions = []
+    for shared in (shared_nodes(node) if hoist else []):
+        # Rendered before its variable is registered, using the variables
+        # of the subexpressions it contains
+        definitions.append(f"$v{len(variables)} := {renderer.render_definition(shared)}")
+        variables[shared] = f"$v{len(variables)}"
+
+    query = f"for {bindings}\n"
+    if definitions:
+        query += " let " + ",\n     ".join(definitions) + "\n"
+    return query + f" return {renderer.render(node)}"
+
+
+class Axis:
+    """
+    A class naming an axis, called to build the Params of a subset, e.g.
+    Lat(35, 75) for a range and Lat(53.08) for a single value.
+
+    Attributes
+    ----------
+    name : str
+        The name of the axis.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+
+
+    def __call__(self, start_val: Union[str, int, float],
+                 end_val: Union[str, int, float] = None) -> Params:
+        return Params(self.name, start_val, end_val)
+
+
+    def __repr__(self) -> str:
+        return f"Axis({self.name!r})"
+
+
+# The axes of the coverages on the rasdaman demo server
+Lat = Axis("Lat")
+Long = Axis("Long")
+ansi = Axis("ansi")
+
+class Datacube:
+    """
+    A class building WCPS queries lazily, from operations on a coverage.
+
+    Subsets, scaling, arithmetic, comparisons and condensers only record
+    the operation in an expression graph and return a new Datacube. Nothing
+    is sent to the server until compute() is called, which sends the whole
+    pipeline as one WCPS request, after wdc.Optimizer has rewritten it to
+    read as few cells as possible.
+
+        cube = Datacube("AvgLandTemp", connection)
+        kelvin = cube[ansi("2014-01", "2014-12"), Lat(53.08), Long(8.80)] + 273.15
+        hottest = kelvin.max().compute()
+
+    Attributes
+    ----------
+    node : ExprNode
+        The expression the datacube stands for.
+    connection : wdc.dbc
+        The connection compute() sends the query to. Defaults to None.
+    axes : Tuple[str, ...]
+        The axes of the result if they are known, otherwise None. Subsets
+        on other axes are rejected.
+
+    Methods
+    -------
+    __init__(self, coverage: str, connection=None, axes: Iterable[str] = None)
+        Initializes a datacube reading from a coverage.
+
+    __getitem__(self, subsets) -> Datacube
+        Subsets the datacube, e.g. cube[Lat(35, 75), Long(-20, 40)].
+
+    subset(self, selection: dict = None, **axes) -> Datacube
+        Subsets the datacube, e.g. cube.subset(Lat=(35, 75), ansi="2014-07").
+
+    scale(self, factor=None, **axes) -> Datacube
+        Scales the datacube by a factor, or every axis to a factor or extent.
+
+    min(self), max(self), avg(self), sum(self), count(self) -> Datacube
+        Condenses the datacube into a single value.
+
+    encode(self, return_type: str) -> Datacube
+        Encodes the result in one of the supported return types.
+
+    get_return_type(self) -> str
+        Returns the format of the result.
+
+    get_wcps(self, optimize: bool = True) -> str
+        Returns the WCPS query of the datacube, optimized by default.
+
+    compute(self, connection=None, dtype=None)
+        Sends the query to the server and returns its result.
+    """
+
+    # Defining __eq__ would otherwise make datacubes unhashable
+    __hash__ = object.__hash__
+
+    def __init__(self, coverage: str, connection=None, axes: Iterable[str] = None):
+        """
+        Initializes a datacube reading from a coverage. The coverage is not
+        checked here, so that building a query never contacts the server.
+
+        Parameters:
+        -----------
+        coverage : str
+            The coverage to read from.
+        connection : wdc.dbc, optional
+            The connection compute() sends the query to. Defaults to None.
+        axes : Iterable[str], optional
+            The axes of the coverage, used to reject subsets on unknown
+            axes. Defaults to None, meaning any axis is accepted.
+        """
+        self.node = ExprNode("coverage", (coverage,))
+        self.connection = connection
+        self.axes = tuple(axes) if axes is not None else None
+        self._wcps = None
+
+
+    def _derive(self, node: ExprNode, axes: Tuple[str, ...] = _SAME_AXES,
+                connection=None) -> "Datacube":
+        """
+        Returns a new datacube standing for the given expression.
+        """
+        cube = Datacube.__new__(Datacube)
+        cube.node = node
+        cube.connection = connection if connection is not None else self.connection
+        cube.axes = self.axes if axes is _SAME_AXES else axes
+        cube._wcps = None
+        return cube
+
+
+    def _check_open(self):
+        if self.node.op == "encode":
+            raise ValueError("Error. An encoded datacube cannot be processed any further")
+
+
+    def _check_axis(self, axis: str):
+        if self.axes is not None and axis not in self.axes:
+            raise ValueError(f"Invalid axis name: {axis}, possible axes are: {self.axes}")
+
+
+    def __repr__(self) -> str:
+        return f"Datacube({', '.join(self.node.coverages())}: {self.node.op})"
+
+
+    def __bool__(self):
+        raise ValueError("Error. A datacube has no truth value before it is computed, "
+                         "use & and | instead of 'and' and 'or'")
+
+
+    def __getitem__(self, subsets) -> "Datacube":
+        """
+        Subsets the datacube.
+
+        Parameters:
+        -----------
+        subsets : Union[Params, dict, tuple]
+            One or more Params, e.g. cube[Lat(35, 75), Long(8.80)], or a
+            dict mapping axes to a value or a (start, end) tuple.
+
+        Returns:
+        --------
+        Datacube
+            The subset datacube.
+        """
+        if not isinstance(subsets, tuple):
+            subsets = (subsets,)
+
+        selection = []
+        for subset in subsets:
+            if isinstance(subset, Params):
+                selection.append((subset.param, subset.start_val, subset.end_val))
+            elif isinstance(subset, dict):
+                for axis, value in subset.items():
+                    if isinstance(value, tuple):
+                        start_val, end_val = value
+                        selection.append((axis, start_val, end_val))
+                    else:
+                        selection.append((axis, value, None))
+            else:
+                raise ValueError(f"Invalid subset type: {type(subset)}, please use Params or a dict")
+        return self._subset(selection)
+
+
+    def subset(self, selection: dict = None, **axes) -> "Datacube":
+        """
+        Subsets the datacube.
+
+        Parameters:
+        -----------
+        selection : dict, optional
+            Maps axes to a value or a (start, end) tuple.
+        **axes
+            The same as keywords, e.g. subset(Lat=(35, 75), ansi="2014-07").
+
+        Returns:
+        --------
+        Datacube
+            The subset datacube.
+        """
+        return self[dict(selection or {}, **axes)]
+
+
+    def _subset(self, selection: List[tuple]) -> "Datacube":
+        self._check_open()
+        if not selection:
+            raise ValueError("Error. Please provide at least one subset")
+
+        names = [axis for axis, _, _ in selection]
+        if len(set(names)) != len(names):
+            raise ValueError(f"Error. Every axis can only be subset once, got {names}")
+
+        for axis, start_val, end_val in selection:
+            self._check_axis(axis)
+            if start_val is None:
+                raise ValueError(f"Invalid subset for axis {axis}: a value is required")
+
+        axes = self.axes
+        if axes is not None:
+            # A single value removes its axis, a range keeps it
+            sliced = {axis for axis, _, end_val in selection if end_val is None}
+            axes = tuple(axis for axis in axes if axis not in sliced)
+
+        return self._derive(ExprNode("subset", tuple(selection), (self.node,)), axes)
+
+
+    def scale(self, factor: Union[int, float, dict] = None, **axes) -> "Datacube":
+        """
+        Scales the datacube.
+
+        Parameters:
+        -----------
+        factor : Union[int, float, dict], optional
+            A factor applied to every axis, or a dict mapping axes to a
+            factor or a (start, end) extent.
+        **axes
+            Factors or extents by axis, e.g. scale(Lat=0.5, Long=(0, 99)).
+
+        Returns:
+        --------
+        Datacube
+            The scaled datacube.
+        """
+        self._check_open()
+
+        if isinstance(factor, dict):
+            axes = dict(factor, **axes)
+            factor = None
+        if factor is not None and axes:
+            raise ValueError("Error. Please scale either by one factor or by axis")
+
+        if factor is not None:
+            if not isinstance(factor, numbers.Real):
+                raise ValueError(f"Invalid scale factor type: {type(factor)}")
+            return self._derive(ExprNode("scale", ((None, factor),), (self.node,)))
+
+        if not axes:
+            raise ValueError("Error. Please provide a scale factor")
+
+        scales = []
+        for axis, value in axes.items():
+            self._check_axis(axis)
+            if not isinstance(value, (numbers.Real, str, tuple)):
+                raise ValueError(f"Invalid factor type for axis {axis}: {type(value)}")
+            scales.append((axis, tuple(value) if isinstance(value, tuple) else value))
+        return self._derive(ExprNode("scale", tuple(scales), (self.node,)))
+
+
+    def _operand(self, other):
+        """
+        Returns the node of the other operand of an arithmetic operation,
+        or None if it is not supported.
+        """
+        if isinstance(other, Datacube):
+            other._check_open()
+            return other.node
+        if isinstance(other, numbers.Real):
+            return ExprNode("literal", (other,))
+        return None
+
+
+    def _binary(self, operator: str, other, reflected: bool = False) -> "Datacube":
+        self._check_open()
+        other_node = self._operand(other)
+        if other_node is None:
+            return NotImplemented
+
+        left, right = (other_node, self.node) if reflected else (self.node, other_node)
+        node = ExprNode("binary", (operator,), (left, right))
+
+        axes = self.axes
+        connection = None
+        if isinstance(other, Datacube):
+            if is_scalar(self.node):
+                axes = other.axes
+            connection = other.connection if self.connection is None else None
+        return self._derive(node, axes, connection)
+
+
+    def __add__(self, other): return self._binary("+", other)
+    def __radd__(self, other): return self._binary("+", other, reflected=True)
+    def __sub__(self, other): return self._binary("-", other)
+    def __rsub__(self, other): return self._binary("-", other, reflected=True)
+    def __mul__(self, other): return self._binary("*", other)
+    def __rmul__(self, other): return self._binary("*", other, reflected=True)
+    def __truediv__(self, other): return self._binary("/", other)
+    def __rtruediv__(self, other): return self._binary("/", other, reflected=True)
+    def __gt__(self, other): return self._binary(">", other)
+    def __lt__(self, other): return self._binary("<", other)
+    def __ge__(self, other): return self._binary(">=", other)
+    def __le__(self, other): return self._binary("<=", other)
+    def __eq__(self, other): return self._binary("=", other)
+    def __ne__(self, other): return self._binary("!=", other)
+    def __and__(self, other): return self._binary("and", other)
+    def __rand__(self, other): return self._binary("and", other, reflected=True)
+    def __or__(self, other): return self._binary("or", other)
+    def __ror__(self, other): return self._binary("or", other, reflected=True)
+
+
+    def _unary(self, function: str) -> "Datacube":
+        self._check_open()
+        return self._derive(ExprNode("unary", (function,), (self.node,)))
+
+
+    def __neg__(self): return self._unary("-")
+    def __invert__(self): return self._unary("not")
+    def __abs__(self): return self._unary("abs")
+    def sqrt(self): return self._unary("sqrt")
+    def exp(self): return self._unary("exp")
+    def log(self): return self._unary("log")
+    def ln(self): return self._unary("ln")
+
+
+    def _aggregate(self, function: str) -> "Datacube":
+        self._check_open()
+        return self._derive(ExprNode("aggregate", (function,), (self.node,)), axes=())
+
+
+    def min(self): return self._aggregate("min")
+    def max(self): return self._aggregate("max")
+    def avg(self): return self._aggregate("avg")
+    def sum(self): return self._aggregate("add")
+    def count(self): return self._aggregate("count")
+
+
+    def encode(self, return_type: str) -> "Datacube":
+        """
+        Encodes the result in one of the supported return types. Results
+        that are not encoded are returned as text/csv.
+
+        Parameters:
+        -----------
+        return_type : str
+            One of the return types listed in wdc.Query.returnTypes.
+
+        Returns:
+        --------
+        Datacube
+            The encoded datacube, which can only be computed.
+        """
+        self._check_open()
+        if return_type not in returnTypes:
+            raise ValueError("Error. Please select a valid return type")
+        return self._derive(ExprNode("encode", (return_type,), (self.node,)))
+
+
+    def get_return_type(self) -> str:
+        """
+        Returns the format of the result.
+
+        Returns:
+        --------
+        str
+            The encoding of the datacube, text/csv for coverages that were
+            not encoded, or None for single values.
+        """
+        if self.node.op == "encode":
+            return self.node.args[0]
+        if is_scalar(self.node) or self.axes == ():
+            return None
+        return "text/csv"
+
+
+    def __str__(self) -> str:
+        """
+        Returns the optimized WCPS query of the datacube, built once.
+
+        Returns:
+        --------
+        str
+            The WCPS query.
+        """
+        if self._wcps is None:
+            self._wcps = self.get_wcps(optimize=True)
+        return self._wcps
+
+
+    def get_wcps(self, optimize: bool = True) -> str:
+        """
+        Returns the WCPS query of the datacube. Coverages that were not
+        encoded are encoded as text/csv.
+
+        Parameters:
+        -----------
+        optimize : bool, optional
+            Whether the expression is rewritten by wdc.Optimizer.optimize
+            first, e.g. to apply subsets before scaling. Defaults to True.
+
+        Returns:
+        --------
+        str
+            The WCPS query.
+        """
+        if optimize and self._wcps is not None:
+            return self._wcps
+
+        node = self.node
+        if node.op != "encode" and self.get_return_type() is not None:
+            node = ExprNode("encode", ("text/csv",), (node,))
+        if optimize:
+            from wdc.Optimizer import optimize as optimize_expression
+            node = optimize_expression(node)
+        return compile_wcps(node)
+
+
+    def compute(self, connection=None, dtype=None):
+        """
+        Sends the whole expression to the server as one WCPS query and
+        returns its result.
+
+        Parameters:
+        -----------
+        connection : wdc.dbc, optional
+            The connection to use. Defaults to the connection the datacube
+            was created with.
+        dtype : numpy dtype, optional
+            The type of numeric results. Defaults to int64 or float64,
+            depending on the payload.
+
+        Returns:
+        --------
+        Union[numpy.ndarray, bytes]
+            Numeric results as a NumPy array (0-dimensional for single
+            values), images as a wdc.ImageResult, decoded on demand.
+
+        Raises:
+        -------
+        QueryError
+            If the query could not be executed.
+        """
+        connection = connection if connection is not None else self.connection
+        if connection is None:
+            raise ValueError("Error. Please provide a connection to compute the datacube")
+
+        content = connection.execute_query_bytes(self)
+        return_type = self.get_return_type()
+        if return_type in imageTypes:
+            return ImageResult(content)
+        return decode_result(content, return_type=return_type, dtype=dtype)
+
+
+def _value_node(value) -> ExprNode:
+    """
+    Returns the node of a switch condition or result: a Datacube, a number,
+    or a dict of band values such as {"red": 255, "green": 0, "blue": 0}.
+    """
+    if isinstance(value, Datacube):
+        value._check_open()
+        return value.node
+    if isinstance(value, dict):
+        return ExprNode("struct", tuple(value.items()))
+    if isinstance(value, numbers.Real):
+        return ExprNode("literal", (value,))
+    raise ValueError(f"Invalid switch value type: {type(value)}")
+
+
+def switch(cases: Iterable[Tuple[Datacube, Union[Datacube, int, float, dict]]],
+           default: Union[Datacube, int, float, dict]) -> Datacube:
+    """
+    Classifies the cells of a datacube, e.g. into the colours of a heatmap.
+
+    Every cell takes the result of the first case whose condition holds,
+    or the default result if none does.
+
+        region = cube[ansi("2014-07"), Lat(35, 75), Long(-20, 40)]
+        heatmap = switch([(region < 18, {"red": 0, "green": 0, "blue": 255}),
+                          (region < 30, {"red": 255, "green": 140, "blue": 0})],
+                         default={"red": 255, "green": 0, "blue": 0})
+
+    The region is compared in every case, but the compiled query binds it
+    to a variable with a let clause, so it is read only once.
+
+    Parameters:
+    -----------
+    cases : Iterable[Tuple[Datacube, Union[Datacube, int, float, dict]]]
+        (condition, result) pairs, in the order they are checked. Results
+        are datacubes, numbers, or dicts of band values.
+    default : Union[Datacube, int, float, dict]
+        The result of cells matching no condition.
+
+    Returns:
+    --------
+    Datacube
+        The classified datacube.
+    """
+    cases = list(cases)
+    if not cases:
+        raise ValueError("Error. Please provide at least one case")
+
+    children = []
+    for condition, result in cases:
+        if not isinstance(condition, Datacube):
+            raise ValueError(f"Invalid switch condition type: {type(condition)}")
+        children.extend((_value_node(condition), _value_node(result)))
+    children.append(_value_node(default))
+
+    values = [value for case in cases for value in case] + [default]
+    cubes = [value for value in values if isinstance(value, Datacube)]
+    source = next((cube for cube in cubes if not is_scalar(cube.node)), cubes[0])
+    connection = next((cube.connection for cube in cubes if cube.connection is not None), None)
+    return source._derive(ExprNode("switch", (), tuple(children)), connection=connection)
@@ -0,0 +1,375 @@
+import io
+import json
+import os
+import time
+import warnings
+from typing import BinaryIO, Dict, List, Tuple, Union
+
+import numpy as np
+
+# Importing user-defined modules
+from wdc.Trace import end_span, start_span
+
+# Characters that only structure a WCPS text result; they are all turned into
+# whitespace so that numpy can parse the values in a single pass
+_STRUCTURE_CHARS = b'{},;"\r\n\t'
+_TO_SPACES = bytes.maketrans(_STRUCTURE_CHARS, b' ' * len(_STRUCTURE_CHARS))
+
+# Return types that are decoded as images rather than as numbers
+imageTypes = [
+    "image/png",
+    "image/jpeg",
+]
+
+def result_shape(query) -> Tuple[int, ...]:
+    """
+    Returns the number of dimensions the result of a query has, as a
+    tuple of unknown (-1) sizes.
+
+    Every subset with a start and an end value keeps its axis, every subset
+    with a single value removes it, so a query over a 3-D coverage with one
+    time range and a fixed Lat/Long point returns a 1-D series.
+
+    Parameters:
+    -----------
+    query : wdc.Query
+        The query whose result is decoded.
+
+    Returns:
+    --------
+    Tuple[int, ...]
+        One -1 per axis kept by the query.
+    """
+    params = getattr(query, "params", None) or []
+    return tuple(-1 for param in params if param.end_val is not None)
+
+
+def _nesting_shape(payload: bytes) -> List[int]:
+    """
+    Infers the sizes of the outer axes from the '{...}' groups of a CSV
+    payload, without looping over the values in Python.
+    """
+    raw = np.frombuffer(payload, dtype=np.uint8)
+    opening = raw == ord("{")
+    if not opening.any():
+        return []
+
+    closing = raw == ord("}")
+    depth = np.cumsum(opening.astype(np.int64) - closing.astype(np.int64))
+    open_depths = depth[opening]
+
+    shape = []
+    groups = 1
+    for level in range(1, int(open_depths.max()) + 1):
+        count = int(np.count_nonzero(open_depths == level))
+        shape.append(count // groups)
+        groups = count
+    return shape
+
+
+def _band_count(payload: bytes) -> int:
+    """
+    Returns the number of bands of a multi-band payload, where every cell
+    is written as a quoted, space separated list of band values.
+    """
+    start = payload.find(b'"')
+    if start < 0:
+        return 1
+    end = payload.find(b'"', start + 1)
+    return len(payload[start + 1:end].split())
+
+
+def _parse_numbers(payload: bytes, dtype) -> np.ndarray:
+    text = payload.translate(_TO_SPACES)
+    if dtype is None:
+        lowered = text.lower()
+        is_float = any(marker in lowered for marker in (b".", b"e", b"nan", b"inf"))
+        dtype = np.float64 if is_float else np.int64
+
+    with warnings.catch_warnings():
+        # numpy only warns when it stops at an unparsable value
+        warnings.simplefilter("error", DeprecationWarning)
+        try:
+            return np.fromstring(text.decode("ascii"), dtype=dtype, sep=" ")
+        except (ValueError, DeprecationWarning, UnicodeDecodeError) as err:
+            raise ValueError(f"Error. The result is not a numeric WCPS payload: {err}") from err
+
+
+def decode_csv(payload: Union[bytes, str], query=None, dtype=None) -> np.ndarray:
+    """
+    Decodes a text/csv or scalar WCPS result into a NumPy array.
+
+    Parameters:
+    -----------
+    payload : Union[bytes, str]
+        The raw result returned by dbc.execute_query.
+    query : wdc.Query, optional
+        The query that produced the result. Used to infer the number of
+        dimensions when the payload itself is flat. Defaults to None.
+    dtype : numpy dtype, optional
+        The type of the values. Defaults to int64 for integer payloads
+        (e.g. count) and float64 otherwise.
+
+    Returns:
+    --------
+    np.ndarray
+        The values, shaped like the subset of the query. Scalar results
+        become 0-dimensional arrays and multi-band results get a trailing
+        band axis.
+    """
+    if isinstance(payload, str):
+        payload = payload.encode("ascii")
+    payload = payload.strip()
+
+    values = _parse_numbers(payload, dtype)
+    shape = _nesting_shape(payload)
+    bands = _band_count(payload)
+    cell = [bands] if bands > 1 else []
+
+    if query is not None:
+        ndim = len(result_shape(query))
+        if ndim == 0:
+            # A slice on every axis returns a single value, possibly multi-band
+            return values.reshape(()) if values.size == 1 else values
+        if not shape and ndim > 1:
+            raise ValueError("Error. Cannot infer the shape of a flat multi-dimensional result")
+
+    if not shape:
+        if query is None and values.size == 1:
+            return values.reshape(())
+        return values.reshape([-1] + cell)
+
+    # The innermost '{...}' groups hold the values of the last axis
+    return values.reshape(shape + [-1] + cell)
+
+
+def decode_result(payload: Union[bytes, str], query=None, return_type: str = None,
+                  dtype=None) -> np.ndarray:
+    """
+    Decodes the result of a WCPS query into a NumPy array.
+
+    Parameters:
+    -----------
+    payload : Union[bytes, str]
+        The raw result returned by dbc.execute_query.
+    query : wdc.Query, optional
+        The query that produced the result. Its return type is used when
+        `return_type` is not given, and its subsets give the shape.
+    return_type : str, optional
+        The format of the result, e.g. "text/csv" or "application/json".
+        Defaults to the return type of the query, or to text/csv.
+    dtype : numpy dtype, optional
+        The type of the values. Defaults to int64 or float64, depending
+        on the payload.
+
+    Returns:
+    --------
+    np.ndarray
+        The decoded values.
+    """
+    if return_type is None and hasattr(query, "get_return_type"):
+        return_type = query.get_return_type()
+    if return_type is None:
+        return_type = getattr(query, "return_type", None) or "text/csv"
+
+    if return_type in imageTypes:
+        raise ValueError(f"Error. {return_type} results are images, not numeric payloads; decode them with ImageResult")
+
+    if return_type in ("application/json", "json"):
+        return np.asarray(json.loads(payload), dtype=dtype)
+
+    return decode_csv(payload, query=query, dtype=dtype)
+
+
+def _pillow():
+    try:
+        from PIL import Image
+    except ImportError:
+        raise ValueError("Error. Decoding images needs Pillow") from None
+    return Image
+
+
+class ImageResult:
+    """
+    A class holding an encoded image/png or image/jpeg result, decoding it
+    into a NumPy array only when the pixels are needed.
+
+    The encoded bytes can be saved or displayed inline in notebooks without
+    any decoding, and previews can be decoded at a reduced resolution,
+    which for JPEG skips most of the decoding work. No image viewer is
+    ever opened.
+
+    Attributes
+    ----------
+    payload : bytes
+        The encoded image, as returned by the server.
+    format : str
+        "png", "jpeg", or None if the payload is neither.
+    decode_seconds : float
+        How long the last decode took, or None before the first one.
+
+    Methods
+    -------
+    __init__(self, payload: bytes)
+        Wraps an encoded image without decoding it.
+
+    to_array(self, reduce: int = 1) -> np.ndarray
+        Decodes the image, optionally at a reduced resolution.
+
+    to_image(self, reduce: int = 1) -> PIL.Image.Image
+        Decodes the image into a Pillow image.
+
+    save(self, destination) -> int
+        Writes the encoded image to a file without decoding it.
+    """
+
+    def __init__(self, payload: bytes):
+        """
+        Wraps an encoded image without decoding it.
+
+        Parameters:
+        -----------
+        payload : bytes
+            The encoded image/png or image/jpeg result.
+        """
+        self.payload = bytes(payload)
+        if self.payload.startswith(b"\x89PNG\r\n\x1a\n"):
+            self.format = "png"
+        elif self.payload.startswith(b"\xff\xd8"):
+            self.format = "jpeg"
+        else:
+            self.format = None
+        self.decode_seconds = None
+        self._arrays: Dict[int, np.ndarray] = {}
+        self._size = None
+
+
+    def __repr__(self) -> str:
+        return f"ImageResult(format={self.format!r}, size={self.size}, bytes={len(self.payload)})"
+
+
+    def __bytes__(self) -> bytes:
+        return self.payload
+
+
+    def __len__(self) -> int:
+        return len(self.payload)
+
+
+    def __array__(self, dtype=None, copy=None) -> np.ndarray:
+        array = self.to_array()
+        return array if dtype is None else array.astype(dtype)
+
+
+    def _repr_png_(self) -> bytes:
+        # Lets notebooks display PNG results as they are
+        return self.payload if self.format == "png" else None
+
+
+    def _repr_jpeg_(self) -> bytes:
+        return self.payload if self.format == "jpeg" else None
+
+
+    @property
+    def size(self) -> Tuple[int, int]:
+        """
+        The width and height of the image, read from its header.
+        """
+        if self._size is None:
+            if self.format == "png" and len(self.payload) >= 24:
+                self._size = (int.from_bytes(self.payload[16:20], "big"),
+                              int.from_bytes(self.payload[20:24], "big"))
+            else:
+                with _pillow().open(io.BytesIO(self.payload)) as image:
+                    self._size = image.size
+        return self._size
+
+
+    def to_image(self, reduce: int = 1):
+        """
+        Decodes the image into a Pillow image.
+
+        Parameters:
+        -----------
+        reduce : int, optional
+            Divides the width and height, e.g. 4 for a preview of a
+            sixteenth of the pixels. Defaults to 1, the full resolution.
+
+        Returns:
+        --------
+        PIL.Image.Image
+            The decoded image. Palette images are converted to RGB(A).
+        """
+        if reduce < 1:
+            raise ValueError("Error. The reduction factor must be at least 1")
+        Image = _pillow()
+        image = Image.open(io.BytesIO(self.payload))
+        width, height = image.size
+        target = (-(-width // reduce), -(-height // reduce))
+        if reduce > 1 and image.format == "JPEG":
+            # Scales by 1/2, 1/4 or 1/8 while decoding, skipping most of the work
+            image.draft(image.mode, target)
+        if image.mode == "P":
+            image = image.convert("RGBA" if "transparency" in image.info else "RGB")
+        if reduce > 1 and image.size != target:
+            if image.size == (width, height):
+                image = image.reduce(reduce)
+            else:
+                image = image.resize(target, Image.Resampling.BOX)
+        image.load()
+        return image
+
+
+    def to_array(self, reduce: int = 1) -> np.ndarray:
+        """
+        Decodes the image into a NumPy array of shape (height, width) or
+        (height, width, bands). Decoded arrays are kept, so repeated calls
+        are free. The time taken is kept in decode_seconds, and recorded as
+        a "wdc.decode_image" span while spans are recorded (see wdc.Trace).
+
+        Parameters:
+        -----------
+        reduce : int, optional
+            Divides the width and height, e.g. 4 for a preview of a
+            sixteenth of the pixels. Pixels are averaged. Defaults to 1,
+            the full resolution.
+
+        Returns:
+        --------
+        np.ndarray
+            The pixels.
+        """
+        array = self._arrays.get(reduce)
+        if array is not None:
+            return array
+
+        span = start_span("wdc.decode_image")
+        if span is not None:
+            span.attributes.update({"format": self.format, "reduce": reduce, "bytes": len(self.payload)})
+        start = time.perf_counter()
+        try:
+            with self.to_image(reduce) as image:
+                array = np.asarray(image)
+        except BaseException as exc:
+            end_span(span, exc)
+            raise
+        self.decode_seconds = time.perf_counter() - start
+        end_span(span)
+        self._arrays[reduce] = array
+        return array
+
+
+    def save(self, destination: Union[str, os.PathLike, BinaryIO]) -> int:
+        """
+        Writes the encoded image to a path or a binary file object, without
+        decoding it.
+
+        Returns:
+        --------
+        int
+            The number of bytes written.
+        """
+        if hasattr(destination, "write"):
+            return destination.write(self.payload)
+        with open(destination, "wb") as output:
+            return output.write(self.payload)
@@ -0,0 +1,640 @@
+import json
+import numbers
+from typing import Dict, Iterable, List, Sequence, Union
+
+import numpy as np
+
+# Importing user-defined modules
+from wdc.Datacube import ExprNode
+from wdc.Parser import parse_wcps
+
+# NumPy functions evaluating the operators and functions of WCPS
+_BINARY = {
+    "+": np.add, "-": np.subtract, "*": np.multiply, "/": np.true_divide,
+    ">": np.greater, "<": np.less, ">=": np.greater_equal, "<=": np.less_equal,
+    "=": np.equal, "!=": np.not_equal,
+    "and": np.logical_and, "or": np.logical_or, "xor": np.logical_xor,
+}
+_UNARY = {
+    "-": np.negative, "not": np.logical_not, "abs": np.abs, "sqrt": np.sqrt,
+    "exp": np.exp, "log": np.log10, "ln": np.log,
+}
+_AGGREGATES = {
+    "min": np.min, "max": np.max, "avg": np.mean, "add": np.sum, "count": np.count_nonzero,
+}
+
+def _to_coordinates(values) -> np.ndarray:
+    """
+    Returns the coordinates of an axis as an array, parsing ISO dates such
+    as "2014-07" into datetime64 so they compare by time.
+    """
+    values = np.asarray(values)
+    if values.dtype.kind in ("U", "S", "O"):
+        try:
+            return values.astype("datetime64")
+        except ValueError:
+            pass
+    return values
+
+
+def _to_coordinate(coordinates: np.ndarray, value):
+    if coordinates.dtype.kind == "M":
+        return np.datetime64(value)
+    return value
+
+
+class AxisIndex:
+    """
+    A class resolving subsets on one axis to index ranges by binary search.
+
+    Attributes
+    ----------
+    name : str
+        The name of the axis.
+    coordinates : np.ndarray
+        The coordinates of the cells, strictly ascending or descending.
+    descending : bool
+        Whether the coordinates are descending, as Lat often is.
+
+    Methods
+    -------
+    __init__(self, name: str, coordinates)
+        Checks the coordinates and prepares the index.
+
+    lookup(self, start_val, end_val=None) -> Union[int, slice]
+        Returns the position of a slice or the range of a subset.
+    """
+
+    def __init__(self, name: str, coordinates):
+        """
+        Checks the coordinates and prepares the index.
+
+        Parameters:
+        -----------
+        name : str
+            The name of the axis.
+        coordinates : array_like
+            The coordinates of the cells. Date strings are parsed into
+            datetime64.
+        """
+        self.name = name
+        self.coordinates = _to_coordinates(coordinates)
+        self.size = len(self.coordinates)
+        self.descending = self.size > 1 and self.coordinates[0] > self.coordinates[-1]
+        # A reversed view, so descending axes are searched without a copy
+        self._ascending = self.coordinates[::-1] if self.descending else self.coordinates
+        if self.size > 1 and not np.all(self._ascending[1:] > self._ascending[:-1]):
+            raise ValueError(f"Error. The coordinates of axis {name} must be strictly ascending or descending")
+
+
+    def _position(self, index: int) -> int:
+        return self.size - 1 - index if self.descending else index
+
+
+    def lookup(self, start_val, end_val=None) -> Union[int, slice]:
+        """
+        Returns the position of a slice or the range of a subset.
+
+        Parameters:
+        -----------
+        start_val : Union[str, int, float]
+            The coordinate of a slice, or the start of a range.
+        end_val : Union[str, int, float], optional
+            The end of a range. Defaults to None, meaning a slice.
+
+        Returns:
+        --------
+        Union[int, slice]
+            The index of the cell nearest to a slice, or the slice of the
+            cells within a range.
+        """
+        ascending = self._ascending
+        start = _to_coordinate(self.coordinates, start_val)
+
+        if end_val is None:
+            position = int(np.searchsorted(ascending, start))
+            candidates = [index for index in (position - 1, position) if 0 <= index < self.size]
+            nearest = min(candidates, key=lambda index: abs(ascending[index] - start))
+            # A slice must fall within half a cell of the nearest coordinate
+            neighbour = nearest + 1 if nearest + 1 < self.size else nearest - 1
+            spacing = abs(ascending[neighbour] - ascending[nearest]) if self.size > 1 else 0
+            if abs(ascending[nearest] - start) > spacing / 2:
+                raise ValueError(f"Error. {start_val} lies outside of axis {self.name}")
+            return self._position(nearest)
+
+        end = _to_coordinate(self.coordinates, end_val)
+        low, high = (start, end) if start <= end else (end, start)
+        first = int(np.searchsorted(ascending, low, side="left"))
+        last = int(np.searchsorted(ascending, high, side="right"))
+        if first >= last:
+            raise ValueError(f"Error. The subset {start_val}:{end_val} lies outside of axis {self.name}")
+        if self.descending:
+            return slice(self.size - last, self.size - first)
+        return slice(first, last)
+
+
+class LocalCoverage:
+    """
+    A class holding a coverage as a NumPy array with named axes and the
+    coordinates of every cell along them.
+
+    Attributes
+    ----------
+    data : np.ndarray
+        The values, with one dimension per axis, plus a trailing band
+        dimension for multi-band coverages.
+    axes : Tuple[str, ...]
+        The names of the axes, in the order of the dimensions.
+    coordinates : Dict[str, np.ndarray]
+        The coordinate of every cell along every axis, sorted ascending or
+        descending. Date strings are stored as datetime64.
+    bands : Tuple[str, ...]
+        The names of the bands of a multi-band coverage, otherwise None.
+
+    Methods
+    -------
+    __init__(self, data, axes: Sequence[str], coordinates: dict = None, bands: Sequence[str] = None)
+        Initializes a coverage, defaulting to grid coordinates 0, 1, 2, ...
+
+    index(self, axis: str, start_val, end_val=None) -> Union[int, slice]
+        Returns the position of a slice or the range of a subset on an axis.
+
+    subset(self, selection) -> LocalCoverage
+        Returns a view of the cells within the subsets.
+    """
+
+    def __init__(self, data, axes: Sequence[str], coordinates: dict = None,
+                 bands: Sequence[str] = None):
+        """
+        Initializes a coverage.
+
+        Parameters:
+        -----------
+        data : array_like
+            The values, one dimension per axis (and one for the bands).
+        axes : Sequence[str]
+            The names of the axes, e.g. ("ansi", "Lat", "Long").
+        coordinates : dict, optional
+            The coordinates of the cells by axis. Axes without coordinates
+            get the grid coordinates 0, 1, 2, ... Defaults to None.
+        bands : Sequence[str], optional
+            The names of the bands of a multi-band coverage. Defaults to None.
+        """
+        self.data = data if isinstance(data, np.ndarray) else np.asarray(data)
+        self.axes = tuple(axes)
+        self.bands = tuple(bands) if bands is not None else None
+        if self.data.ndim != len(self.axes) + (1 if self.bands else 0):
+            raise ValueError(f"Error. The data has {self.data.ndim} dimensions but {len(self.axes)} axes were named")
+
+        coordinates = coordinates or {}
+        self.coordinates = {}
+        for axis, size in zip(self.axes, self.data.shape):
+            values = coordinates.get(axis)
+            values = np.arange(size) if values is None else _to_coordinates(values)
+            if len(values) != size:
+                raise ValueError(f"Error. Axis {axis} has {size} cells but {len(values)} coordinates")
+            self.coordinates[axis] = values
+        self._indexes: Dict[str, AxisIndex] = {}
+
+
+    def __repr__(self) -> str:
+        return f"LocalCoverage(axes={self.axes}, shape={self.data.shape})"
+
+
+    def index(self, axis: str, start_val, end_val=None) -> Union[int, slice]:
+        """
+        Returns the position of a slice or the range of a subset on an axis.
+
+        Parameters:
+        -----------
+        axis : str
+            The name of the axis.
+        start_val : Union[str, int, float]
+            The coordinate of a slice, or the start of a range.
+        end_val : Union[str, int, float], optional
+            The end of a range. Defaults to None, meaning a slice.
+
+        Returns:
+        --------
+        Union[int, slice]
+            The index of the cell nearest to a slice, or the slice of the
+            cells within a range, found by binary search.
+        """
+        index = self._indexes.get(axis)
+        if index is None:
+            if axis not in self.coordinates:
+                raise ValueError(f"Invalid axis name: {axis}, possible axes are: {self.axes}")
+            index = self._indexes[axis] = AxisIndex(axis, self.coordinates[axis])
+        return index.lookup(start_val, end_val)
+
+
+    def subset(self, selection: Iterable[tuple]) -> "LocalCoverage":
+        """
+        Returns a view of the cells within the subsets, without copying.
+
+        Parameters:
+        -----------
+        selection : Iterable[tuple]
+            (axis, start_val, end_val) subsets, where end_val is None for
+            a slice, which removes its axis.
+
+        Returns:
+        --------
+        LocalCoverage
+            The subset coverage.
+        """
+        positions = {axis: self.index(axis, start_val, end_val) for axis, start_val, end_val in selection}
+        key = tuple(positions.get(axis, slice(None)) for axis in self.axes)
+
+        axes = []
+        coordinates = {}
+        for axis, position in zip(self.axes, key):
+            if isinstance(position, slice):
+                axes.append(axis)
+                coordinates[axis] = self.coordinates[axis][position]
+        return LocalCoverage(self.data[key], axes, coordinates, self.bands)
+
+
+def _format_cells(values: list) -> List[str]:
+    return [repr(value) if isinstance(value, float) else str(value) for value in values]
+
+
+def encode_csv(data: np.ndarray, bands: bool = False) -> bytes:
+    """
+    Encodes an array in the text/csv format of rasdaman: the values of the
+    last axis separated by commas, every outer axis grouped in braces, and
+    the bands of a cell quoted and separated by spaces.
+
+    Parameters:
+    -----------
+    data : np.ndarray
+        The values.
+    bands : bool, optional
+        Whether the last dimension holds the bands of every cell.
+        Defaults to False.
+
+    Returns:
+    --------
+    bytes
+        The encoded values, e.g. b"{1,2},{3,4}".
+    """
+    data = np.asarray(data)
+    if data.dtype == bool:
+        data = data.astype(np.uint8)
+
+    if bands:
+        shape = data.shape[:-1]
+        rows = data.reshape(-1, data.shape[-1]).tolist()
+        cells = ['"' + " ".join(_format_cells(row)) + '"' for row in rows]
+    else:
+        shape = data.shape
+        cells = _format_cells(data.reshape(-1).tolist())
+
+    # Joining the innermost axis first, wrapping every axis but the outermost in braces
+    for level in range(len(shape) - 1, -1, -1):
+        size = shape[level]
+        groups = [",".join(cells[start:start + size]) for start in range(0, len(cells), size)] if size else [""]
+        cells = ["{" + group + "}" for group in groups] if level > 0 else groups
+    return cells[0].encode("ascii")
+
+
+def _encode_image(data: np.ndarray, return_type: str) -> bytes:
+    try:
+        from io import BytesIO
+        from PIL import Image
+    except ImportError as err:
+        raise ValueError("Error. Encoding images locally requires Pillow") from err
+
+    if data.ndim not in (2, 3):
+        raise ValueError(f"Error. Only 2-D coverages can be encoded as {return_type}")
+    image = Image.fromarray(np.clip(data, 0, 255).astype(np.uint8))
+    output = BytesIO()
+    image.save(output, format="JPEG" if "jpeg" in return_type else "PNG")
+    return output.getvalue()
+
+
+def encode_result(value, return_type: str = None) -> bytes:
+    """
+    Encodes an evaluated result the way rasdaman returns it.
+
+    Parameters:
+    -----------
+    value : Union[LocalCoverage, numpy scalar]
+        The evaluated result.
+    return_type : str, optional
+        The format given to encode(), e.g. "text/csv" or "image/png".
+        Defaults to None, for results that were not encoded.
+
+    Returns:
+    --------
+    bytes
+        The encoded result.
+    """
+    if not isinstance(value, LocalCoverage):
+        value = np.asarray(value).item()
+        if isinstance(value, bool):
+            value = int(value)
+        return _format_cells([value])[0].encode("ascii")
+
+    if return_type in ("image/png", "png", "image/jpeg", "jpeg"):
+        return _encode_image(value.data, return_type)
+    if return_type in ("application/json", "json"):
+        return json.dumps(value.data.tolist()).encode("ascii")
+    if return_type in (None, "text/csv", "csv"):
+        return encode_csv(value.data, bands=value.bands is not None)
+    raise ValueError(f"Error. Unsupported return type for local execution: {return_type}")
+
+
+class _Evaluator:
+    """
+    Evaluates an expression graph with NumPy. Every node is evaluated once,
+    so subexpressions shared through let are computed a single time.
+    """
+
+    def __init__(self, engine: "LocalEngine"):
+        self.engine = engine
+        self._values = {}
+
+
+    def evaluate(self, node: ExprNode):
+        if node in self._values:
+            return self._values[node]
+        value = self._evaluate(node)
+        self._values[node] = value
+        return value
+
+
+    def _evaluate(self, node: ExprNode):
+        op = node.op
+
+        if op == "coverage":
+            return self.engine.get_coverage(node.args[0])
+
+        elif op == "literal":
+            return node.args[0]
+
+        elif op == "struct":
+            return np.array([value for _, value in node.args])
+
+        elif op == "subset":
+            source = self.evaluate(node.children[0])
+            if not isinstance(source, LocalCoverage):
+                raise ValueError("Error. Only coverages can be subset")
+            return source.subset(node.args)
+
+        elif op == "scale":
+            return self._scale(self.evaluate(node.children[0]), node.args)
+
+        elif op == "binary":
+            left, right = (self.evaluate(child) for child in node.children)
+            return self._apply(_BINARY[node.args[0]], left, right)
+
+        elif op == "unary":
+            return self._apply(_UNARY[node.args[0]], self.evaluate(node.children[0]))
+
+        elif op == "aggregate":
+            value = self.evaluate(node.children[0])
+            data = value.data if isinstance(value, LocalCoverage) else np.asarray(value)
+            return np.asarray(_AGGREGATES[node.args[0]](data))[()]
+
+        elif op == "switch":
+            return self._switch(node)
+
+        elif op == "construct":
+            return self._construct(node)
+
+        elif op == "encode":
+            return self.evaluate(node.children[0])
+
+        raise ValueError(f"Error. Unsupported expression node for local execution: {op}")
+
+
+    @staticmethod
+    def _apply(function, *values):
+        """
+        Applies a NumPy function cell by cell to coverages and numbers.
+        """
+        coverages = [value for value in values if isinstance(value, LocalCoverage)]
+        if not coverages:
+            return np.asarray(function(*values))[()]
+
+        shapes = {coverage.data.shape for coverage in coverages}
+        if len(shapes) > 1:
+            raise ValueError(f"Error. Cannot combine coverages of different shapes: {sorted(shapes)}")
+        data = function(*[value.data if isinstance(value, LocalCoverage) else value for value in values])
+        template = coverages[0]
+        return LocalCoverage(data, template.axes, template.coordinates, template.bands)
+
+
+    @staticmethod
+    def _scale(coverage, args):
+        if not isinstance(coverage, LocalCoverage):
+            raise ValueError("Error. Only coverages can be scaled")
+
+        if len(args) == 1 and args[0][0] is None:
+            args = [(axis, args[0][1]) for axis in coverage.axes]
+
+        data = coverage.data
+        coordinates = dict(coverage.coordinates)
+        for axis, value in args:
+            if axis not in coverage.axes:
+                raise ValueError(f"Invalid axis name: {axis}, possible axes are: {coverage.axes}")
+            dimension = coverage.axes.index(axis)
+            size = data.shape[dimension]
+
+            if isinstance(value, tuple):
+                target = int(value[1]) - int(value[0]) + 1
+            elif isinstance(value, numbers.Real):
+                target = max(1, int(round(size * value)))
+            else:
+                raise ValueError(f"Error. Unsupported scale for axis {axis}: {value}")
+
+            # Nearest neighbour: the source cell under the centre of every target cell
+            source = ((np.arange(target) + 0.5) * size / target).astype(np.intp)
+            data = np.take(data, np.minimum(source, size - 1), axis=dimension)
+            if isinstance(value, tuple):
+                coordinates[axis] = np.arange(int(value[0]), int(value[1]) + 1)
+            else:
+                coordinates[axis] = coordinates[axis][np.minimum(source, size - 1)]
+        return LocalCoverage(data, coverage.axes, coordinates, coverage.bands)
+
+
+    def _switch(self, node: ExprNode):
+        *cases, default = node.children
+        conditions = [self.evaluate(child) for child in cases[0::2]]
+        results = [self.evaluate(child) for child in cases[1::2]] + [self.evaluate(default)]
+        with_bands = any(child.op == "struct" for child in cases[1::2] + [default])
+
+        values = conditions + results
+        template = next((value for value in values if isinstance(value, LocalCoverage)), None)
+
+        def data(value, is_condition: bool) -> np.ndarray:
+            # Conditions and single band coverages are repeated over the bands
+            if isinstance(value, LocalCoverage):
+                array = value.data
+                if with_bands and value.bands is None:
+                    array = array[..., np.newaxis]
+                return array
+            array = np.asarray(value)
+            return array[..., np.newaxis] if with_bands and is_condition else array
+
+        selected = np.select([data(value, True) for value in conditions],
+                             [data(value, False) for value in results[:-1]],
+                             data(results[-1], False))
+        if template is None:
+            return selected[()]
+
+        bands = None
+        if with_bands:
+            struct = next(child for child in cases[1::2] + [default] if child.op == "struct")
+            bands = [name for name, _ in struct.args]
+        return LocalCoverage(selected, template.axes, template.coordinates, bands)
+
+
+    def _construct(self, node: ExprNode):
+        _, axes = node.args
+        shape = tuple(int(end_val) - int(start_val) + 1 for _, _, start_val, end_val in axes)
+        names = [axis for _, axis, _, _ in axes]
+        coordinates = {axis: np.arange(int(start_val), int(end_val) + 1)
+                       for _, axis, start_val, end_val in axes}
+
+        for dimension, (variable, axis, start_val, _) in enumerate(axes):
+            grid = coordinates[axis].reshape([-1 if index == dimension else 1 for index in range(len(axes))])
+            self._values[ExprNode("index", (variable, axis))] = LocalCoverage(
+                np.broadcast_to(grid, shape), names, coordinates)
+
+        values = self.evaluate(node.children[0])
+        if not isinstance(values, LocalCoverage):
+            return LocalCoverage(np.full(shape, values), names, coordinates)
+        if values.data.shape[:len(shape)] != shape:
+            raise ValueError(f"Error. The values of coverage {node.args[0]} do not match its domain {shape}")
+        return LocalCoverage(values.data, names, coordinates, values.bands)
+
+
+class LocalEngine:
+    """
+    A class executing WCPS queries in-process with NumPy, against coverages
+    held in memory or memory-mapped from disk.
+
+    It understands the WCPS generated by wdc (see wdc.Parser.parse_wcps):
+    subsets and slices, scale, arithmetic, comparisons, min, max, avg, sum
+    and count, switch colouring and coverage constructors. Pass it to dbc
+    as `engine` to run the queries of any wdc API locally, e.g. for small
+    or hot coverages and for tests that must not use the network.
+
+    Attributes
+    ----------
+    coverages : Dict[str, LocalCoverage]
+        The coverages queries can read from, by name.
+    store : CoverageStore
+        A store of memory-mapped coverages, opened when queries first read
+        them, or None.
+
+    Methods
+    -------
+    __init__(self, coverages: Dict[str, LocalCoverage] = None, store=None)
+        Initializes the engine with the given coverages and store.
+
+    add_coverage(self, name: str, coverage: LocalCoverage)
+        Makes a coverage available to queries.
+
+    get_coverage(self, name: str) -> LocalCoverage
+        Returns a coverage by name.
+
+    coverage_names(self) -> List[str]
+        Returns the names of all coverages.
+
+    evaluate(self, query: str)
+        Executes a query and returns its result before encoding.
+
+    execute(self, query: str) -> bytes
+        Executes a query and returns its result as rasdaman would.
+    """
+
+    def __init__(self, coverages: Dict[str, LocalCoverage] = None, store=None):
+        """
+        Initializes the engine with the given coverages and store.
+
+        Parameters:
+        -----------
+        coverages : Dict[str, LocalCoverage], optional
+            The coverages queries can read from, by name. Defaults to None.
+        store : CoverageStore, optional
+            A store (see wdc.Store) to read other coverages from. Defaults
+            to None.
+        """
+        self.coverages = dict(coverages or {})
+        self.store = store
+
+
+    def add_coverage(self, name: str, coverage: LocalCoverage):
+        """
+        Makes a coverage available to queries.
+
+        Parameters:
+        -----------
+        name : str
+            The name queries use for the coverage, e.g. "AvgLandTemp".
+        coverage : LocalCoverage
+            The coverage.
+        """
+        self.coverages[name] = coverage
+
+
+    def get_coverage(self, name: str) -> LocalCoverage:
+        """
+        Returns a coverage by name.
+        """
+        if name in self.coverages:
+            return self.coverages[name]
+        if self.store is not None and name in self.store:
+            return self.store.open(name)
+        raise ValueError(f"Error. Unknown coverage: {name}")
+
+
+    def coverage_names(self) -> List[str]:
+        """
+        Returns the names of all coverages.
+        """
+        names = list(self.coverages)
+        if self.store is not None:
+            names.extend(name for name in self.store.names() if name not in self.coverages)
+        return names
+
+
+    def evaluate(self, query: str):
+        """
+        Executes a query and returns its result before encoding.
+
+        Parameters:
+        -----------
+        query : str
+            WCPS text, or any object whose str() is WCPS text such as
+            wdc.Query or wdc.Datacube.
+
+        Returns:
+        --------
+        Union[LocalCoverage, numpy scalar]
+            A coverage for gridded results, a NumPy scalar for single values.
+        """
+        return _Evaluator(self).evaluate(parse_wcps(str(query)))
+
+
+    def execute(self, query: str) -> bytes:
+        """
+        Executes a query and returns its result encoded as rasdaman would
+        return it, so it can be decoded like a server response.
+
+        Parameters:
+        -----------
+        query : str
+            WCPS text, or any object whose str() is WCPS text.
+
+        Returns:
+        --------
+        bytes
+            The encoded result.
+        """
+        node = parse_wcps(str(query))
+        value = _Evaluator(self).evaluate(node)
+        return encode_result(value, node.args[0] if node.op == "encode" else None)
@@ -0,0 +1,86 @@
+import logging
+import random
+import sys
+from typing import Dict, TextIO
+
+# wdc reports its status through this logger. Like every library it only
+# has a NullHandler, so nothing is written unless the application asks for it
+logger = logging.getLogger("wdc")
+logger.addHandler(logging.NullHandler())
+
+# event -> share of the events that are logged; None is the default of all events
+_sample_rates: Dict[str, float] = {None: 1.0}
+
+def set_sampling(rate: float, event: str = None):
+    """
+    Logs only a share of the events, e.g. of the successful queries of a
+    batch loop. Sampled records carry the rate as the field sample_rate,
+    so counts can be scaled back up.
+
+    Parameters:
+    -----------
+    rate : float
+        The share of the events that are logged, from 0 to 1.
+    event : str, optional
+        The event to sample, e.g. "query_succeeded". Defaults to None,
+        meaning every event without a rate of its own.
+    """
+    if not 0 <= rate <= 1:
+        raise ValueError("Error. The sample rate must be between 0 and 1")
+    _sample_rates[event] = rate
+
+
+def emit(event: str, message: str, level: int = logging.INFO, **fields):
+    """
+    Logs a structured event to the "wdc" logger.
+
+    Nothing is done, not even formatting the message, unless the logger is
+    enabled for the level and the event is sampled, so events can be
+    emitted on hot paths. Handlers find the name of the event in
+    record.event and its fields in record.fields.
+
+    Parameters:
+    -----------
+    event : str
+        The name of the event, e.g. "query_failed".
+    message : str
+        A str.format template of the message, filled with the fields.
+    level : int, optional
+        The logging level. Defaults to logging.INFO.
+    **fields
+        Describe the event.
+    """
+    if not logger.isEnabledFor(level):
+        return
+    rate = _sample_rates.get(event, _sample_rates[None])
+    if rate < 1:
+        if random.random() >= rate:
+            return
+        fields["sample_rate"] = rate
+    logger.log(level, message.format(**fields), extra={"event": event, "fields": fields})
+
+
+def log_to_console(level: int = logging.INFO, stream: TextIO = None) -> logging.Handler:
+    """
+    Writes the events of wdc to the terminal, e.g. in notebooks, like the
+    status messages earlier versions printed.
+
+    Parameters:
+    -----------
+    level : int, optional
+        The lowest level written. Defaults to logging.INFO.
+    stream : TextIO, optional
+        Where to write. Defaults to sys.stderr.
+
+    Returns:
+    --------
+    logging.Handler
+        The handler, to be removed with logger.removeHandler.
+    """
+    handler = logging.StreamHandler(stream if stream is not None else sys.stderr)
+    handler.setLevel(level)
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(handler)
+    if logger.getEffectiveLevel() > level or logger.level == logging.NOTSET:
+        logger.setLevel(level)
+    return handler
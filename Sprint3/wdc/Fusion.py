@@ -0,0 +1,195 @@
+from typing import List, Union
+
+# Importing user-defined modules
+from wdc.Decode import decode_csv
+from wdc.Query import Query
+
+# Query types returning a single value, which can be fused into one request
+fusableTypes = [
+    "selecting_single_value",
+    "min",
+    "max",
+    "avg",
+    "when_temp_more_than_15"
+]
+
+class FusedQuery:
+    """
+    A class fusing many single-value queries on the same coverage into one
+    WCPS request.
+
+    The fused query builds a 1-D coverage over an index axis $i whose value
+    at index n is the result of the n-th query, and encodes it as CSV. The
+    server therefore answers all queries in a single round trip, and split()
+    turns the response back into one result per query.
+
+    Attributes
+    ----------
+    queries : List[Query]
+        The queries that were fused, in order.
+    coverage : str
+        The coverage all queries read from.
+
+    Methods
+    -------
+    __init__(self, queries: List[Query])
+        Checks that the queries can be fused and fuses them.
+
+    __str__(self) -> str
+        Returns the fused WCPS query.
+
+    get_wcps(self) -> str
+        Returns the fused WCPS query.
+
+    split(self, payload: bytes) -> List[Union[int, float]]
+        Splits the result of the fused query into one result per query.
+    """
+
+    def __init__(self, queries: List[Query]):
+        """
+        Checks that the queries can be fused and fuses them.
+
+        Parameters:
+        -----------
+        queries : List[Query]
+            Queries of a type listed in fusableTypes, all on the same
+            coverage and using the same iterator.
+        """
+        self.queries = list(queries)
+        if not self.queries:
+            raise ValueError("Error. Please provide at least one query to fuse")
+
+        first = self.queries[0]
+        self.coverage = first.coverage
+        self.return_val = first.return_val
+
+        for query in self.queries:
+            if query.query_type not in fusableTypes:
+                raise ValueError(f"Error. Queries of type {query.query_type} cannot be fused")
+            if query.coverage != self.coverage or query.return_val != self.return_val:
+                raise ValueError("Error. Only queries on the same coverage can be fused")
+            if query.query_type == "selecting_single_value" and any(
+                    param.end_val is not None for param in query.params or []):
+                raise ValueError("Error. Only single values can be fused, not ranges")
+
+        self._wcps = None
+
+
+    def __len__(self) -> int:
+        return len(self.queries)
+
+
+    def __str__(self) -> str:
+        """
+        Returns the fused WCPS query.
+
+        Returns:
+        --------
+        str
+            The WCPS query returning the results of all queries as CSV.
+        """
+        if self._wcps is not None:
+            return self._wcps
+
+        expressions = [query.get_return_expression() for query in self.queries]
+        last = len(expressions) - 1
+
+        if last == 0:
+            values = expressions[0]
+        else:
+            cases = [f" case $i = {index} return {expression}\n"
+                     for index, expression in enumerate(expressions[:-1])]
+            values = "switch\n" + "".join(cases) + f" default return {expressions[-1]}"
+
+        self._wcps = (f"diagram>>for {self.return_val} in ( {self.coverage} )\n return encode(\n"
+                      f"coverage fused over $i i(0:{last})\nvalues {values}\n, \"text/csv\")")
+        return self._wcps
+
+
+    def get_wcps(self) -> str:
+        """
+        Returns the fused WCPS query.
+
+        Returns:
+        --------
+        str
+            The WCPS query returning the results of all queries as CSV.
+        """
+        return str(self)
+
+
+    def split(self, payload: bytes) -> List[Union[int, float]]:
+        """
+        Splits the result of the fused query into one result per query.
+
+        Parameters:
+        -----------
+        payload : bytes
+            The CSV returned by the server for the fused query.
+
+        Returns:
+        --------
+        List[Union[int, float]]
+            The result of every query, in order. Counts are returned as
+            integers, all other results as floats.
+        """
+        values = decode_csv(payload, dtype=float).reshape(-1)
+        if values.size != len(self.queries):
+            raise ValueError(f"Error. Expected {len(self.queries)} values but received {values.size}")
+
+        results = values.tolist()
+        for index, query in enumerate(self.queries):
+            if query.query_type == "when_temp_more_than_15":
+                results[index] = int(results[index])
+        return results
+
+
+def fusion_groups(queries: List[Query], max_batch: int = 500) -> List[List[int]]:
+    """
+    Groups the positions of queries that can be fused together.
+
+    Parameters:
+    -----------
+    queries : List[Query]
+        Queries of a type listed in fusableTypes.
+    max_batch : int, optional
+        Maximum number of queries fused into one request, which keeps the
+        fused query text at a size the server accepts. Defaults to 500.
+
+    Returns:
+    --------
+    List[List[int]]
+        The positions of the queries of every fused request. Together they
+        contain every position exactly once.
+    """
+    groups = {}
+    for index, query in enumerate(queries):
+        groups.setdefault((query.coverage, query.return_val), []).append(index)
+
+    batches = []
+    for group in groups.values():
+        for start in range(0, len(group), max_batch):
+            batches.append(group[start:start + max_batch])
+    return batches
+
+
+def fuse_queries(queries: List[Query], max_batch: int = 500) -> List[FusedQuery]:
+    """
+    Groups queries by coverage and fuses every group into as few requests
+    as possible.
+
+    Parameters:
+    -----------
+    queries : List[Query]
+        Queries of a type listed in fusableTypes.
+    max_batch : int, optional
+        Maximum number of queries fused into one request. Defaults to 500.
+
+    Returns:
+    --------
+    List[FusedQuery]
+        The fused queries. Together they contain every query exactly once.
+    """
+    queries = list(queries)
+    return [FusedQuery([queries[index] for index in batch])
+            for batch in fusion_groups(queries, max_batch)]
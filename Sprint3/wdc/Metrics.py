@@ -0,0 +1,348 @@
+import bisect
+import threading
+from typing import Dict, List, Sequence, Tuple
+
+# Importing user-defined modules
+from wdc.Trace import Span, add_hook, remove_hook
+
+# Upper bounds of the latency buckets in seconds, from a cached answer to a timeout
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+class Histogram:
+    """
+    A class counting observations in buckets, like a Prometheus histogram,
+    so quantiles can be estimated in constant memory.
+
+    Attributes
+    ----------
+    buckets : Tuple[float]
+        The ascending upper bounds of the buckets. Larger observations are
+        counted in an implicit +Inf bucket.
+    count : int
+        The number of observations.
+    sum : float
+        The sum of the observations.
+
+    Methods
+    -------
+    __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS)
+        Initializes an empty histogram.
+
+    observe(self, value: float)
+        Counts an observation.
+
+    quantile(self, q: float) -> float
+        Estimates a quantile of the observations.
+
+    cumulative(self) -> List[Tuple[float, int]]
+        Returns the number of observations up to every bound.
+    """
+
+    __slots__ = ("buckets", "counts", "count", "sum")
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        """
+        Initializes an empty histogram.
+
+        Parameters:
+        -----------
+        buckets : Sequence[float], optional
+            The upper bounds of the buckets. Defaults to DEFAULT_BUCKETS,
+            from 1 ms to 60 s.
+        """
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+
+    def observe(self, value: float):
+        """
+        Counts an observation.
+        """
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+
+    def quantile(self, q: float) -> float:
+        """
+        Estimates a quantile of the observations by interpolating linearly
+        within the bucket it falls in, like Prometheus' histogram_quantile.
+
+        Parameters:
+        -----------
+        q : float
+            The quantile, e.g. 0.95.
+
+        Returns:
+        --------
+        float
+            The estimate, or NaN without observations. Quantiles in the
+            +Inf bucket are estimated as the largest bound.
+        """
+        if self.count == 0:
+            return float("nan")
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if seen + count >= rank and count > 0:
+                if index == len(self.buckets):
+                    return self.buckets[-1]
+                lower = self.buckets[index - 1] if index > 0 else 0.0
+                return lower + (self.buckets[index] - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+
+    def cumulative(self) -> List[Tuple[float, int]]:
+        """
+        Returns the number of observations up to every bound, ending with
+        float("inf").
+        """
+        total = 0
+        result = []
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+
+class _Family:
+    # The metrics of one query_type and coverage
+    __slots__ = ("requests", "errors", "bytes", "cache_hits", "cache_misses", "shared", "latency", "phases")
+
+    def __init__(self, buckets: Sequence[float]):
+        self.requests = 0
+        self.errors: Dict[str, int] = {}
+        self.bytes = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.shared = 0
+        self.latency = Histogram(buckets)
+        self.phases: Dict[str, float] = {}
+
+
+def _label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+class MetricsRegistry:
+    """
+    A class aggregating the spans of queries (see wdc.Trace) into metrics
+    per query_type and coverage: request and error counts, bytes
+    received, result cache hits and misses, latency histograms and the
+    total time spent in every phase.
+
+    Queries are only measured while the registry is installed, so the
+    metrics cost nothing otherwise. wdc.metrics is the registry of the
+    process.
+
+    Attributes
+    ----------
+    buckets : Tuple[float]
+        The upper bounds of the latency buckets in seconds.
+
+    Methods
+    -------
+    __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS)
+        Initializes an empty, uninstalled registry.
+
+    install(self) -> MetricsRegistry
+        Starts measuring every query of the process.
+
+    uninstall(self)
+        Stops measuring queries, keeping the metrics.
+
+    record(self, span: Span)
+        Adds the span of a query to the metrics.
+
+    snapshot(self) -> List[Dict]
+        Returns the metrics of every query_type and coverage.
+
+    to_prometheus(self) -> str
+        Returns the metrics in the Prometheus text exposition format.
+
+    reset(self)
+        Drops all metrics.
+    """
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        """
+        Initializes an empty, uninstalled registry.
+
+        Parameters:
+        -----------
+        buckets : Sequence[float], optional
+            The upper bounds of the latency buckets in seconds. Defaults to
+            DEFAULT_BUCKETS.
+        """
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        self._families: Dict[Tuple[str, str], _Family] = {}
+        self._installed = False
+
+
+    def __enter__(self) -> "MetricsRegistry":
+        return self.install()
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.uninstall()
+
+
+    def install(self) -> "MetricsRegistry":
+        """
+        Starts measuring every query of the process, by registering the
+        registry as a hook of wdc.Trace.
+        """
+        with self._lock:
+            if not self._installed:
+                add_hook(self.record)
+                self._installed = True
+        return self
+
+
+    def uninstall(self):
+        """
+        Stops measuring queries, keeping the metrics.
+        """
+        with self._lock:
+            if self._installed:
+                remove_hook(self.record)
+                self._installed = False
+
+
+    def record(self, span: Span):
+        """
+        Adds the span of a query to the metrics. Spans of other operations
+        are ignored.
+
+        Parameters:
+        -----------
+        span : Span
+            A finished "wdc.query" span.
+        """
+        if span.name != "wdc.query" or span.end is None:
+            return
+        attributes = span.attributes
+        key = (attributes.get("query_type") or "wcps", attributes.get("coverage") or "")
+        timings = span.timings()
+
+        with self._lock:
+            family = self._families.get(key)
+            if family is None:
+                family = self._families[key] = _Family(self.buckets)
+            family.requests += 1
+            family.latency.observe(timings.pop("total"))
+            family.bytes += attributes.get("bytes", 0)
+            error = attributes.get("error")
+            if error is not None:
+                family.errors[error] = family.errors.get(error, 0) + 1
+            cache = attributes.get("cache")
+            if cache == "hit":
+                family.cache_hits += 1
+            elif cache == "miss":
+                family.cache_misses += 1
+            if attributes.get("shared"):
+                family.shared += 1
+            for phase, seconds in timings.items():
+                family.phases[phase] = family.phases.get(phase, 0.0) + seconds
+
+
+    def snapshot(self) -> List[Dict]:
+        """
+        Returns the metrics of every query_type and coverage, the families
+        with the most time spent first.
+
+        Returns:
+        --------
+        List[Dict]
+            For every family its query_type, coverage, requests, errors
+            (by type and in total), bytes, cache_hits, cache_misses,
+            cache_hit_rate (None without cache lookups), shared, the total
+            latency_seconds, latency quantiles p50, p95 and p99 in seconds
+            and phase_seconds.
+        """
+        with self._lock:
+            result = []
+            for (query_type, coverage), family in self._families.items():
+                lookups = family.cache_hits + family.cache_misses
+                result.append({
+                    "query_type": query_type,
+                    "coverage": coverage,
+                    "requests": family.requests,
+                    "errors": sum(family.errors.values()),
+                    "errors_by_type": dict(family.errors),
+                    "bytes": family.bytes,
+                    "cache_hits": family.cache_hits,
+                    "cache_misses": family.cache_misses,
+                    "cache_hit_rate": family.cache_hits / lookups if lookups else None,
+                    "shared": family.shared,
+                    "latency_seconds": family.latency.sum,
+                    "p50": family.latency.quantile(0.5),
+                    "p95": family.latency.quantile(0.95),
+                    "p99": family.latency.quantile(0.99),
+                    "phase_seconds": dict(family.phases),
+                })
+        return sorted(result, key=lambda metrics: metrics["latency_seconds"], reverse=True)
+
+
+    def to_prometheus(self) -> str:
+        """
+        Returns the metrics in the Prometheus text exposition format, e.g.
+        to be served on /metrics or written for the node exporter's textfile
+        collector.
+        """
+        counters = [
+            ("wdc_queries_total", "Queries executed.", lambda family: family.requests),
+            ("wdc_response_bytes_total", "Bytes of query results received.", lambda family: family.bytes),
+            ("wdc_cache_hits_total", "Queries answered by the result cache.", lambda family: family.cache_hits),
+            ("wdc_cache_misses_total", "Queries not found in the result cache.", lambda family: family.cache_misses),
+            ("wdc_shared_queries_total", "Queries answered by an identical query in flight.",
+             lambda family: family.shared),
+        ]
+        lines = []
+        with self._lock:
+            families = sorted(self._families.items())
+            labelled = [(f'query_type="{_label(query_type)}",coverage="{_label(coverage)}"', family)
+                        for (query_type, coverage), family in families]
+
+            for name, description, value in counters:
+                lines += [f"# HELP {name} {description}", f"# TYPE {name} counter"]
+                lines += [f"{name}{{{labels}}} {value(family)}" for labels, family in labelled]
+
+            lines += ["# HELP wdc_query_errors_total Queries that failed, by exception type.",
+                      "# TYPE wdc_query_errors_total counter"]
+            for labels, family in labelled:
+                for error, count in sorted(family.errors.items()):
+                    lines.append(f'wdc_query_errors_total{{{labels},error="{_label(error)}"}} {count}')
+
+            lines += ["# HELP wdc_query_phase_seconds_total Seconds spent in every phase of the queries.",
+                      "# TYPE wdc_query_phase_seconds_total counter"]
+            for labels, family in labelled:
+                for phase, seconds in sorted(family.phases.items()):
+                    lines.append(f'wdc_query_phase_seconds_total{{{labels},phase="{_label(phase)}"}} {seconds!r}')
+
+            lines += ["# HELP wdc_query_duration_seconds Latency of the queries.",
+                      "# TYPE wdc_query_duration_seconds histogram"]
+            for labels, family in labelled:
+                for bound, count in family.latency.cumulative():
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f'wdc_query_duration_seconds_bucket{{{labels},le="{le}"}} {count}')
+                lines.append(f"wdc_query_duration_seconds_sum{{{labels}}} {family.latency.sum!r}")
+                lines.append(f"wdc_query_duration_seconds_count{{{labels}}} {family.latency.count}")
+        return "\n".join(lines) + "\n"
+
+
+    def reset(self):
+        """
+        Drops all metrics.
+        """
+        with self._lock:
+            self._families.clear()
+
+
+# The registry of the process, measuring queries once installed
+metrics = MetricsRegistry()
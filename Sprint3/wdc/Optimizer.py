@@ -0,0 +1,200 @@
+import numbers
+from typing import Dict, Optional, Tuple
+
+# Importing user-defined modules
+from wdc.Datacube import ExprNode, is_scalar
+
+def _is_factor(value) -> bool:
+    """
+    Returns whether a scale value is a plain factor, as opposed to a target
+    extent such as Lat(0:99).
+    """
+    return isinstance(value, numbers.Real) and not isinstance(value, bool)
+
+
+def _intersect(axis: str, inner: tuple, outer: tuple) -> Optional[tuple]:
+    """
+    Returns the (start_val, end_val) of two consecutive subsets on the same
+    axis, or None if their bounds cannot be compared.
+    """
+    inner_start, inner_end = inner
+    outer_start, outer_end = outer
+    if inner_end is None:
+        raise ValueError(f"Error. Axis {axis} was already sliced and cannot be subset again")
+
+    try:
+        if outer_end is None:
+            if not inner_start <= outer_start <= inner_end:
+                raise ValueError(f"Error. The subsets on axis {axis} do not overlap")
+            return outer_start, None
+        start_val = max(inner_start, outer_start)
+        end_val = min(inner_end, outer_end)
+    except TypeError:
+        return None
+
+    if start_val > end_val:
+        raise ValueError(f"Error. The subsets on axis {axis} do not overlap")
+    return start_val, end_val
+
+
+def merge_subsets(inner: tuple, outer: tuple) -> Optional[tuple]:
+    """
+    Merges the subsets of two consecutive subset nodes into one.
+
+    Parameters:
+    -----------
+    inner : tuple
+        The (axis, start_val, end_val) subsets applied first.
+    outer : tuple
+        The (axis, start_val, end_val) subsets applied to the result.
+
+    Returns:
+    --------
+    Optional[tuple]
+        The subsets of the merged node, where subsets on the same axis are
+        replaced by their intersection, or None if the bounds of an axis
+        cannot be compared (e.g. a date and a number).
+    """
+    bounds = {axis: (start_val, end_val) for axis, start_val, end_val in inner}
+    order = [axis for axis, _, _ in inner]
+
+    for axis, start_val, end_val in outer:
+        if axis in bounds:
+            merged = _intersect(axis, bounds[axis], (start_val, end_val))
+            if merged is None:
+                return None
+            bounds[axis] = merged
+        else:
+            bounds[axis] = (start_val, end_val)
+            order.append(axis)
+
+    return tuple((axis,) + bounds[axis] for axis in order)
+
+
+class _Optimizer:
+    """
+    Rewrites an expression graph bottom-up. Every node is optimized once,
+    and identical nodes of the result are shared, so the rewritten
+    expression stays a DAG.
+    """
+
+    def __init__(self):
+        # Holding on to the original node keeps its id from being reused
+        self._optimized: Dict[int, Tuple[ExprNode, ExprNode]] = {}
+        self._nodes: Dict[tuple, ExprNode] = {}
+
+
+    def _make(self, op: str, args: tuple, children: tuple) -> ExprNode:
+        node = ExprNode(op, args, children)
+        return self._nodes.setdefault(node.key, node)
+
+
+    def optimize(self, node: ExprNode) -> ExprNode:
+        done = self._optimized.get(id(node))
+        if done is not None:
+            return done[1]
+
+        children = tuple(self.optimize(child) for child in node.children)
+        result = self._rewrite(node.op, node.args, children)
+        self._optimized[id(node)] = (node, result)
+        return result
+
+
+    def _rewrite(self, op: str, args: tuple, children: tuple) -> ExprNode:
+        if op == "scale":
+            return self._scale(args, children[0])
+        if op == "subset":
+            return self._subset(args, children[0])
+        return self._make(op, args, children)
+
+
+    def _scale(self, args: tuple, child: ExprNode) -> ExprNode:
+        # Scaling by 1 leaves the coverage as it is
+        args = tuple((axis, factor) for axis, factor in args
+                     if not (_is_factor(factor) and factor == 1))
+        if not args:
+            return child
+        return self._make("scale", args, (child,))
+
+
+    def _subset(self, args: tuple, child: ExprNode) -> ExprNode:
+        if child.op == "subset":
+            merged = merge_subsets(child.args, args)
+            if merged is not None:
+                return self._subset(merged, child.children[0])
+
+        elif child.op in ("binary", "unary", "switch"):
+            # Arithmetic and switch work cell by cell, so only the subset cells of
+            # every coverage operand are needed
+            if not all(is_scalar(operand) for operand in child.children):
+                operands = tuple(operand if is_scalar(operand) else self._subset(args, operand)
+                                 for operand in child.children)
+                return self._make(child.op, child.args, operands)
+
+        elif child.op == "scale":
+            return self._subset_scale(args, child)
+
+        return self._make("subset", args, (child,))
+
+
+    def _subset_scale(self, args: tuple, scale: ExprNode) -> ExprNode:
+        """
+        Moves the subsets below a scale wherever that gives the same cells.
+
+        Subsets are given in the coordinates of the axes, which scaling by
+        a factor keeps, so they can be applied first. Scaling an axis to a
+        target extent depends on the size of its input, so subsets on such
+        an axis stay above the scale.
+        """
+        uniform = len(scale.args) == 1 and scale.args[0][0] is None
+        factors = {} if uniform else dict(scale.args)
+
+        pushed, kept = [], []
+        for subset in args:
+            axis = subset[0]
+            if axis not in factors or _is_factor(factors[axis]):
+                pushed.append(subset)
+            else:
+                kept.append(subset)
+
+        if not pushed:
+            return self._make("subset", args, (scale,))
+
+        # A sliced axis no longer exists below the scale, so its factor is dropped
+        sliced = {axis for axis, _, end_val in pushed if end_val is None}
+        scale_args = scale.args if uniform else tuple(
+            (axis, factor) for axis, factor in scale.args if axis not in sliced)
+
+        result = self._subset(tuple(pushed), scale.children[0])
+        result = self._scale(scale_args, result)
+        if kept:
+            result = self._make("subset", tuple(kept), (result,))
+        return result
+
+
+def optimize(node: ExprNode) -> ExprNode:
+    """
+    Rewrites an expression into an equivalent one that reads fewer cells.
+
+    - Subsets are pushed below arithmetic and below scaling by a factor,
+      so they are applied to the coverage before any other operation.
+    - Consecutive subsets are merged into one, and subsets on the same
+      axis are replaced by their intersection.
+    - Scales by a factor of 1 are dropped.
+
+    Parameters:
+    -----------
+    node : ExprNode
+        The root of the expression.
+
+    Returns:
+    --------
+    ExprNode
+        The root of the optimized expression.
+
+    Raises:
+    -------
+    ValueError
+        If two subsets on the same axis do not overlap.
+    """
+    return _Optimizer().optimize(node)
@@ -60,7 +60,7 @@ class Params:
         """
         param_str = self.param
         
-        if self.end_val:
+        if self.end_val is not None:
             if isinstance(self.start_val, str):
                 param_str += f'("{self.start_val}":"{self.end_val}")'
             else:
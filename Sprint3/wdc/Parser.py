@@ -0,0 +1,323 @@
+import re
+from functools import lru_cache
+from typing import Dict, List, Tuple
+
+# Importing user-defined modules
+from wdc.Datacube import ExprNode, aggregateTypes, unaryFunctions
+
+# Tokens of the WCPS subset understood by the parser
+_TOKEN = re.compile(r"""
+    \s*(?:
+        (?P<number>(?:\d+\.\d*|\.\d+|\d+)(?:[eE][-+]?\d+)?)
+      | (?P<string>"[^"]*"|'[^']*')
+      | (?P<var>\$\w+)
+      | (?P<name>[A-Za-z_]\w*)
+      | (?P<op>:=|>=|<=|!=|[-+*/=<>()\[\]{},:;])
+    )""", re.VERBOSE)
+
+# Client-side prefixes such as "diagram>>" or "image>>" in front of a query
+_PREFIX = re.compile(r"^\s*\w+>>")
+
+# Operators by precedence, from the loosest to the tightest binding ones
+_PRECEDENCE = [("or", "xor"), ("and",), ("=", "!=", "<", ">", "<=", ">="), ("+", "-"), ("*", "/")]
+
+def _tokenize(text: str) -> List[Tuple[str, str]]:
+    tokens = []
+    position = 0
+    text = text.rstrip()
+    while position < len(text):
+        match = _TOKEN.match(text, position)
+        if match is None or match.end() == position:
+            raise ValueError(f"Error. Unexpected character in WCPS query: {text[position:position + 20]!r}")
+        kind = match.lastgroup
+        tokens.append((kind, match.group(kind)))
+        position = match.end()
+    return tokens
+
+
+class _Parser:
+    """
+    A recursive descent parser turning WCPS text into an expression graph.
+    """
+
+    def __init__(self, text: str):
+        self.tokens = _tokenize(_PREFIX.sub("", text, count=1))
+        self.position = 0
+        self.variables: Dict[str, ExprNode] = {}
+
+
+    def _peek(self, offset: int = 0) -> Tuple[str, str]:
+        index = self.position + offset
+        return self.tokens[index] if index < len(self.tokens) else ("end", "")
+
+
+    def _next(self) -> Tuple[str, str]:
+        token = self._peek()
+        self.position += 1
+        return token
+
+
+    def _accept(self, value: str) -> bool:
+        if self._peek()[1] == value and self._peek()[0] in ("op", "name"):
+            self.position += 1
+            return True
+        return False
+
+
+    def _expect(self, value: str):
+        kind, found = self._next()
+        if found != value:
+            raise ValueError(f"Error. Expected '{value}' in WCPS query but found '{found or kind}'")
+
+
+    def _expect_kind(self, kind: str) -> str:
+        found_kind, value = self._next()
+        if found_kind != kind:
+            raise ValueError(f"Error. Expected a {kind} in WCPS query but found '{value or found_kind}'")
+        return value
+
+
+    def parse_query(self) -> ExprNode:
+        self._expect("for")
+        while True:
+            variable = self._expect_kind("var")
+            self._expect("in")
+            self._expect("(")
+            coverage = self._expect_kind("name")
+            if self._peek()[1] == ",":
+                raise ValueError("Error. Iterating over several coverages with one variable is not supported")
+            self._expect(")")
+            self.variables[variable] = ExprNode("coverage", (coverage,))
+            if not self._accept(","):
+                break
+
+        if self._accept("let"):
+            while True:
+                variable = self._expect_kind("var")
+                self._expect(":=")
+                self.variables[variable] = self.parse_expression()
+                if not self._accept(","):
+                    break
+
+        self._expect("return")
+        node = self.parse_expression()
+        if self._peek()[0] != "end":
+            raise ValueError(f"Error. Unexpected '{self._peek()[1]}' after the return expression")
+        return node
+
+
+    def parse_expression(self, level: int = 0) -> ExprNode:
+        if level == len(_PRECEDENCE):
+            return self._unary()
+
+        node = self.parse_expression(level + 1)
+        while self._peek()[1] in _PRECEDENCE[level] and self._peek()[0] in ("op", "name"):
+            operator = self._next()[1]
+            node = ExprNode("binary", (operator,), (node, self.parse_expression(level + 1)))
+        return node
+
+
+    def _unary(self) -> ExprNode:
+        if self._accept("-"):
+            operand = self._unary()
+            if operand.op == "literal":
+                return ExprNode("literal", (-operand.args[0],))
+            return ExprNode("unary", ("-",), (operand,))
+        if self._accept("+"):
+            return self._unary()
+        return self._postfix()
+
+
+    def _postfix(self) -> ExprNode:
+        node = self._primary()
+        while self._accept("["):
+            subsets = []
+            while True:
+                axis = self._expect_kind("name")
+                self._expect("(")
+                start_val = self._bound()
+                end_val = self._bound() if self._accept(":") else None
+                self._expect(")")
+                subsets.append((axis, start_val, end_val))
+                if not self._accept(","):
+                    break
+            self._expect("]")
+            node = ExprNode("subset", tuple(subsets), (node,))
+        return node
+
+
+    def _bound(self):
+        """
+        Parses a subset bound or scale factor: a number or a quoted string.
+        """
+        negative = self._accept("-")
+        kind, value = self._next()
+        if kind == "number":
+            number = float(value) if any(char in value for char in ".eE") else int(value)
+            return -number if negative else number
+        if kind == "string" and not negative:
+            return value[1:-1]
+        raise ValueError(f"Error. Expected a number or a string in WCPS query but found '{value or kind}'")
+
+
+    def _primary(self) -> ExprNode:
+        kind, value = self._next()
+
+        if kind == "number":
+            return ExprNode("literal", (float(value) if any(char in value for char in ".eE") else int(value),))
+
+        if kind == "var":
+            if value not in self.variables:
+                raise ValueError(f"Error. Unknown variable in WCPS query: {value}")
+            return self.variables[value]
+
+        if value == "(":
+            node = self.parse_expression()
+            self._expect(")")
+            return node
+
+        if value == "{":
+            return self._struct()
+
+        if kind != "name":
+            raise ValueError(f"Error. Unexpected '{value or kind}' in WCPS query")
+
+        if value in ("true", "false"):
+            return ExprNode("literal", (value == "true",))
+        if value == "switch":
+            return self._switch()
+        if value == "coverage":
+            return self._constructor()
+        if value == "encode":
+            return self._encode()
+        if value == "scale":
+            return self._scale()
+
+        function = "add" if value == "sum" else value
+        if function in aggregateTypes or function in unaryFunctions:
+            self._expect("(")
+            operand = self.parse_expression()
+            self._expect(")")
+            op = "aggregate" if function in aggregateTypes else "unary"
+            return ExprNode(op, (function,), (operand,))
+
+        raise ValueError(f"Error. Unsupported WCPS function or keyword: {value}")
+
+
+    def _struct(self) -> ExprNode:
+        fields = []
+        while True:
+            name = self._expect_kind("name")
+            self._expect(":")
+            value = self.parse_expression()
+            if value.op != "literal":
+                raise ValueError("Error. Only constant band values are supported in records")
+            fields.append((name, value.args[0]))
+            if not self._accept(";"):
+                break
+        self._expect("}")
+        return ExprNode("struct", tuple(fields))
+
+
+    def _switch(self) -> ExprNode:
+        children = []
+        while self._accept("case"):
+            condition = self.parse_expression()
+            self._expect("return")
+            children.extend((condition, self.parse_expression()))
+        if not children:
+            raise ValueError("Error. A switch needs at least one case")
+        self._expect("default")
+        self._expect("return")
+        children.append(self.parse_expression())
+        return ExprNode("switch", (), tuple(children))
+
+
+    def _constructor(self) -> ExprNode:
+        name = self._expect_kind("name")
+        self._expect("over")
+        axes = []
+        while True:
+            variable = self._expect_kind("var")
+            axis = self._expect_kind("name")
+            self._expect("(")
+            start_val = self._bound()
+            self._expect(":")
+            end_val = self._bound()
+            self._expect(")")
+            axes.append((variable, axis, start_val, end_val))
+            self.variables[variable] = ExprNode("index", (variable, axis))
+            if not self._accept(","):
+                break
+        self._expect("values")
+        values = self.parse_expression()
+        return ExprNode("construct", (name, tuple(axes)), (values,))
+
+
+    def _encode(self) -> ExprNode:
+        self._expect("(")
+        operand = self.parse_expression()
+        self._expect(",")
+        return_type = self._expect_kind("string")[1:-1]
+        # Format parameters such as "{...}" do not change the values
+        if self._accept(","):
+            self._expect_kind("string")
+        self._expect(")")
+        return ExprNode("encode", (return_type,), (operand,))
+
+
+    def _scale(self) -> ExprNode:
+        self._expect("(")
+        operand = self.parse_expression()
+        self._expect(",")
+        if not self._accept("{"):
+            factor = self._bound()
+            self._expect(")")
+            return ExprNode("scale", ((None, factor),), (operand,))
+
+        scales = []
+        while True:
+            axis = self._expect_kind("name")
+            self._expect("(")
+            start_val = self._bound()
+            if self._accept(":"):
+                scales.append((axis, (start_val, self._bound())))
+            else:
+                scales.append((axis, start_val))
+            self._expect(")")
+            if not self._accept(","):
+                break
+        self._expect("}")
+        self._expect(")")
+        return ExprNode("scale", tuple(scales), (operand,))
+
+
+@lru_cache(maxsize=256)
+def parse_wcps(query: str) -> ExprNode:
+    """
+    Parses a WCPS query into an expression graph.
+
+    The parser understands the part of WCPS generated by wdc: one iterator
+    per coverage, let clauses, subsets and slices, scale, arithmetic,
+    comparisons, the condensers min, max, avg, add (sum) and count, cell
+    functions, switch with records, coverage constructors and encode.
+    Client-side prefixes such as "diagram>>" are ignored. Variables bound
+    by let are shared in the graph, not copied. Parsed queries are cached,
+    so repeated queries are only parsed once.
+
+    Parameters:
+    -----------
+    query : str
+        The WCPS query.
+
+    Returns:
+    --------
+    ExprNode
+        The root of the expression following 'return'.
+
+    Raises:
+    -------
+    ValueError
+        If the query uses syntax outside of the supported subset.
+    """
+    return _Parser(query).parse_query()
@@ -0,0 +1,379 @@
+import contextvars
+import copy
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, Optional
+
+# The absolute time (time.monotonic) by which the current operation must finish
+_deadline = contextvars.ContextVar("wdc_deadline", default=None)
+
+class RetryPolicy:
+    """
+    A class deciding how often and how long apart failed requests are
+    retried.
+
+    Only failures that may succeed when repeated are retried, i.e. the
+    server could not be reached, timed out or answered 408, 429, 502, 503
+    or 504. WCPS queries only read data, so sending one again is safe.
+    The delays grow exponentially and are drawn at random below that bound
+    ("full jitter"), so clients failing together do not retry together.
+
+    Attributes
+    ----------
+    max_attempts : int
+        The number of attempts including the first one. 1 disables retries.
+    base_delay : float
+        The bound of the delay before the first retry, in seconds.
+    max_delay : float
+        The largest bound of a delay, in seconds.
+
+    Methods
+    -------
+    __init__(self, max_attempts: int = 3, base_delay: float = 0.2, max_delay: float = 10.0, seed: int = None)
+        Initializes the policy.
+
+    backoff(self, retry: int) -> float
+        Returns the delay before a retry, in seconds.
+    """
+
+    def __init__(self, max_attempts: int = 3, base_delay: float = 0.2, max_delay: float = 10.0,
+                 seed: int = None):
+        """
+        Initializes the policy.
+
+        Parameters:
+        -----------
+        max_attempts : int, optional
+            The number of attempts including the first one. Defaults to 3.
+        base_delay : float, optional
+            The bound of the delay before the first retry, in seconds.
+            Defaults to 0.2.
+        max_delay : float, optional
+            The largest bound of a delay, in seconds. Defaults to 10.
+        seed : int, optional
+            Seeds the jitter, for reproducible delays. Defaults to None.
+        """
+        if max_attempts < 1:
+            raise ValueError("Error. A request needs at least one attempt")
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._random = random.Random(seed)
+
+
+    def __repr__(self) -> str:
+        return (f"RetryPolicy(max_attempts={self.max_attempts}, base_delay={self.base_delay}, "
+                f"max_delay={self.max_delay})")
+
+
+    def backoff(self, retry: int) -> float:
+        """
+        Returns the delay before a retry, in seconds.
+
+        Parameters:
+        -----------
+        retry : int
+            The number of retries made so far, 0 before the first one.
+
+        Returns:
+        --------
+        float
+            A random delay between 0 and min(max_delay, base_delay * 2 ** retry).
+        """
+        return self._random.uniform(0, min(self.max_delay, self.base_delay * 2 ** retry))
+
+
+class CircuitBreaker:
+    """
+    A class pausing requests to a host after repeated failures, so a
+    struggling server is not hammered and callers fail fast.
+
+    Every host starts closed, letting requests through. After
+    `failure_threshold` failures in a row it opens and rejects requests
+    for `reset_timeout` seconds. Then a single request is let through:
+    if it succeeds the host is closed again, otherwise it opens again.
+
+    Attributes
+    ----------
+    failure_threshold : int
+        The number of failures in a row that opens a host.
+    reset_timeout : float
+        The number of seconds a host stays open.
+
+    Methods
+    -------
+    __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0, clock=time.monotonic)
+        Initializes the breaker with every host closed.
+
+    allow(self, host: str) -> bool
+        Returns whether a request to a host may be sent now.
+
+    record_success(self, host: str)
+        Records that the server of a host answered.
+
+    record_failure(self, host: str)
+        Records that a request to a host failed.
+
+    release(self, host: str)
+        Records that a request to a host ended without an outcome.
+
+    state(self, host: str) -> str
+        Returns "closed", "open" or "half-open".
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0,
+                 clock: Callable[[], float] = time.monotonic):
+        """
+        Initializes the breaker with every host closed.
+
+        Parameters:
+        -----------
+        failure_threshold : int, optional
+            The number of failures in a row that opens a host. Defaults to 5.
+        reset_timeout : float, optional
+            The number of seconds a host stays open. Defaults to 30.
+        clock : Callable[[], float], optional
+            Returns the current time in seconds. Defaults to time.monotonic.
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self._lock = threading.Lock()
+        # host -> [failures in a row, time the host opened or None, probe in flight]
+        self._hosts: Dict[str, list] = {}
+
+
+    def _host(self, host: str) -> list:
+        return self._hosts.setdefault(host, [0, None, False])
+
+
+    def state(self, host: str) -> str:
+        """
+        Returns "closed", "open" or "half-open".
+        """
+        with self._lock:
+            failures, opened_at, probing = self._host(host)
+            if opened_at is None:
+                return "closed"
+            if probing or self._clock() - opened_at >= self.reset_timeout:
+                return "half-open"
+            return "open"
+
+
+    def allow(self, host: str) -> bool:
+        """
+        Returns whether a request to a host may be sent now. Once a host
+        has been open for `reset_timeout` seconds, a single request is
+        allowed to probe it.
+
+        Parameters:
+        -----------
+        host : str
+            The host, e.g. "ows.rasdaman.org".
+
+        Returns:
+        --------
+        bool
+            Whether the request may be sent.
+        """
+        with self._lock:
+            stats = self._host(host)
+            if stats[1] is None:
+                return True
+            if stats[2] or self._clock() - stats[1] < self.reset_timeout:
+                return False
+            stats[2] = True
+            return True
+
+
+    def record_success(self, host: str):
+        """
+        Records that the server of a host answered, closing the host.
+        """
+        with self._lock:
+            self._hosts[host] = [0, None, False]
+
+
+    def record_failure(self, host: str):
+        """
+        Records that a request to a host failed, opening the host after
+        `failure_threshold` failures in a row or when a probe failed.
+        """
+        with self._lock:
+            stats = self._host(host)
+            stats[0] += 1
+            if stats[2] or stats[0] >= self.failure_threshold:
+                stats[1] = self._clock()
+                stats[2] = False
+
+
+    def release(self, host: str):
+        """
+        Records that a request to a host ended without an outcome, e.g. it
+        was interrupted by KeyboardInterrupt or a cancelled task. A probe
+        of the host no longer counts as in flight, so the next request
+        probes it instead.
+        """
+        with self._lock:
+            self._host(host)[2] = False
+
+
+def _copy_error(error: BaseException) -> BaseException:
+    # A copy has the type and attributes of the error, but not its
+    # traceback, which raising the shared error would append to
+    try:
+        return copy.copy(error)
+    except Exception:
+        return RuntimeError(f"Error. The shared call failed: {error}")
+
+
+class _Flight:
+    __slots__ = ("done", "result", "error", "waiters")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    A class letting concurrent callers of the same work share one call.
+
+    The first caller of a key runs the function. Callers arriving with the
+    same key while it runs wait for it and receive its result, or a copy
+    of its exception raised from the original, so every caller gets a
+    traceback of its own. Nothing is kept once the call finished, so later
+    callers run the function again.
+
+    Methods
+    -------
+    do(self, key, function: Callable, timeout: float = None)
+        Runs the function, or waits for the call already running for key.
+
+    in_flight(self) -> int
+        Returns the number of calls running.
+
+    shared(self) -> int
+        Returns how many callers received the result of another call.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights: Dict[object, _Flight] = {}
+        self._shared = 0
+
+
+    def do(self, key, function: Callable, timeout: float = None):
+        """
+        Runs the function, or waits for the call already running for key.
+
+        Parameters:
+        -----------
+        key : hashable
+            Identifies the work, e.g. the normalized query.
+        function : Callable
+            Does the work, without arguments.
+        timeout : float, optional
+            The number of seconds a caller waits for another call.
+            Defaults to None, meaning no limit.
+
+        Returns:
+        --------
+        The result of the function.
+
+        Raises:
+        -------
+        TimeoutError
+            If the call of another caller did not finish within timeout.
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+            else:
+                flight.waiters += 1
+
+        if not leader:
+            if not flight.done.wait(None if timeout is None else max(timeout, 0)):
+                raise TimeoutError("Error. The shared call did not finish in time")
+            if flight.error is not None:
+                raise _copy_error(flight.error) from flight.error
+            return flight.result
+
+        try:
+            flight.result = function()
+            return flight.result
+        except BaseException as exc:
+            flight.error = exc
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+                self._shared += flight.waiters
+            flight.done.set()
+
+
+    def in_flight(self) -> int:
+        """
+        Returns the number of calls running.
+        """
+        with self._lock:
+            return len(self._flights)
+
+
+    def shared(self) -> int:
+        """
+        Returns how many callers received the result of another call
+        instead of running the function themselves.
+        """
+        with self._lock:
+            return self._shared
+
+
+@contextmanager
+def deadline(seconds: float) -> Iterator[None]:
+    """
+    Bounds the time of every query sent in the block, including retries,
+    the queries of batches and tiles, and queries of nested blocks.
+
+    A nested block can only shorten the current deadline. The deadline is
+    also passed on to the worker threads of wdc, e.g. of dbc.execute_many.
+
+    Parameters:
+    -----------
+    seconds : float
+        The number of seconds the block may take.
+    """
+    expires = time.monotonic() + seconds
+    current = _deadline.get()
+    token = _deadline.set(expires if current is None else min(current, expires))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining_time() -> Optional[float]:
+    """
+    Returns the number of seconds left until the current deadline, or None
+    if there is none.
+    """
+    expires = _deadline.get()
+    return None if expires is None else expires - time.monotonic()
+
+
+def bind_context(function: Callable) -> Callable:
+    """
+    Returns a function running `function` with the context of the caller,
+    e.g. its deadline, from whichever thread calls it.
+    """
+    context = contextvars.copy_context()
+
+    def run(*args, **kwargs):
+        return context.copy().run(function, *args, **kwargs)
+    return run
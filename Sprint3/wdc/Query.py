@@ -1,7 +1,7 @@
 from typing import List
 
 # Importing user-defined modules
-from wdc.Connection import allCoverages
+from wdc.Catalog import allCoverages
 from wdc.Params import Params
 
 # Specifying the supported return and query types for the queries
@@ -27,6 +27,9 @@ queryTypes = [
     "encode_format"
 ]
 
+# Attributes the text surrounding the parameters of a query depends on
+_TEMPLATE_ATTRIBUTES = ("coverage", "query_type", "return_val", "return_type")
+
 class Query:
     """
     A class used to handle query generation
@@ -75,12 +78,18 @@ class Query:
 
     print_query(self) -> str
         Generates and prints the query based on the provided attributes.
+
+    get_return_type(self) -> str
+        Returns the return type, falling back to the default of the query type.
     
     __str__(self) -> str
-        Returns a string representation of the query.
+        Returns a string representation of the query, cached until it changes.
         
     get_wcps(self) -> str
         Returns the WCPS query string representation of the object.
+
+    get_return_expression(self) -> str
+        Returns the expression following 'return' in the WCPS query.
     """
 
     def __init__(self, coverage: str = None, query_type: str = None, return_val: str = "$c", 
@@ -179,31 +188,57 @@ class Query:
         print(query)
 
 
-    def __str__(self) -> str:
+    def __setattr__(self, name, value):
         """
-        Returns a string representation of the query.
+        Drops the cached WCPS text whenever an attribute it depends on
+        changes, whether through a setter or by direct assignment.
+        """
+        if name in _TEMPLATE_ATTRIBUTES:
+            object.__setattr__(self, "_template", None)
+            object.__setattr__(self, "_wcps", None)
+        elif name == "params":
+            object.__setattr__(self, "_wcps", None)
+        object.__setattr__(self, name, value)
+
+
+    def get_return_type(self) -> str:
+        """
+        Returns the return type of the query, falling back to the default
+        return type of its query type if none was set.
 
         Returns:
         --------
         str
-        A string representation of the query.
+            The return type, or None if the query type has no default.
+        """
+        if self.return_type is not None:
+            return self.return_type
+        if self.query_type in (queryTypes[2], queryTypes[4]):
+            return "text/csv"
+        if self.query_type == queryTypes[3]:
+            return "image/png"
+        return None
+
+
+    def _build_template(self) -> tuple:
+        """
+        Builds the parts of the query surrounding its parameters.
+
+        Returns:
+        --------
+        tuple
+            The text before the parameters, the text after them, and whether
+            the query uses its parameters at all.
         """
         query = ""
         query_prefixes = ['diagram>>', 'image>>']
-        if self.params is not None:
-            params_string = ", ".join([param.get_all_params() for param in self.params])
-        else:
-            params_string = ""
+        return_type = self.get_return_type()
 
         if self.query_type in (queryTypes[2], queryTypes[4]):
             query += query_prefixes[0]
-            if self.return_type is None:
-                self.return_type = "text/csv"
 
         elif self.query_type == queryTypes[3]:
             query += query_prefixes[1]
-            if self.return_type is None:
-                self.return_type = "image/png"
 
         if self.coverage is not None:
             query += "for " + self.return_val + " in ( " + self.coverage + " )"
@@ -211,31 +246,72 @@ class Query:
         else:
             raise ValueError("Error. Invalid coverage was specified")
 
-        return_text = "\n return "
+        query += "\n return "
 
         if self.query_type == "most_basic_query":
-            return_text += "1"
+            return query + "1", "", False
 
         elif self.query_type == "selecting_single_value":
-            return_text += self.return_val + f"[{params_string}]"
+            return query + self.return_val + "[", "]", True
 
         elif self.query_type in ("transform_3d_to_1d_subset", "transform_3d_to_2d_subset"):
-            return_text += f'encode(\n{self.return_val}[{params_string}]\n, "{self.return_type}")'
+            return query + f'encode(\n{self.return_val}[', f']\n, "{return_type}")', True
 
         elif self.query_type == "celsius_to_kelvin":
-            return_text += f'encode(\n{self.return_val}[{params_string}]\n+273.15\n, "{self.return_type}")'
+            return query + f'encode(\n{self.return_val}[', f']\n+273.15\n, "{return_type}")', True
 
         elif self.query_type in ("min", "max", "avg"):
-            return_text += f'\n{self.query_type}({self.return_val}[{params_string}])'
+            return query + f'\n{self.query_type}({self.return_val}[', '])', True
 
         elif self.query_type == "when_temp_more_than_15":
-            return_text += f'count(\n{self.return_val}[{params_string}]\n> 15)'
+            return query + f'count(\n{self.return_val}[', ']\n> 15)', True
 
         else:
             raise ValueError("Error. Unsupported query type")
-    
-        query += return_text
-        return query
+
+
+    def __str__(self) -> str:
+        """
+        Returns a string representation of the query.
+
+        The text is built once and cached. Changing the coverage, query
+        type, return value or return type rebuilds it, while changing only
+        the parameters reuses the cached text surrounding them. Params
+        objects changed in place are only picked up after set_params is
+        called again.
+
+        Returns:
+        --------
+        str
+        A string representation of the query.
+        """
+        if self._wcps is not None:
+            return self._wcps
+
+        if self._template is None:
+            self._template = self._build_template()
+        head, tail, uses_params = self._template
+
+        if not uses_params:
+            self._wcps = head
+        elif self.params is not None:
+            self._wcps = head + ", ".join([param.get_all_params() for param in self.params]) + tail
+        else:
+            self._wcps = head + tail
+        return self._wcps
+
+    def get_return_expression(self) -> str:
+        """
+        Returns the expression following 'return' in the WCPS query, which
+        is used when several queries are fused into one.
+
+        Returns
+        -------
+        str
+            The return expression of the query.
+        """
+
+        return str(self).split("\n return ", 1)[1].strip()
 
     def get_wcps(self) -> str:
         """
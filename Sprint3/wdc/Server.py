@@ -0,0 +1,295 @@
+import argparse
+import random
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Dict, Sequence
+from urllib.parse import parse_qs, urlsplit
+from xml.sax.saxutils import escape
+
+import numpy as np
+
+# Importing user-defined modules
+from wdc.Engine import LocalCoverage, LocalEngine
+
+_CAPABILITIES = """<?xml version="1.0" encoding="UTF-8"?>
+<wcs:Capabilities xmlns:wcs="http://www.opengis.net/wcs/2.0" version="2.1.0">
+  <wcs:Contents>
+{summaries}
+  </wcs:Contents>
+</wcs:Capabilities>"""
+
+_SUMMARY = "    <wcs:CoverageSummary><wcs:CoverageId>{name}</wcs:CoverageId></wcs:CoverageSummary>"
+
+_EXCEPTION = """<?xml version="1.0" encoding="UTF-8"?>
+<ows:ExceptionReport xmlns:ows="http://www.opengis.net/ows/2.0" version="2.0.0">
+  <ows:Exception exceptionCode="{code}"><ows:ExceptionText>{text}</ows:ExceptionText></ows:Exception>
+</ows:ExceptionReport>"""
+
+def demo_cube(resolution: float = 5.0, start_year: int = 2000, end_year: int = 2015) -> LocalCoverage:
+    """
+    Returns a synthetic, deterministic stand-in for the AvgLandTemp coverage
+    of the rasdaman demo server: monthly temperatures in degrees Celsius on
+    a global Lat/Long grid, warmest at the equator and following the seasons
+    of each hemisphere.
+
+    Parameters:
+    -----------
+    resolution : float, optional
+        The size of a cell in degrees. Defaults to 5.
+    start_year : int, optional
+        The first year of the ansi axis. Defaults to 2000.
+    end_year : int, optional
+        The last year of the ansi axis. Defaults to 2015.
+
+    Returns:
+    --------
+    LocalCoverage
+        The coverage with the axes ansi, Lat (descending) and Long.
+    """
+    months = np.arange(f"{start_year}-01", f"{end_year + 1}-01", dtype="datetime64[M]")
+    lat = np.arange(90 - resolution / 2, -90, -resolution)
+    long = np.arange(-180 + resolution / 2, 180, resolution)
+
+    season = np.cos(2 * np.pi * (months.astype(int) % 12 - 6) / 12)[:, None, None]
+    latitude = np.radians(lat)[None, :, None]
+    data = 30 * np.cos(latitude) - 5 + 12 * season * np.sin(latitude) + 2 * np.sin(np.radians(long))[None, None, :]
+    return LocalCoverage(data.round(4).astype(np.float32), ("ansi", "Lat", "Long"),
+                         {"ansi": months, "Lat": lat, "Long": long})
+
+
+class _StandInHandler(BaseHTTPRequestHandler):
+    # Headers and body are written separately, so Nagle's algorithm would add
+    # the delayed ACK timeout of the client to every response
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        self._handle(parse_qs(urlsplit(self.path).query))
+
+    def do_POST(self):
+        fields = parse_qs(urlsplit(self.path).query)
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        fields.update(parse_qs(body.decode("utf-8", "replace")))
+        self._handle(fields)
+
+    def _handle(self, fields: Dict[str, list]):
+        status, content_type, payload = self.server.stand_in._respond(
+            {key.lower(): values[0] for key, values in fields.items()})
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+class StandInServer:
+    """
+    A class running a lightweight WCPS server on localhost, answering
+    queries from in-memory coverages with wdc.LocalEngine.
+
+    It serves GetCapabilities and WCPS queries like the rasdaman endpoint
+    (".../rasdaman/ows"), so dbc, CoverageCatalog and every query API work
+    against it unchanged, without a network. Latency, errors and payload
+    sizes can be injected to load-test and benchmark the transport, the
+    result cache and concurrency. The fault settings are plain attributes
+    and can be changed while the server runs.
+
+    Attributes
+    ----------
+    engine : LocalEngine
+        Executes the queries.
+    url : str
+        The endpoint to pass to dbc, e.g. "http://127.0.0.1:8080/rasdaman/ows".
+    latency : float
+        Seconds every response is delayed by.
+    jitter : float
+        Up to this many seconds are added to the latency at random.
+    error_rate : float
+        Share of the queries answered with `error_status`, from 0 to 1.
+    error_status : int
+        The status code of injected errors.
+    payload_size : int
+        If set, every query is answered with a CSV payload of this many
+        bytes instead of its result.
+
+    Methods
+    -------
+    __init__(self, coverages: Dict[str, LocalCoverage] = None, port: int = 0, latency: float = 0.0,
+             jitter: float = 0.0, error_rate: float = 0.0, error_status: int = 503,
+             payload_size: int = None, seed: int = None)
+        Initializes the server without starting it.
+
+    start(self) -> StandInServer
+        Starts serving on a background thread.
+
+    stop(self)
+        Stops serving and closes the socket.
+
+    stats(self) -> Dict[str, int]
+        Returns the number of requests, queries and injected errors.
+    """
+
+    def __init__(self, coverages: Dict[str, LocalCoverage] = None, port: int = 0, latency: float = 0.0,
+                 jitter: float = 0.0, error_rate: float = 0.0, error_status: int = 503,
+                 payload_size: int = None, seed: int = None):
+        """
+        Initializes the server without starting it.
+
+        Parameters:
+        -----------
+        coverages : Dict[str, LocalCoverage], optional
+            The coverages queries can read from. Defaults to a demo_cube()
+            named AvgLandTemp.
+        port : int, optional
+            The port to listen on. Defaults to 0, meaning any free port.
+        latency : float, optional
+            Seconds every response is delayed by. Defaults to 0.
+        jitter : float, optional
+            Up to this many seconds are added to the latency at random.
+            Defaults to 0.
+        error_rate : float, optional
+            Share of the queries answered with `error_status`. Defaults to 0.
+        error_status : int, optional
+            The status code of injected errors. Defaults to 503.
+        payload_size : int, optional
+            Answers every query with a CSV payload of this many bytes.
+            Defaults to None, meaning the result of the query.
+        seed : int, optional
+            Seeds the jitter and the injected errors. Defaults to None.
+        """
+        if coverages is None:
+            coverages = {"AvgLandTemp": demo_cube()}
+        self.engine = LocalEngine(coverages)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.payload_size = payload_size
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._stats = {"requests": 0, "queries": 0, "errors": 0, "injected_errors": 0}
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), _StandInHandler)
+        self._server.daemon_threads = True
+        self._server.stand_in = self
+        self._thread = None
+        self.url = f"http://127.0.0.1:{self._server.server_port}/rasdaman/ows"
+
+
+    def __enter__(self) -> "StandInServer":
+        return self.start()
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+
+    def __repr__(self) -> str:
+        return f"StandInServer(url={self.url!r}, coverages={self.engine.coverage_names()})"
+
+
+    def start(self) -> "StandInServer":
+        """
+        Starts serving on a background thread.
+        """
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._server.serve_forever,
+                                            name="wdc-stand-in", daemon=True)
+            self._thread.start()
+        return self
+
+
+    def stop(self):
+        """
+        Stops serving and closes the socket.
+        """
+        if self._thread is not None:
+            self._server.shutdown()
+            self._thread = None
+        self._server.server_close()
+
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Returns the number of requests, of WCPS queries among them, of
+        queries that failed, and of errors that were injected.
+        """
+        with self._lock:
+            return dict(self._stats)
+
+
+    def _count(self, *names: str):
+        with self._lock:
+            for name in names:
+                self._stats[name] += 1
+
+
+    def _respond(self, fields: Dict[str, str]) -> tuple:
+        """
+        Returns the status code, content type and body of the response to
+        the fields of a request.
+        """
+        self._count("requests")
+        with self._lock:
+            delay = self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0)
+            fail = self.error_rate > 0 and self._random.random() < self.error_rate
+        if delay > 0:
+            time.sleep(delay)
+
+        if fields.get("request", "").lower() == "getcapabilities":
+            summaries = "\n".join(_SUMMARY.format(name=escape(name)) for name in self.engine.coverage_names())
+            return 200, "application/xml", _CAPABILITIES.format(summaries=summaries).encode()
+
+        query = fields.get("query")
+        if query is None:
+            return self._error(400, "MissingParameterValue", "Error. Expected a WCPS query or GetCapabilities")
+        self._count("queries")
+
+        if fail:
+            self._count("injected_errors")
+            return self._error(self.error_status, "InjectedError", "Error. Injected by the stand-in server")
+        if self.payload_size is not None:
+            payload = b",".join([b"0"] * max((self.payload_size + 1) // 2, 1))
+            return 200, "text/plain", payload.ljust(self.payload_size, b"\n")
+
+        try:
+            return 200, "text/plain", self.engine.execute(query)
+        except ValueError as err:
+            return self._error(400, "WcpsError", str(err))
+        except Exception as exc:
+            return self._error(500, "InternalError", f"Error. {exc}")
+
+
+    def _error(self, status: int, code: str, text: str) -> tuple:
+        self._count("errors")
+        return status, "application/xml", _EXCEPTION.format(code=code, text=escape(text)).encode()
+
+
+def main(argv: Sequence[str] = None):
+    parser = argparse.ArgumentParser(description="Runs a stand-in WCPS server answering from a demo cube.")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds every response is delayed by")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Up to this many seconds of random extra delay")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of queries answered with an error")
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--payload-size", type=int, help="Answer every query with this many bytes")
+    args = parser.parse_args(argv)
+
+    server = StandInServer(port=args.port, latency=args.latency, jitter=args.jitter,
+                           error_rate=args.error_rate, error_status=args.error_status,
+                           payload_size=args.payload_size)
+    print(f"Serving {', '.join(server.engine.coverage_names())} at {server.url}")
+    try:
+        server._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server._server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,254 @@
+import json
+import os
+import shutil
+import uuid
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+# Importing user-defined modules
+from wdc.Engine import LocalCoverage
+
+# The files of a stored coverage, inside its own directory. The data and
+# coordinate files of every version are named after it, and the metadata
+# file names those of the published version
+_DATA_FILE = "data.npy"
+_META_FILE = "coverage.json"
+
+class CoverageStore:
+    """
+    A class keeping coverages on disk as memory-mapped NumPy arrays.
+
+    Every coverage is a directory under the root holding its values in
+    the .npy format, the coordinates of every axis, and a small JSON file
+    naming the axes, bands and files. Coverages are written to new files
+    and published by atomically replacing the JSON file, so readers see
+    either the old or the new coverage. Opened coverages are backed by np.memmap,
+    so only the pages of the cells that are read are loaded, and subsets
+    resolve to index ranges by binary search over the coordinates and
+    return views without copying (see LocalCoverage.subset). A point time
+    series of a large datacube therefore reads a few pages, not the file.
+
+    Attributes
+    ----------
+    root : str
+        The directory holding the coverages.
+
+    Methods
+    -------
+    __init__(self, root: str)
+        Initializes the store, creating the root directory if needed.
+
+    names(self) -> List[str]
+        Returns the names of the stored coverages.
+
+    save(self, name: str, coverage: LocalCoverage) -> LocalCoverage
+        Writes a coverage to the store and returns it memory-mapped.
+
+    create(self, name: str, shape, dtype, axes, coordinates=None, bands=None) -> LocalCoverage
+        Creates an empty coverage on disk, to be filled in place.
+
+    open(self, name: str, writable: bool = False) -> LocalCoverage
+        Opens a stored coverage memory-mapped.
+
+    delete(self, name: str)
+        Removes a coverage from the store.
+    """
+
+    def __init__(self, root: str):
+        """
+        Initializes the store, creating the root directory if needed.
+
+        Parameters:
+        -----------
+        root : str
+            The directory holding the coverages.
+        """
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self._opened: Dict[str, LocalCoverage] = {}
+
+
+    def __contains__(self, name: str) -> bool:
+        return os.path.isfile(os.path.join(self._path(name), _META_FILE))
+
+
+    def __repr__(self) -> str:
+        return f"CoverageStore(root={self.root!r})"
+
+
+    def _path(self, name: str) -> str:
+        if not name or "/" in name or "\\" in name or name.startswith("."):
+            raise ValueError(f"Error. Invalid coverage name: {name!r}")
+        return os.path.join(self.root, name)
+
+
+    def names(self) -> List[str]:
+        """
+        Returns the names of the stored coverages.
+        """
+        return sorted(entry for entry in os.listdir(self.root)
+                      if not entry.startswith(".") and entry in self)
+
+
+    def _write(self, name: str, shape: tuple, dtype, axes: Sequence[str],
+               coordinates: dict, bands: Sequence[str]) -> Tuple[np.memmap, str]:
+        """
+        Writes the coordinates of a new version of a coverage and its
+        metadata to a temporary file, published by _publish, and returns
+        the memory-mapped data file for the caller to fill and the version.
+        """
+        # Checks the name, axes and coordinates before anything is written
+        path = self._path(name)
+        meta = LocalCoverage(np.broadcast_to(np.zeros((), dtype), shape), axes, coordinates, bands)
+        version = uuid.uuid4().hex
+        os.makedirs(path, exist_ok=True)
+
+        files = {}
+        for number, axis in enumerate(meta.axes):
+            files[axis] = f"axis{number}.{version}.npy"
+            np.save(os.path.join(path, files[axis]), meta.coordinates[axis])
+        data_file = f"data.{version}.npy"
+        with open(os.path.join(path, f"{_META_FILE}.{version}.tmp"), "w") as file:
+            json.dump({"axes": list(meta.axes), "bands": list(bands) if bands else None,
+                       "coordinates": files, "data": data_file}, file)
+
+        data = np.lib.format.open_memmap(os.path.join(path, data_file), mode="w+", dtype=dtype, shape=shape)
+        return data, version
+
+
+    def _publish(self, name: str, version: str):
+        """
+        Replaces the metadata of a coverage with that of a version written
+        by _write, and removes the files of the version it replaced.
+        """
+        path = self._path(name)
+        meta_path = os.path.join(path, _META_FILE)
+        replaced = []
+        if os.path.isfile(meta_path):
+            with open(meta_path) as file:
+                meta = json.load(file)
+            replaced = [meta.get("data", _DATA_FILE)] + list(meta["coordinates"].values())
+
+        os.replace(f"{meta_path}.{version}.tmp", meta_path)
+        self._opened.pop(name, None)
+        for file_name in replaced:
+            try:
+                os.remove(os.path.join(path, file_name))
+            except OSError:
+                # E.g. still memory-mapped on Windows
+                pass
+
+
+    def save(self, name: str, coverage: LocalCoverage) -> LocalCoverage:
+        """
+        Writes a coverage to the store, replacing a stored coverage with the
+        same name, and returns it memory-mapped.
+
+        Parameters:
+        -----------
+        name : str
+            The name of the coverage, e.g. "AvgLandTemp".
+        coverage : LocalCoverage
+            The coverage to store.
+
+        Returns:
+        --------
+        LocalCoverage
+            The stored coverage, backed by the file.
+        """
+        data, version = self._write(name, coverage.data.shape, coverage.data.dtype, coverage.axes,
+                                    coverage.coordinates, coverage.bands)
+        data[...] = coverage.data
+        data.flush()
+        del data
+        self._publish(name, version)
+        return self.open(name)
+
+
+    def create(self, name: str, shape: Sequence[int], dtype, axes: Sequence[str],
+               coordinates: dict = None, bands: Sequence[str] = None) -> LocalCoverage:
+        """
+        Creates a coverage on disk filled with zeros, to be filled in place,
+        e.g. tile by tile, without ever holding it in memory.
+
+        Parameters:
+        -----------
+        name : str
+            The name of the coverage.
+        shape : Sequence[int]
+            The number of cells along every axis (and the number of bands).
+        dtype : data-type
+            The type of the values, e.g. np.float32.
+        axes : Sequence[str]
+            The names of the axes.
+        coordinates : dict, optional
+            The coordinates of the cells by axis. Defaults to None.
+        bands : Sequence[str], optional
+            The names of the bands. Defaults to None.
+
+        Returns:
+        --------
+        LocalCoverage
+            The coverage, backed by a writable memory map.
+        """
+        data, version = self._write(name, tuple(shape), np.dtype(dtype), axes, coordinates, bands)
+        del data
+        self._publish(name, version)
+        return self.open(name, writable=True)
+
+
+    def open(self, name: str, writable: bool = False) -> LocalCoverage:
+        """
+        Opens a stored coverage memory-mapped. Read-only coverages are opened
+        once and shared.
+
+        Parameters:
+        -----------
+        name : str
+            The name of the coverage.
+        writable : bool, optional
+            Whether changes to the data are written to the file.
+            Defaults to False.
+
+        Returns:
+        --------
+        LocalCoverage
+            The coverage, whose data is an np.memmap.
+
+        Raises:
+        -------
+        ValueError
+            If the store holds no coverage with that name.
+        """
+        if not writable and name in self._opened:
+            return self._opened[name]
+
+        path = self._path(name)
+        if name not in self:
+            raise ValueError(f"Error. Unknown coverage: {name}")
+        with open(os.path.join(path, _META_FILE)) as file:
+            meta = json.load(file)
+
+        data = np.load(os.path.join(path, meta.get("data", _DATA_FILE)), mmap_mode="r+" if writable else "r")
+        coordinates = {axis: np.load(os.path.join(path, file_name))
+                       for axis, file_name in meta["coordinates"].items()}
+        coverage = LocalCoverage(data, meta["axes"], coordinates, meta["bands"])
+        if not writable:
+            self._opened[name] = coverage
+        return coverage
+
+
+    def delete(self, name: str):
+        """
+        Removes a coverage from the store.
+
+        Parameters:
+        -----------
+        name : str
+            The name of the coverage.
+        """
+        if name not in self:
+            raise ValueError(f"Error. Unknown coverage: {name}")
+        self._opened.pop(name, None)
+        shutil.rmtree(self._path(name))
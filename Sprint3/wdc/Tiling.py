@@ -0,0 +1,426 @@
+import copy
+import math
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Dict, List, Sequence, Tuple, Union
+
+import numpy as np
+
+try:
+    from PIL import Image
+except ImportError:
+    # Pillow is only needed to assemble image results
+    Image = None
+
+# Importing user-defined modules
+from wdc.Connection import QueryError
+from wdc.Decode import ImageResult, decode_result, imageTypes
+from wdc.Params import Params
+from wdc.Policy import bind_context
+
+# Tiles hold at most this many cells unless a plan asks for another size
+DEFAULT_TILE_CELLS = 250_000
+
+class AxisGrid:
+    """
+    A class describing the regular grid of one axis of a coverage: the
+    coordinate of its first cell and the distance between two cells.
+
+    Attributes
+    ----------
+    origin : Union[int, float, np.datetime64]
+        The coordinate of the first cell of the axis.
+    resolution : Union[int, float, np.timedelta64]
+        The distance from one cell to the next, negative for axes stored in
+        descending order such as Lat.
+    size : int
+        The number of cells of the axis, or None if unknown.
+
+    Methods
+    -------
+    __init__(self, origin, resolution, size: int = None)
+        Initializes the grid of an axis.
+
+    from_coordinates(cls, coordinates) -> AxisGrid
+        Returns the grid of an axis from the coordinates of its cells.
+
+    cells(self, start_val, end_val) -> Tuple[int, int]
+        Returns the first and last index of the cells within a subset.
+
+    coordinate(self, index: int)
+        Returns the coordinate of a cell.
+    """
+
+    def __init__(self, origin, resolution, size: int = None):
+        """
+        Initializes the grid of an axis.
+
+        Parameters:
+        -----------
+        origin : Union[int, float, str]
+            The coordinate of the first cell. Date strings such as
+            "2000-01" are parsed into datetime64.
+        resolution : Union[int, float, np.timedelta64]
+            The distance between two cells, negative for descending axes.
+            Time axes take a timedelta64, e.g. np.timedelta64(1, "M").
+        size : int, optional
+            The number of cells of the axis. Defaults to None.
+        """
+        self.origin = np.datetime64(origin) if isinstance(origin, str) else origin
+        self.resolution = resolution
+        self.size = size
+        if not self.resolution:
+            raise ValueError("Error. The resolution of an axis cannot be 0")
+
+
+    def __repr__(self) -> str:
+        return f"AxisGrid(origin={self.origin!r}, resolution={self.resolution!r}, size={self.size})"
+
+
+    @classmethod
+    def from_coordinates(cls, coordinates) -> "AxisGrid":
+        """
+        Returns the grid of an axis from the coordinates of its cells, e.g.
+        those of a wdc.LocalCoverage.
+        """
+        coordinates = np.asarray(coordinates)
+        if coordinates.dtype.kind in ("U", "S"):
+            coordinates = coordinates.astype("datetime64")
+        if len(coordinates) < 2:
+            raise ValueError("Error. The resolution of an axis needs at least two coordinates")
+        return cls(coordinates[0], coordinates[1] - coordinates[0], len(coordinates))
+
+
+    @property
+    def is_time(self) -> bool:
+        return isinstance(self.origin, np.datetime64)
+
+
+    def _value(self, value):
+        return np.datetime64(value) if self.is_time else value
+
+
+    def cells(self, start_val, end_val) -> Tuple[int, int]:
+        """
+        Returns the first and last index of the cells whose coordinates lie
+        within a subset, in the order the axis is stored.
+
+        Parameters:
+        -----------
+        start_val : Union[str, int, float]
+            The start of the subset.
+        end_val : Union[str, int, float]
+            The end of the subset.
+
+        Returns:
+        --------
+        Tuple[int, int]
+            The indices of the first and last cell.
+        """
+        low, high = sorted((self._value(start_val), self._value(end_val)))
+        first, last = (low, high) if self.resolution > 0 else (high, low)
+        # The tolerance keeps cells lying exactly on a bound despite rounding
+        first = max(math.ceil((first - self.origin) / self.resolution - 1e-9), 0)
+        last = math.floor((last - self.origin) / self.resolution + 1e-9)
+        if self.size is not None:
+            last = min(last, self.size - 1)
+        if first > last:
+            raise ValueError(f"Error. The subset {start_val}:{end_val} contains no cells")
+        return first, last
+
+
+    def coordinate(self, index: int):
+        """
+        Returns the coordinate of a cell.
+        """
+        return self.origin + index * self.resolution
+
+
+    def bounds(self, first: int, last: int, start_val, end_val) -> Tuple:
+        """
+        Returns subset bounds selecting exactly the cells first to last.
+
+        Numeric bounds lie a quarter cell outside the outer cells, which
+        selects the same cells whether the server matches cell centres or
+        cell areas, and are clipped to the original subset. Time axes are
+        matched exactly, so their bounds are the dates of the outer cells.
+        """
+        low, high = sorted((self.coordinate(first), self.coordinate(last)))
+        if self.is_time:
+            unit = np.datetime_data(np.asarray(self.origin).dtype)[0]
+            return (np.datetime_as_string(low, unit=unit), np.datetime_as_string(high, unit=unit))
+
+        margin = abs(self.resolution) / 4
+        start_val, end_val = sorted((start_val, end_val))
+        return (max(float(low - margin), start_val), min(float(high + margin), end_val))
+
+
+class Tile:
+    """
+    A class holding one tile of a plan: the subsets selecting it and its
+    position among the tiles.
+
+    Attributes
+    ----------
+    params : List[Params]
+        The subsets of the tile, including the slices of the original query.
+    position : Tuple[int, ...]
+        The index of the tile along every kept axis of the plan.
+    shape : Tuple[int, ...]
+        The planned number of cells along every kept axis, -1 if unknown.
+    """
+
+    def __init__(self, params: List[Params], position: Tuple[int, ...], shape: Tuple[int, ...]):
+        self.params = params
+        self.position = position
+        self.shape = shape
+
+
+    def __repr__(self) -> str:
+        return f"Tile({', '.join(str(param) for param in self.params)})"
+
+
+class TilePlan:
+    """
+    A class holding the tiles a large subset is split into.
+
+    Attributes
+    ----------
+    axes : Tuple[str, ...]
+        The axes kept by the subset (those with a range), in result order.
+    counts : Tuple[int, ...]
+        The number of tiles along every kept axis.
+    shape : Tuple[int, ...]
+        The planned number of cells along every kept axis, -1 if unknown.
+    tiles : List[Tile]
+        The tiles, in row-major order of their positions.
+    """
+
+    def __init__(self, axes: Tuple[str, ...], counts: Tuple[int, ...],
+                 shape: Tuple[int, ...], tiles: List[Tile]):
+        self.axes = axes
+        self.counts = counts
+        self.shape = shape
+        self.tiles = tiles
+
+
+    def __len__(self) -> int:
+        return len(self.tiles)
+
+
+    def __repr__(self) -> str:
+        return f"TilePlan(axes={self.axes}, counts={self.counts}, shape={self.shape})"
+
+
+def plan_tiles(params: Sequence[Params], grids: Dict[str, AxisGrid],
+               max_cells: int = DEFAULT_TILE_CELLS, split_axes: Sequence[str] = None,
+               axes: Sequence[str] = None) -> TilePlan:
+    """
+    Splits a subset into tiles of at most `max_cells` cells.
+
+    The number of cells along every axis follows from the grid of the axis,
+    so tiles are planned in cells rather than in degrees or dates, and their
+    bounds select whole cells without gaps or overlaps. The axis with the
+    most cells per tile is halved until a tile is small enough.
+
+    Results come back with their dimensions in the axis order of the
+    coverage, whatever the order of the params, so the plan follows the
+    order of `axes`, or else the order of `grids`.
+
+    Parameters:
+    -----------
+    params : Sequence[Params]
+        The subsets of the query, e.g. [Params("ansi", "2000-01", "2015-12"),
+        Params("Lat", -90, 90), Params("Long", -180, 180)].
+    grids : Dict[str, AxisGrid]
+        The grid of the axes by name. Axes without a grid are never split
+        and do not count towards the size of a tile.
+    max_cells : int, optional
+        The maximum number of cells of a tile. Defaults to 250000.
+    split_axes : Sequence[str], optional
+        The axes that may be split. Defaults to every axis with a grid.
+    axes : Sequence[str], optional
+        The axes of the coverage in their order, e.g. LocalCoverage.axes.
+        Defaults to the order of the keys of `grids`.
+
+    Returns:
+    --------
+    TilePlan
+        The tiles.
+    """
+    if max_cells < 1:
+        raise ValueError("Error. A tile must hold at least one cell")
+
+    ranges = [param for param in params if param.end_val is not None]
+    slices = [param for param in params if param.end_val is None]
+    names = [param.param for param in ranges]
+    if len(set(names)) != len(names):
+        raise ValueError("Error. Every axis can only be subset once")
+
+    order = list(axes if axes is not None else grids)
+    if len(ranges) > 1:
+        unknown = [name for name in names if name not in order]
+        if unknown:
+            raise ValueError(f"Error. The position of axis {unknown[0]} in the coverage is unknown; "
+                             f"please pass the axes of the coverage")
+        ranges.sort(key=lambda param: order.index(param.param))
+    axes = tuple(param.param for param in ranges)
+
+    cells = []
+    for param in ranges:
+        grid = grids.get(param.param)
+        cells.append(grid.cells(param.start_val, param.end_val) if grid is not None else None)
+
+    splittable = set(axes if split_axes is None else split_axes)
+    sizes = [span[1] - span[0] + 1 if span is not None else None for span in cells]
+    chunks = list(sizes)
+    while math.prod(chunk for chunk in chunks if chunk) > max_cells:
+        candidates = [index for index, chunk in enumerate(chunks)
+                      if chunk and chunk > 1 and axes[index] in splittable]
+        if not candidates:
+            break
+        widest = max(candidates, key=lambda index: chunks[index])
+        chunks[widest] = math.ceil(chunks[widest] / 2)
+
+    # The cell ranges of the tiles along every axis
+    spans = []
+    for param, span, chunk in zip(ranges, cells, chunks):
+        if span is None:
+            spans.append([None])
+            continue
+        first, last = span
+        spans.append([(start, min(start + chunk - 1, last)) for start in range(first, last + 1, chunk)])
+
+    tiles = []
+    for position in np.ndindex(*[len(axis_spans) for axis_spans in spans]):
+        tile_params = []
+        shape = []
+        for param, axis_spans, index in zip(ranges, spans, position):
+            span = axis_spans[index]
+            if span is None:
+                tile_params.append(param)
+                shape.append(-1)
+                continue
+            grid = grids[param.param]
+            start_val, end_val = grid.bounds(span[0], span[1], param.start_val, param.end_val)
+            tile_params.append(Params(param.param, start_val, end_val))
+            shape.append(span[1] - span[0] + 1)
+        tiles.append(Tile(tile_params + slices, tuple(position), tuple(shape)))
+
+    return TilePlan(axes, tuple(len(axis_spans) for axis_spans in spans),
+                    tuple(size if size is not None else -1 for size in sizes), tiles)
+
+
+def _tile_query(query, tile: Tile):
+    if callable(query):
+        return query(tile.params)
+    if not hasattr(query, "params"):
+        raise ValueError("Error. Tiled queries must be wdc.Query objects or functions building them")
+    tile_query = copy.copy(query)
+    tile_query.params = tile.params
+    return tile_query
+
+
+def _decode_tile(payload: bytes, tile_query, tile: Tile, return_type: str, dtype) -> np.ndarray:
+    if return_type in imageTypes:
+        return ImageResult(payload).to_array()
+    values = decode_result(payload, query=tile_query if getattr(tile_query, "params", None) else None,
+                           return_type=return_type, dtype=dtype)
+    # A tile of a single cell per axis comes back as a scalar
+    if values.ndim < len(tile.shape) and -1 not in tile.shape:
+        values = values.reshape(tile.shape)
+    return values
+
+
+def _mosaic(plan: TilePlan, results: Dict[Tuple[int, ...], np.ndarray]) -> np.ndarray:
+    """
+    Places the tiles of a plan next to each other. The sizes of the tiles
+    are taken from their results, not from the plan.
+    """
+    ndim = len(plan.axes)
+    first = results[(0,) * ndim]
+    offsets = []
+    for dimension, count in enumerate(plan.counts):
+        sizes = [results[tuple(index if axis == dimension else 0 for axis in range(ndim))].shape[dimension]
+                 for index in range(count)]
+        offsets.append(np.concatenate(([0], np.cumsum(sizes))))
+
+    shape = tuple(int(axis_offsets[-1]) for axis_offsets in offsets) + first.shape[ndim:]
+    mosaic = np.empty(shape, dtype=np.result_type(*results.values()))
+    for position, values in results.items():
+        key = tuple(slice(int(axis_offsets[index]), int(axis_offsets[index + 1]))
+                    for axis_offsets, index in zip(offsets, position))
+        if values.shape[:ndim] != tuple(block.stop - block.start for block in key):
+            raise ValueError(f"Error. The tile at {position} does not line up with its neighbours")
+        mosaic[key] = values
+    return mosaic
+
+
+def fetch_tiles(conn, query, plan: TilePlan, workers: int = None,
+                progress: Callable[[int, int], None] = None,
+                dtype=None) -> Union[np.ndarray, "Image.Image"]:
+    """
+    Fetches the tiles of a plan concurrently and reassembles them.
+
+    Parameters:
+    -----------
+    conn : wdc.dbc
+        The connection executing the tile queries.
+    query : Union[wdc.Query, Callable[[List[Params]], Query]]
+        A query whose params are replaced by those of every tile, or a
+        function returning the query of a tile from its params, e.g.
+        `lambda params: cube[tuple(params)]` for a wdc.Datacube.
+    plan : TilePlan
+        The tiles, see plan_tiles.
+    workers : int, optional
+        Number of tiles fetched at the same time. Defaults to the
+        concurrency of the connection.
+    progress : Callable[[int, int], None], optional
+        Called with the number of tiles done and the number of tiles after
+        every tile, e.g. to drive a progress bar. Defaults to None.
+    dtype : numpy dtype, optional
+        The type of the values of numeric results. Defaults to None.
+
+    Returns:
+    --------
+    Union[np.ndarray, PIL.Image.Image]
+        The values of the whole subset, dimensions in the order of its
+        kept axes, or one mosaic image for image/png and image/jpeg tiles.
+
+    Raises:
+    -------
+    QueryError
+        If a tile could not be fetched. The remaining tiles are cancelled.
+    """
+    tile_queries = [_tile_query(query, tile) for tile in plan.tiles]
+    return_type = tile_queries[0].get_return_type() if hasattr(tile_queries[0], "get_return_type") else None
+    if return_type in imageTypes and len(plan.axes) != 2:
+        raise ValueError("Error. Only subsets with two kept axes can be mosaicked into an image")
+
+    def run(index: int) -> np.ndarray:
+        payload = conn.execute_query_bytes(tile_queries[index])
+        try:
+            return _decode_tile(payload, tile_queries[index], plan.tiles[index], return_type, dtype)
+        except ValueError as err:
+            raise QueryError(str(err), query=str(tile_queries[index])) from err
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=workers or getattr(conn, "concurrency", None) or 4,
+                            thread_name_prefix="wdc-tiles") as executor:
+        run = bind_context(run)
+        futures = {executor.submit(run, index): tile for index, tile in enumerate(plan.tiles)}
+        try:
+            for future in as_completed(futures):
+                results[futures[future].position] = future.result()
+                if progress is not None:
+                    progress(len(results), len(plan.tiles))
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+
+    mosaic = _mosaic(plan, results)
+    if return_type in imageTypes:
+        if Image is None:
+            raise ValueError("Error. Assembling images needs Pillow")
+        return Image.fromarray(mosaic)
+    return mosaic
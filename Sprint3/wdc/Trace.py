@@ -0,0 +1,295 @@
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional
+
+# The span of the operation running in the current thread or task
+_current_span = contextvars.ContextVar("wdc_span", default=None)
+
+# Replaced, never mutated, so readers need no lock
+_hooks = ()
+_hooks_lock = threading.Lock()
+
+class Span:
+    """
+    A class recording the duration and attributes of one operation, e.g.
+    of one query, in the style of an OpenTelemetry span.
+
+    The phases of the operation are recorded as children: every query span
+    of dbc has a child for each phase that took place, named
+        build        Generating the WCPS text (e.g. Query.__str__)
+        connect      Resolving the host and opening a TCP connection
+        tls          The TLS handshake
+        server_wait  From sending the request to the first response byte
+        transfer     Receiving the response body
+        decode       Decoding the result, e.g. into a NumPy array
+        retry_wait   Waiting before a retry
+        execute      Running the query on a local engine
+    and the attributes query_type, coverage, bytes, attempts, cache
+    ("hit" or "miss"), shared (the result of an identical query in flight
+    was used) and error (the type of the exception that ended it).
+
+    Attributes
+    ----------
+    name : str
+        The name of the operation, "wdc.query" for queries.
+    attributes : Dict
+        Describe the operation.
+    start : float
+        time.perf_counter() when the operation started.
+    end : float
+        time.perf_counter() when the operation ended, or None while it runs.
+    children : List[Span]
+        The phases of the operation and the operations it started.
+    parent : Span
+        The span of the operation that started this one, or None.
+
+    Methods
+    -------
+    __init__(self, name: str, attributes: Dict = None, parent: Span = None, start: float = None)
+        Initializes a running span.
+
+    add_child(self, name: str, start: float, end: float) -> Span
+        Records a finished phase of the operation.
+
+    timings(self) -> Dict[str, float]
+        Returns the total seconds spent in every phase.
+
+    to_dict(self) -> Dict
+        Returns the span and its children as plain data, e.g. for JSON.
+    """
+
+    __slots__ = ("name", "attributes", "start", "end", "children", "parent")
+
+    def __init__(self, name: str, attributes: Dict = None, parent: "Span" = None, start: float = None):
+        """
+        Initializes a running span.
+
+        Parameters:
+        -----------
+        name : str
+            The name of the operation.
+        attributes : Dict, optional
+            Describe the operation. Defaults to no attributes.
+        parent : Span, optional
+            The span of the operation that started this one. Defaults to None.
+        start : float, optional
+            time.perf_counter() when the operation started. Defaults to now.
+        """
+        self.name = name
+        self.attributes = attributes if attributes is not None else {}
+        self.parent = parent
+        self.start = time.perf_counter() if start is None else start
+        self.end = None
+        self.children = []
+
+
+    def __repr__(self) -> str:
+        duration = "running" if self.end is None else f"{self.duration * 1000:.3f} ms"
+        return f"Span({self.name!r}, {duration}, {self.attributes})"
+
+
+    @property
+    def duration(self) -> Optional[float]:
+        """
+        The seconds the operation took, or None while it runs.
+        """
+        return None if self.end is None else self.end - self.start
+
+
+    def add_child(self, name: str, start: float, end: float) -> "Span":
+        """
+        Records a finished phase of the operation.
+
+        Parameters:
+        -----------
+        name : str
+            The name of the phase, e.g. "transfer".
+        start : float
+            time.perf_counter() when the phase started.
+        end : float
+            time.perf_counter() when the phase ended.
+
+        Returns:
+        --------
+        Span
+            The finished span of the phase.
+        """
+        child = Span(name, parent=self, start=start)
+        child.end = end
+        self.children.append(child)
+        return child
+
+
+    def timings(self) -> Dict[str, float]:
+        """
+        Returns the total seconds spent in every phase, summing phases that
+        took place more than once, e.g. the server_wait of every attempt.
+        The total duration is listed as "total".
+        """
+        timings = {}
+        for child in self.children:
+            if child.end is not None:
+                timings[child.name] = timings.get(child.name, 0.0) + child.duration
+        if self.end is not None:
+            timings["total"] = self.duration
+        return timings
+
+
+    def to_dict(self) -> Dict:
+        """
+        Returns the span and its children as plain data, e.g. for JSON.
+        Times are in seconds relative to the start of this span.
+        """
+        def describe(span: Span) -> Dict:
+            return {
+                "name": span.name,
+                "start": span.start - self.start,
+                "duration": span.duration,
+                "attributes": dict(span.attributes),
+                "children": [describe(child) for child in span.children],
+            }
+        return describe(self)
+
+
+def add_hook(hook: Callable[[Span], None]):
+    """
+    Registers a function called with every span that ends, e.g. the span
+    of every query, in the thread that ran the operation.
+
+    Spans are only recorded while a hook is registered or a span is
+    running, so instrumentation costs nothing otherwise. Hooks should be
+    quick; exceptions they raise are ignored.
+
+    Parameters:
+    -----------
+    hook : Callable[[Span], None]
+        Called with the finished span.
+    """
+    global _hooks
+    with _hooks_lock:
+        _hooks = _hooks + (hook,)
+
+
+def remove_hook(hook: Callable[[Span], None]):
+    """
+    Unregisters a function registered with add_hook.
+    """
+    global _hooks
+    with _hooks_lock:
+        hooks = list(_hooks)
+        hooks.remove(hook)
+        _hooks = tuple(hooks)
+
+
+def current_span() -> Optional[Span]:
+    """
+    Returns the span of the operation running in the current thread or
+    task, or None.
+    """
+    return _current_span.get()
+
+
+def start_span(name: str, attributes: Dict = None) -> Optional[Span]:
+    """
+    Starts a span and makes it the current span, if spans are recorded.
+
+    Parameters:
+    -----------
+    name : str
+        The name of the operation.
+    attributes : Dict, optional
+        Describe the operation.
+
+    Returns:
+    --------
+    Optional[Span]
+        The running span, or None if no hook is registered and no span is
+        running. Pass it to end_span either way.
+    """
+    parent = _current_span.get()
+    if parent is None and not _hooks:
+        return None
+    span = Span(name, attributes, parent=parent)
+    if parent is not None:
+        parent.children.append(span)
+    _current_span.set(span)
+    return span
+
+
+def end_span(span: Optional[Span], error: BaseException = None):
+    """
+    Ends a span started with start_span, restores the previous current
+    span and passes the span to the hooks.
+
+    Parameters:
+    -----------
+    span : Optional[Span]
+        The span, or None if start_span did not record one.
+    error : BaseException, optional
+        The exception that ended the operation, recorded as the attribute
+        error. Defaults to None.
+    """
+    if span is None:
+        return
+    span.end = time.perf_counter()
+    if error is not None:
+        span.attributes["error"] = type(error).__name__
+    if _current_span.get() is span:
+        _current_span.set(span.parent)
+    for hook in _hooks:
+        try:
+            hook(span)
+        except Exception:
+            pass
+
+
+@contextmanager
+def span(name: str, **attributes) -> Iterator[Optional[Span]]:
+    """
+    Records the block as a span. Queries sent in the block are recorded as
+    its children, even without a hook, so a slow notebook cell can be
+    wrapped to see where its time goes.
+
+    Parameters:
+    -----------
+    name : str
+        The name of the operation.
+    **attributes
+        Describe the operation.
+    """
+    parent = _current_span.get()
+    current = Span(name, attributes, parent=parent)
+    if parent is not None:
+        parent.children.append(current)
+    _current_span.set(current)
+    try:
+        yield current
+    except BaseException as exc:
+        end_span(current, exc)
+        raise
+    end_span(current)
+
+
+@contextmanager
+def collect_spans(name: str = None) -> Iterator[List[Span]]:
+    """
+    Collects the spans that end in the block, from every thread.
+
+    Parameters:
+    -----------
+    name : str, optional
+        Only collect spans of this name, e.g. "wdc.query". Defaults to all.
+    """
+    spans = []
+
+    def hook(finished: Span):
+        if name is None or finished.name == name:
+            spans.append(finished)
+
+    add_hook(hook)
+    try:
+        yield spans
+    finally:
+        remove_hook(hook)
@@ -1,3 +1,19 @@
 from .Connection import *
+from .Cache import *
+from .Catalog import *
+from .Decode import *
 from .Params import *
-from .Query import *
\ No newline at end of file
+from .Query import *
+from .Fusion import *
+from .Datacube import *
+from .Optimizer import *
+from .Parser import *
+from .Engine import *
+from .Store import *
+from .Tiling import *
+from .Aggregate import *
+from .Policy import *
+from .Server import *
+from .Trace import *
+from .Metrics import *
+from .Events import *
\ No newline at end of file